@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import argparse
+import subprocess
+import timeit
+from CardConvert import util
+from benchmarks import synthetic
+
+logger = logging.getLogger('CardConvert.benchmarks')
+
+
+def git_commit():
+    """
+    Function to get the commit the benchmark runs on.
+    Returns:
+        str: commit sha or None outside of a git checkout
+    """
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        stdout_value, stderr_value = proc.communicate()
+    except OSError:
+        return None
+    return stdout_value.strip() if proc.returncode == 0 else None
+
+
+def time_call(func, repeat=1):
+    """
+    Function to time a call, the best of repeat runs is kept.
+    Args:
+        func (function): function to call
+        repeat (int): number of runs
+    Returns:
+        seconds (float): best wall time
+        result: what the last call returned
+    """
+    best = None
+    result = None
+    for run in range(repeat):
+        start = timeit.default_timer()
+        result = func()
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def time_tasks(instance, output_dir):
+    """
+    Function to run the tasks of a card serially and time each of them (see BasicCard.task_graph).
+    Args:
+        instance (obj): card instance
+        output_dir (str): path to write to
+    Returns:
+        dict: seconds by task name, or the error if a task failed
+    """
+    timings = {}
+    for name, func, dependencies in instance.task_graph(output_dir):
+        start = timeit.default_timer()
+        try:
+            func()
+        except Exception as err:
+            timings[name] = {'error': str(err)}
+            break
+        timings[name] = timeit.default_timer() - start
+    return timings
+
+
+def run(args):
+    """
+    Function to run the suite.
+    Args:
+        args (argparse.Namespace): parsed command line
+    Returns:
+        dict: results
+    """
+    config = util.load_config()
+    if args.image_engine:
+        config['image_engine'] = args.image_engine
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cardconvert_bench_')
+    input_path = os.path.join(workdir, 'input')
+    params = {'cards': args.cards, 'locales': args.locales, 'frames': args.frames, 'size': [args.width, args.height],
+              'cardbacks': args.cardbacks, 'heroes': args.heroes, 'processes': args.processes,
+              'repeat': args.repeat}
+    results = {'commit': git_commit(), 'timestamp': time.time(), 'python': platform.python_version(),
+               'host': platform.node(), 'params': params,
+               'config': {'image_engine': config.get('image_engine'), 'link_mode': config.get('link_mode')},
+               'timings': {}}
+    timings = results['timings']
+    try:
+        logger.info('Generating synthetic tree in %s' % input_path)
+        timings['generate'], results['tree'] = time_call(
+            lambda: synthetic.make_tree(input_path, config, cards=args.cards, locales=args.locales,
+                                        frames=args.frames, size=(args.width, args.height),
+                                        cardbacks=args.cardbacks, heroes=args.heroes))
+        card_types = ['cards', 'cardbacks', 'heroes']
+        timings['get_card_instances'], instances = time_call(
+            lambda: util.get_card_instances(card_types, config, input_path), repeat=args.repeat)
+
+        timings['tasks'] = {}
+        for card_type in card_types:
+            candidates = [instance for instance in instances if instance.card_class == card_type]
+            animated = [instance for instance in candidates if instance.input_files()[1]]
+            if candidates:
+                output_path = os.path.join(workdir, 'tasks_output')
+                timings['tasks'][card_type] = time_tasks((animated or candidates)[0], output_path)
+                shutil.rmtree(output_path, ignore_errors=True)
+
+        def execute_pool():
+            output_path = os.path.join(workdir, 'pool_output')
+            shutil.rmtree(output_path, ignore_errors=True)
+            return util.execute_pool(card_types, config, input_path, output_path, processes=args.processes,
+                                     force=True)
+
+        timings['execute_pool'] = time_call(execute_pool, repeat=args.repeat)[0]
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def flatten(timings, prefix=''):
+    """
+    Function to flatten nested timings into {'a.b': seconds}.
+    Args:
+        timings (dict): timings
+        prefix (str): key prefix
+    Returns:
+        dict
+    """
+    flat = {}
+    for key, value in timings.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, '%s%s.' % (prefix, key)))
+        elif isinstance(value, (int, float)):
+            flat['%s%s' % (prefix, key)] = value
+    return flat
+
+
+def compare(baseline_path, current_path, threshold):
+    """
+    Function to compare two result files and print the ratio of every timing.
+    Args:
+        baseline_path (str): results of the reference commit
+        current_path (str): results to check
+        threshold (float): ratio above which a timing is a regression
+    Returns:
+        int: number of regressions
+    """
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+    with open(current_path) as handle:
+        current = json.load(handle)
+    if baseline.get('params') != current.get('params'):
+        print 'Warning: the runs have different params, the comparison may be meaningless'
+    baseline_timings = flatten(baseline['timings'])
+    current_timings = flatten(current['timings'])
+    regressions = 0
+    print '%-40s %12s %12s %8s' % ('timing', 'baseline', 'current', 'ratio')
+    for key in sorted(set(baseline_timings) & set(current_timings)):
+        ratio = current_timings[key] / baseline_timings[key] if baseline_timings[key] else float('inf')
+        flag = ''
+        if ratio > threshold and key != 'generate':
+            flag = ' REGRESSION'
+            regressions += 1
+        print '%-40s %12.4f %12.4f %8.2f%s' % (key, baseline_timings[key], current_timings[key], ratio, flag)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark CardConvert on a synthetic Unity export tree.')
+    parser.add_argument('--cards', type=int, default=20, help='Number of cards per locale')
+    parser.add_argument('--locales', type=int, default=2, help='Number of locales')
+    parser.add_argument('--frames', type=int, default=8, help='Number of frames of an animated card')
+    parser.add_argument('--width', type=int, default=256, help='Width of the images')
+    parser.add_argument('--height', type=int, default=388, help='Height of the images')
+    parser.add_argument('--cardbacks', type=int, default=2, help='Number of cardbacks')
+    parser.add_argument('--heroes', type=int, default=2, help='Number of heroes')
+    parser.add_argument('-p', '--processes', type=int, default=4, help='Number of procs of the pool')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per timing, the best one is kept')
+    parser.add_argument('--image-engine', choices=['pillow', 'imagemagick'], help='Override image_engine of the config')
+    parser.add_argument('--workdir', help='Folder for the tree and outputs, a temp folder by default')
+    parser.add_argument('--keep', action='store_true', help='Keep the temp folder')
+    parser.add_argument('-o', '--output', help='Write the results to this json file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two result files')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Ratio flagged as a regression by --compare')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(args.compare[0], args.compare[1], args.threshold) else 0
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=1, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print
+    return 0
@@ -0,0 +1,134 @@
+import os
+import re
+import logging
+import numpy
+from PIL import Image
+
+logger = logging.getLogger('CardConvert.benchmarks')
+
+# frame name patterns tried, in order, to find one the crawler splits back into the card name
+FRAME_NAME_FORMATS = ('%s_%02d', '%s_%d', '%s.%d')
+
+
+def frame_name(name, index, frame_re):
+    """
+    Function to get the name of an animation frame that the crawler maps back to its card with frame_re.
+    Args:
+        name (str): card name
+        index (int): frame index
+        frame_re (str): regex expression to delimit frame counter (see CardConvert.yaml)
+    Returns:
+        str: frame name without extension or None if no name format works for this index
+    """
+    for format_ in FRAME_NAME_FORMATS:
+        header = format_ % (name, index)
+        if re.split(frame_re, header)[0] == name:
+            return header
+    return None
+
+
+def make_image(size, seed, alpha=True):
+    """
+    Function to make a synthetic card image: gradients and noise so the encoders have something to work on.
+    Args:
+        size (tuple): (width, height)
+        seed (int): random seed
+        alpha (bool): make the border transparent like the card exports
+    Returns:
+        PIL.Image.Image: RGBA image
+    """
+    width, height = size
+    random = numpy.random.RandomState(seed)
+    y, x = numpy.mgrid[0:height, 0:width].astype(numpy.float32)
+    array = numpy.empty((height, width, 4), dtype=numpy.float32)
+    phase = random.uniform(0, 6.28, 3)
+    array[:, :, 0] = 128 + 127 * numpy.sin(x / (width / 7.0) + phase[0])
+    array[:, :, 1] = 128 + 127 * numpy.sin(y / (height / 5.0) + phase[1])
+    array[:, :, 2] = 128 + 127 * numpy.sin((x + y) / (width / 3.0) + phase[2])
+    array[:, :, :3] += random.normal(0, 12, (height, width, 3))
+    array[:, :, 3] = 255
+    if alpha:
+        border = max(1, min(width, height) // 12)
+        array[:border, :, 3] = array[-border:, :, 3] = 0
+        array[:, :border, 3] = array[:, -border:, 3] = 0
+    return Image.fromarray(numpy.clip(array, 0, 255).astype(numpy.uint8), 'RGBA')
+
+
+def _write_card(folder, anim_folder, name, frame_re, frames, size, seed):
+    """
+    Function to write the static image and the animation frames of one card.
+    Args:
+        folder (str): folder of the static image
+        anim_folder (str): name of the animation subfolder
+        name (str): card name
+        frame_re (str): regex expression to delimit frame counter
+        frames (int): number of frames
+        size (tuple): (width, height)
+        seed (int): random seed
+    Returns:
+        int: number of frames written
+    """
+    make_image(size, seed).save(os.path.join(folder, '%s.png' % name))
+    written = 0
+    for index in range(frames):
+        header = frame_name(name, index, frame_re)
+        if header is None:
+            logger.warning('No frame name for %s frame %s matches %s, stopping at %s frames' % (name, index,
+                                                                                             frame_re, written))
+            break
+        anim_path = os.path.join(folder, anim_folder)
+        if not os.path.isdir(anim_path):
+            os.makedirs(anim_path)
+        make_image(size, seed * 1000 + index + 1).save(os.path.join(anim_path, '%s.png' % header))
+        written += 1
+    return written
+
+
+def make_tree(root, config, cards=10, locales=2, frames=8, size=(256, 388), cardbacks=2, heroes=2,
+              animated_ratio=0.5, shared_ratio=0.5):
+    """
+    Function to write a synthetic Unity export tree in the layout the crawlers expect:
+    <unity_folder of cards>/<locale>/<card>.png with an animation subfolder per locale, and
+    <unity_folder of cardbacks or heroes>/<card>.png with an animation subfolder.
+    Args:
+        root (str): folder to write the tree in
+        config (dict): configuration (CardConvert.yaml)
+        cards (int): number of cards per locale
+        locales (int): number of locales, taken from the start of the locale list of the config
+        frames (int): number of animation frames of an animated card
+        size (tuple): (width, height) of the images
+        cardbacks (int): number of cardbacks
+        heroes (int): number of heroes
+        animated_ratio (float): ratio of cards that have an animation
+        shared_ratio (float): ratio of cards whose art is identical in all locales
+    Returns:
+        dict: number of cards and frames written by card type
+    """
+    stats = {}
+    card_types = config['card_types']
+    frame_re = card_types['cards']['frame_re']
+    anim_folder = card_types['cards']['anim_folder']
+    stats['cards'] = {'cards': 0, 'frames': 0}
+    for locale_index, locale in enumerate(config['locale'][:locales]):
+        folder = os.path.join(root, card_types['cards']['unity_folder'], locale)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for index in range(cards):
+            shared = index < cards * shared_ratio
+            seed = index if shared else (locale_index + 1) * 100000 + index
+            card_frames = frames if index < cards * animated_ratio else 0
+            stats['cards']['frames'] += _write_card(folder, anim_folder, 'CARD_%04d' % index, frame_re, card_frames,
+                                                    size, seed)
+            stats['cards']['cards'] += 1
+    for card_type, count, prefix in (('cardbacks', cardbacks, 'Cardback'), ('heroes', heroes, 'Hero')):
+        frame_re = card_types[card_type]['frame_re']
+        anim_folder = card_types[card_type]['anim_folder']
+        folder = os.path.join(root, card_types[card_type]['unity_folder'])
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        stats[card_type] = {'cards': 0, 'frames': 0}
+        for index in range(count):
+            stats[card_type]['frames'] += _write_card(folder, anim_folder, '%s_%d' % (prefix, index), frame_re,
+                                                      frames, size, 500000 + index)
+            stats[card_type]['cards'] += 1
+    return stats
@@ -0,0 +1,411 @@
+import os
+import re
+import zlib
+import struct
+import timeit
+import logging
+from cStringIO import StringIO
+try:
+    import PIL
+    from PIL import Image, GifImagePlugin
+except ImportError:
+    PIL = None
+    Image = None
+    GifImagePlugin = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('CardConvert.animation')
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+# delay of a frame as a fraction of a second, the default of apngasm
+FRAME_DELAY = (1, 10)
+# palette index of transparent pixels in gifs, the other 255 entries hold the colours
+TRANSPARENT_INDEX = 255
+# pixels with a lower alpha are transparent in gifs
+ALPHA_THRESHOLD = 128
+# max number of frames and pixels sampled to compute the palette of an animation
+PALETTE_SAMPLE_FRAMES = 16
+PALETTE_SAMPLE_PIXELS = 1 << 18
+# bumped when the gifs written for the same frames change, so the cards are processed again (see
+# BasicCard.fingerprint)
+GIF_ENCODER_VERSION = 2
+# gif disposal methods: leave the frame on the canvas, clear the frame rectangle to transparent
+KEEP = 1
+CLEAR = 2
+# fewest colours a gif is reduced to while it is over its size target
+MIN_COLOURS = 16
+# 4x4 bayer matrix of the ordered dithering, and the amplitude in 0-255 of the offsets it adds to the colours
+BAYER_4 = [[0, 8, 2, 10],
+           [12, 4, 14, 6],
+           [3, 11, 1, 9],
+           [15, 7, 13, 5]]
+DITHER_SPREAD = 24
+# oldest Pillow writing gifs the way this module does: quantize to a palette without dithering (dither argument of
+# Image.quantize) and frames with their own offset, duration, disposal and transparency (GifImagePlugin.getdata)
+MIN_PILLOW_VERSION = (6, 0)
+
+
+def pillow_version():
+    """
+    Function to get the version of Pillow.
+    Returns:
+        tuple: (major, minor), None if Pillow (or PIL, which it replaces) can't be imported
+    """
+    version = PIL and (getattr(PIL, '__version__', None) or getattr(PIL, 'PILLOW_VERSION', None))
+    match = re.match(r'(\d+)\.(\d+)', version or '')
+    return match and (int(match.group(1)), int(match.group(2)))
+
+
+def available():
+    """
+    Function to check if the animations can be written in process: Pillow MIN_PILLOW_VERSION or newer and NumPy.
+    The distribution packages of older systems are older (eg: Pillow 2.3 on ubuntu 14.04), then the animations are
+    written with apngasm and apng2gif (see imaging.get_engine).
+    Returns:
+        bool
+    """
+    version = pillow_version()
+    return numpy is not None and version is not None and version >= MIN_PILLOW_VERSION
+
+
+def _chunk(chunk_type, data):
+    """
+    Function to build a png chunk.
+    Args:
+        chunk_type (str): 4 letter chunk type
+        data (str): chunk data
+    Returns:
+        str
+    """
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) &
+                                                                          0xffffffff)
+
+
+def _png_chunks(data):
+    """
+    Function to split an encoded png into chunks.
+    Args:
+        data (str): encoded png
+    Returns:
+        list: list of (chunk type, chunk data)
+    """
+    chunks = []
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+        chunks.append((chunk_type, data[offset + 8:offset + 8 + length]))
+        offset += length + 12
+    return chunks
+
+
+class APNGWriter(object):
+    """ Writes an animated png frame by frame. Each frame is encoded as a png by Pillow and its image data is moved
+    into the animation chunks (acTL, fcTL, fdAT), so no frame has to be kept in memory.
+    """
+    def __init__(self, path, frame_count, delay=FRAME_DELAY, loops=0):
+        """
+        Constructor
+        Args:
+            path (str): output file path
+            frame_count (int): number of frames that will be added
+            delay (tuple): (numerator, denominator) of the delay of each frame in seconds
+            loops (int): number of times to play the animation, 0 to loop forever
+        """
+        self.path = path
+        self.frame_count = frame_count
+        self.delay = delay
+        self.loops = loops
+        self._handle = open(path, 'wb')
+        self._handle.write(PNG_SIGNATURE)
+        self._size = None
+        self._sequence = 0
+
+    def add(self, image):
+        """
+        Function to add a frame.
+        Args:
+            image (PIL.Image.Image): RGBA frame, all frames must have the size of the first one
+        """
+        buffer_ = StringIO()
+        image.save(buffer_, 'PNG')
+        chunks = _png_chunks(buffer_.getvalue())
+        data = ''.join([chunk_data for chunk_type, chunk_data in chunks if chunk_type == 'IDAT'])
+        if self._size is None:
+            self._size = image.size
+            self._handle.write(_chunk('IHDR', dict(chunks)['IHDR']))
+            self._handle.write(_chunk('acTL', struct.pack('>II', self.frame_count, self.loops)))
+        elif image.size != self._size:
+            raise ValueError('Frame size %sx%s differs from %sx%s' % (image.size + self._size))
+        self._handle.write(_chunk('fcTL', struct.pack('>IIIIIHHBB', self._sequence, image.size[0], image.size[1],
+                                                      0, 0, self.delay[0], self.delay[1], 0, 0)))
+        self._sequence += 1
+        if self._sequence == 1:
+            self._handle.write(_chunk('IDAT', data))
+        else:
+            self._handle.write(_chunk('fdAT', struct.pack('>I', self._sequence) + data))
+            self._sequence += 1
+
+    def close(self):
+        """
+        Function to finish the file.
+        """
+        self._handle.write(_chunk('IEND', ''))
+        self._handle.close()
+
+
+class GIFWriter(object):
+    """ Writes an animated gif frame by frame with one global palette. The container is written here and Pillow
+    only LZW encodes the frames.
+    """
+    def __init__(self, path, palette, size, delay=FRAME_DELAY, loops=0):
+        """
+        Constructor
+        Args:
+            path (str): output file path
+            palette (list): 768 ints, the global palette
+            size (tuple): (width, height) of the animation
+            delay (tuple): (numerator, denominator) of the delay of each frame in seconds
+            loops (int): number of times to play the animation, 0 to loop forever
+        """
+        self.path = path
+        self.size = size
+        self.duration = int(1000 * delay[0] / delay[1])
+        self._handle = open(path, 'wb')
+        # header, logical screen descriptor with a 256 entry global colour table, the table and the loop extension
+        self._handle.write('GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0xf7, TRANSPARENT_INDEX, 0))
+        self._handle.write(''.join([chr(value) for value in palette]))
+        self._handle.write('!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loops) + '\x00')
+
+    def add(self, image, offset=(0, 0), disposal=2):
+        """
+        Function to add a frame.
+        Args:
+            image (PIL.Image.Image): P frame indexed into the global palette
+            offset (tuple): (x, y) of the frame on the canvas
+            disposal (int): gif disposal method
+        """
+        self._handle.write(''.join(GifImagePlugin.getdata(image, offset=offset, duration=self.duration,
+                                                          disposal=disposal, transparency=TRANSPARENT_INDEX)))
+
+    def close(self):
+        """
+        Function to finish the file.
+        """
+        self._handle.write(';')
+        self._handle.close()
+
+
+def compute_palette(samples, colours=TRANSPARENT_INDEX):
+    """
+    Function to compute one palette for all the frames of an animation with a median cut over the opaque pixels of
+    sample frames.
+    Args:
+        samples (list): RGBA images
+        colours (int): number of colours, up to TRANSPARENT_INDEX
+    Returns:
+        list: 768 ints, the colours, the unused entries and TRANSPARENT_INDEX set to copies of the first colour so
+              that they are never picked when mapping colours
+    """
+    pixels = []
+    for frame in samples:
+        array = numpy.asarray(frame)
+        pixels.append(array[array[:, :, 3] >= ALPHA_THRESHOLD][:, :3])
+    pixels = numpy.concatenate(pixels) if pixels else numpy.zeros((0, 3), numpy.uint8)
+    if not len(pixels):
+        pixels = numpy.zeros((1, 3), numpy.uint8)
+    pixels = pixels[::max(1, len(pixels) // PALETTE_SAMPLE_PIXELS)]
+    sample = Image.fromarray(numpy.ascontiguousarray(pixels.reshape((-1, 1, 3))), 'RGB')
+    colours = min(colours, TRANSPARENT_INDEX)
+    palette = sample.quantize(colors=colours).getpalette()[:colours * 3]
+    return palette + palette[:3] * (TRANSPARENT_INDEX + 1 - len(palette) // 3)
+
+
+def ordered_dither(image):
+    """
+    Function to add the offsets of a bayer matrix to the colours of an image before it is mapped to a palette. Unlike
+    an error diffusion, a pixel is dithered the same way in every frame, so the pixels that don't change between
+    frames stay the same and are left out of the frames (see delta_frames).
+    Args:
+        image (PIL.Image.Image): RGB image
+    Returns:
+        PIL.Image.Image: RGB image
+    """
+    array = numpy.asarray(image, dtype=numpy.float32)
+    height, width = array.shape[:2]
+    matrix = (numpy.array(BAYER_4, dtype=numpy.float32) + 0.5) / 16 - 0.5
+    offsets = numpy.tile(matrix, (height // 4 + 1, width // 4 + 1))[:height, :width] * DITHER_SPREAD
+    return Image.fromarray(numpy.clip(array + offsets[:, :, None] + 0.5, 0, 255).astype(numpy.uint8), 'RGB')
+
+
+def index_frame(image, palette_image, dither=None):
+    """
+    Function to map an RGBA frame to the global palette. Pixels under ALPHA_THRESHOLD get TRANSPARENT_INDEX.
+    Args:
+        image (PIL.Image.Image): RGBA frame
+        palette_image (PIL.Image.Image): P image holding the global palette
+        dither (str): 'ordered', 'floyd-steinberg' or None to map every pixel to its closest colour
+    Returns:
+        numpy.ndarray: (height, width) palette indices
+    """
+    rgb = image.convert('RGB')
+    if dither == 'ordered':
+        rgb = ordered_dither(rgb)
+    indexed = numpy.array(rgb.quantize(palette=palette_image,
+                                       dither=Image.FLOYDSTEINBERG if dither == 'floyd-steinberg' else Image.NONE))
+    indexed[numpy.asarray(image)[:, :, 3] < ALPHA_THRESHOLD] = TRANSPARENT_INDEX
+    return indexed
+
+
+def _bounding_box(mask):
+    """
+    Function to get the bounding box of the set pixels of a mask.
+    Args:
+        mask (numpy.ndarray): (height, width) booleans
+    Returns:
+        tuple: (left, top, right, bottom), None if no pixel is set
+    """
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    columns = numpy.flatnonzero(mask.any(axis=0))
+    return columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+
+
+def _union(box, other):
+    return min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3])
+
+
+def _settle(pending, following):
+    """
+    Function to finish a frame once the frame that follows it is known. The frame is left on the canvas, unless
+    pixels it shows are transparent in the following frame: its rectangle is then grown to cover them and cleared
+    after it is shown.
+    Args:
+        pending (tuple): (palette indices of the frame, canvas it is drawn on, rectangle it is drawn in)
+        following (numpy.ndarray): palette indices of the following frame
+    Returns:
+        pending (tuple): the following frame, the canvas it is drawn on and the rectangle of its changes
+        frame (tuple): (palette indices of the rectangle, (x, y) of the rectangle, disposal)
+    """
+    indices, canvas, box = pending
+    disposal = KEEP
+    next_canvas = indices
+    cleared = _bounding_box((following == TRANSPARENT_INDEX) & (indices != TRANSPARENT_INDEX))
+    if cleared is not None:
+        box = _union(box, cleared)
+        disposal = CLEAR
+        next_canvas = indices.copy()
+        next_canvas[box[1]:box[3], box[0]:box[2]] = TRANSPARENT_INDEX
+    left, top, right, bottom = box
+    rectangle = indices[top:bottom, left:right].copy()
+    # pixels the canvas already shows are transparent, the canvas shows through
+    rectangle[rectangle == canvas[top:bottom, left:right]] = TRANSPARENT_INDEX
+    changed = _bounding_box(following != next_canvas) or (0, 0, 1, 1)
+    return (following, next_canvas, changed), (rectangle, (left, top), disposal)
+
+
+def delta_frames(frames):
+    """
+    Generator turning the frames of an animation into the frames of a gif that only hold what changed: the
+    bounding rectangle of the pixels that differ from the canvas the frame is drawn on, with the pixels that don't
+    differ left transparent. The last frame is settled against the first one, which is drawn over it when the
+    animation loops.
+    Args:
+        frames (iterable): (height, width) palette indices of each frame (see index_frame)
+    Yields:
+        tuple: (palette indices of the rectangle, (x, y) of the rectangle, disposal)
+    """
+    first = None
+    pending = None
+    for indices in frames:
+        if pending is None:
+            first = indices
+            height, width = indices.shape
+            pending = (indices, numpy.full(indices.shape, TRANSPARENT_INDEX, numpy.uint8), (0, 0, width, height))
+            continue
+        pending, frame = _settle(pending, indices)
+        yield frame
+    if pending is not None:
+        yield _settle(pending, first)[1]
+
+
+def _write_gif(frames, load, gif_output, palette, size, delay, dither, apng=None):
+    """
+    Function to write the gif of an animation with a palette, frame by frame (see delta_frames).
+    Args:
+        frames (list): frame paths
+        load (function): function to decode a frame path into an RGBA image
+        gif_output (str): gif output file path
+        palette (list): 768 ints, the global palette
+        size (tuple): (width, height) of the animation
+        delay (tuple): (numerator, denominator) of the delay of each frame in seconds
+        dither (str): dithering (see index_frame)
+        apng (APNGWriter): animated png the frames are also added to, None to skip it
+    Returns:
+        float: fraction of the pixels of the animation written to the gif
+    """
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette)
+
+    def indexed_frames():
+        for frame in frames:
+            image = load(frame).convert('RGBA')
+            if image.size != size:
+                raise ValueError('Frame %s size %sx%s differs from %sx%s' % ((frame,) + image.size + size))
+            if apng:
+                apng.add(image)
+            yield index_frame(image, palette_image, dither=dither)
+
+    gif = GIFWriter(gif_output, palette, size, delay=delay)
+    written = 0
+    try:
+        for indices, offset, disposal in delta_frames(indexed_frames()):
+            written += indices.size
+            image = Image.fromarray(indices, 'P')
+            image.putpalette(palette)
+            gif.add(image, offset=offset, disposal=disposal)
+    finally:
+        gif.close()
+    return float(written) / (size[0] * size[1] * len(frames))
+
+
+def write_animation(frames, load, gif_output, apng_output=None, delay=FRAME_DELAY, dither=None, target_bytes=None):
+    """
+    Function to write the gif (and optionally the apng) of an animation. The palette is computed once from sample
+    frames, then every frame is decoded once and written to both files. The gif only holds the rectangle of each
+    frame that changed (see delta_frames). A gif over target_bytes is written again with half the colours, down to
+    MIN_COLOURS.
+    Args:
+        frames (list): frame paths
+        load (function): function to decode a frame path into an RGBA image
+        gif_output (str): gif output file path
+        apng_output (str): apng output file path or None
+        delay (tuple): (numerator, denominator) of the delay of each frame in seconds
+        dither (str): 'ordered', 'floyd-steinberg' or None (see index_frame)
+        target_bytes (int): size the gif should fit in, None for no target
+    Returns:
+        dict: {'bytes', 'target_bytes', 'colours', 'frames', 'written' (fraction of the pixels written), 'seconds'}
+    """
+    start = timeit.default_timer()
+    step = max(1, len(frames) // PALETTE_SAMPLE_FRAMES)
+    samples = [load(frame).convert('RGBA') for frame in frames[::step][:PALETTE_SAMPLE_FRAMES]]
+    size = samples[0].size
+    colours = TRANSPARENT_INDEX
+    apng = APNGWriter(apng_output, len(frames), delay=delay) if apng_output else None
+    try:
+        written = _write_gif(frames, load, gif_output, compute_palette(samples, colours), size, delay, dither,
+                             apng=apng)
+    finally:
+        if apng:
+            apng.close()
+    while target_bytes and os.path.getsize(gif_output) > target_bytes and colours > MIN_COLOURS:
+        colours = max(MIN_COLOURS, colours // 2)
+        logger.debug('%s is %s bytes, over %s, writing it with %s colours' % (gif_output,
+                                                                               os.path.getsize(gif_output),
+                                                                               target_bytes, colours))
+        written = _write_gif(frames, load, gif_output, compute_palette(samples, colours), size, delay, dither)
+    return {'bytes': os.path.getsize(gif_output), 'target_bytes': target_bytes, 'colours': colours,
+            'frames': len(frames), 'written': written, 'seconds': timeit.default_timer() - start}
@@ -0,0 +1,169 @@
+import os
+import re
+import logging
+from CardConvert import executor
+from CardConvert import files as files_
+from CardConvert import imaging
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('CardConvert.assets')
+
+# decoded and premultiplied backgrounds for the in-process engine, read through mmap
+NPY_EXT = '.npy'
+# ImageMagick persistent cache, mapped by ImageMagick instead of decoding the png (the pixels go to a .cache file)
+MPC_EXT = '.mpc'
+MPC_CACHE_EXT = '.cache'
+
+# backgrounds folder of this checkout, looked up once per process
+_folder = None
+
+
+def backgrounds_folder():
+    """
+    Function to get the folder of the background images, BACKGROUNDS_FOLDER in the environment or the backgrounds
+    folder next to the python folder.
+    Returns:
+        str: path
+    """
+    folder = os.getenv('BACKGROUNDS_FOLDER')
+    if folder:
+        return folder
+    global _folder
+    if _folder is None:
+        module_folder = re.split('python', os.path.abspath(__file__))[0]
+        _folder = os.path.join(module_folder, 'backgrounds')
+    return _folder
+
+
+def _extension(engine):
+    return NPY_EXT if engine.in_process else MPC_EXT
+
+
+def cache_path(cache_dir, path, ext):
+    """
+    Function to get the path of the cached version of a background. The mtime and size of the background are part
+    of the name so a cached version is never used for a background that changed since.
+    Args:
+        cache_dir (str): asset cache folder
+        path (str): background path
+        ext (str): NPY_EXT or MPC_EXT
+    Returns:
+        str: path
+    """
+    stat = os.stat(path)
+    return os.path.join(cache_dir, '%s.%x.%x%s' % (os.path.basename(path), int(stat.st_mtime * 1000), stat.st_size,
+                                                   ext))
+
+
+def cached(config, path, engine):
+    """
+    Function to get the file to read a background from with an engine: its cached version if it is up to date (see
+    prepare), the background itself otherwise.
+    Args:
+        config (dict): configuration
+        path (str): background path
+        engine (imaging.ImageEngine): engine that reads it
+    Returns:
+        str: path
+    """
+    cache_dir = config.get('asset_cache_dir')
+    if not cache_dir:
+        return path
+    try:
+        cached_path = cache_path(cache_dir, path, _extension(engine))
+    except OSError:
+        return path
+    return cached_path if os.path.isfile(cached_path) else path
+
+
+def _write_npy(path, output):
+    """
+    Function to decode a background, premultiply it and save it as a (height, width, 4) float32 array.
+    """
+    rgb, alpha = imaging.PillowEngine.to_array(imaging.PillowEngine.load(path))
+    with files_.atomic_outputs([output]) as (temp,):
+        with open(temp, 'wb') as handle:
+            numpy.save(handle, numpy.concatenate((rgb, alpha), axis=2))
+
+
+def _write_mpc(path, output):
+    """
+    Function to convert a background to the persistent cache format of ImageMagick, a .mpc header and a .cache file
+    of pixels. The .cache is renamed first so the .mpc is only found complete.
+    """
+    temp = files_.temp_path(output)
+    temp_cache = '%s%s' % (os.path.splitext(temp)[0], MPC_CACHE_EXT)
+    cmd = ['convert', path, temp]
+    try:
+        return_code, stdout_value, stderr_value = executor.run(cmd)
+        if return_code != 0:
+            raise OSError('%s failed: %s' % (' '.join(cmd), stderr_value.strip()))
+        os.rename(temp_cache, '%s%s' % (os.path.splitext(output)[0], MPC_CACHE_EXT))
+        os.rename(temp, output)
+    finally:
+        for leftover in (temp, temp_cache):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def prepare(config, engine):
+    """
+    Function to fill the asset cache (asset_cache_dir in the config) with the backgrounds of the backgrounds folder,
+    so they are decoded once for all the pool processes instead of once per process or, with ImageMagick, once per
+    frame. The in-process engine maps a premultiplied array of each background read only (see
+    imaging.PillowEngine.load_background), ImageMagick maps its persistent cache of each background, so the memory
+    they take is shared by all the processes. Called in the parent process before the tasks run. Cached versions of
+    backgrounds that changed since are replaced.
+    Args:
+        config (dict): configuration
+        engine (imaging.ImageEngine): engine that composites the backgrounds
+    Returns:
+        int: number of backgrounds cached
+    """
+    cache_dir = config.get('asset_cache_dir')
+    folder = backgrounds_folder()
+    if not cache_dir or not os.path.isdir(folder):
+        return 0
+    if engine.in_process and numpy is None:
+        return 0
+    ext = _extension(engine)
+    files_.make_dirs([cache_dir])
+    current = set()
+    built = 0
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not os.path.isfile(path):
+            continue
+        output = cache_path(cache_dir, path, ext)
+        current.add(os.path.basename(output))
+        if os.path.isfile(output):
+            continue
+        try:
+            if ext == NPY_EXT:
+                _write_npy(path, output)
+            else:
+                _write_mpc(path, output)
+        except (IOError, OSError, ValueError) as err:
+            logger.warning('Could not cache %s, it is decoded from the png: %s' % (path, err))
+            if ext == MPC_EXT:
+                # eg: ImageMagick is missing, the other backgrounds would fail the same way
+                break
+            continue
+        built += 1
+    # cached versions of backgrounds that changed since, for this engine
+    names = set(os.listdir(folder))
+    for cached_name in os.listdir(cache_dir):
+        root, cached_ext = os.path.splitext(cached_name)
+        if cached_ext == MPC_CACHE_EXT:
+            cached_ext = MPC_EXT
+        if cached_ext != ext or '%s%s' % (root, ext) in current:
+            continue
+        if root.rsplit('.', 2)[0] in names:
+            try:
+                os.remove(os.path.join(cache_dir, cached_name))
+            except OSError:
+                pass
+    return built
@@ -1,10 +1,16 @@
 import os
 import re
-import copy
-import shutil
-import inspect
+import json
+import hashlib
 import logging
-import subprocess
+from CardConvert import assets
+from CardConvert import imaging
+from CardConvert import animation
+from CardConvert import files as files_
+from CardConvert import executor
+from CardConvert import discovery
+from CardConvert import resources
+from CardConvert import metrics
 from CardConvert import exceptions
 
 logger = logging.getLogger()
@@ -21,6 +27,18 @@ class BasicCard(object):
     the cards of it's class residing in a given folder. It can generate instances for each of the cards in the dict.
     This class is subclassed by the card classes to implement their conversion functions.
     """
+    # output types that are derived from the static file and the functions that create them one at a time
+    static_copies = (('small', '_make_small_copy'),
+                     ('medium', '_make_medium_copy'),
+                     ('mediumj', '_make_jpg_copy'),
+                     ('icons/small', '_make_small_icons'),
+                     ('icons/medium', '_make_medium_icons'),
+                     ('icons/large', '_make_large_icons'))
+    # formats written to the animated output folder
+    animated_formats = ('gif',)
+    # the cards of this class are grouped in locale folders
+    locale_folders = False
+
     def __init__(self, config, name='', locale='', info=None):
         """
         Constructor
@@ -64,67 +82,79 @@ class BasicCard(object):
         """
         return self._config
 
+    @property
+    def image_engine(self):
+        """
+        Property that holds the image engine used for the static copies (image_engine in CardConvert.yaml).
+        Returns:
+             imaging.ImageEngine
+        """
+        return imaging.get_engine(self.config.get('image_engine'))
+
+    @property
+    def scratch_dir(self):
+        """
+        Property that holds the folder the intermediate files of this card are written to (see scratch.Workspace),
+        None to write them to the output folders.
+        Returns:
+             str
+        """
+        return self._info.get('scratch')
+
+    @scratch_dir.setter
+    def scratch_dir(self, path):
+        self._info['scratch'] = path
+
+    @property
+    def folders_made(self):
+        """
+        Property that tells if the output folders of this card were made before its tasks run (see
+        util.execute_pool), the task graph has no folders task then.
+        Returns:
+             bool
+        """
+        return bool(self._info.get('folders_made'))
+
+    @folders_made.setter
+    def folders_made(self, made):
+        self._info['folders_made'] = made
+
     @staticmethod
-    def crawler(target_dir, frame_re, anim_folder, locale_list=None):
+    def crawler(target_dir, frame_re, anim_folder, locale_list=None, index=None):
         """
-        Function to os.walk through a target directory and collect all the cards in it.
+        Function to walk through a target directory and collect all the cards in it (see discovery.crawl).
         Args:
             target_dir (str): path to crawl
             frame_re (str): regex expression to delimit frame counter
             anim_folder (str): name of the subdir in the target_dir that contains the animated frames
             locale_list (list): list of supported locales
+            index (discovery.DirectoryIndex): index of the directory listings of the last run
         Returns:
             cards (dict): cards in the target_dir with it's files
                           eg: {$card_name: {'static': 'file path', 'animated': [frames]}}
         """
-        cards = {}
-        if os.path.isdir(target_dir):
-            for path, subdir, files in os.walk(target_dir):
-                animated = False
-                basename = os.path.basename(path)
-                if basename == anim_folder:
-                    animated = True
-                if not animated:
-                    for file_ in sorted(files):
-                        if not re.match('^\.', file_):
-                            fullpath = os.path.join(path, file_)
-                            header = os.path.splitext(file_)[0]
-                            if header not in cards:
-                                cards[header] = {'static': fullpath,
-                                                 'animated': []}
-                if animated:
-                    for file_ in sorted(files):
-                        if not re.match('^\.', file_):
-                            fullpath = os.path.join(path, file_)
-                            header = os.path.splitext(file_)[0]
-                            header = re.split(frame_re, header)[0]
-                            if header in cards:
-                                cards[header]['animated'].append(fullpath)
-
-        return cards
+        return discovery.crawl(target_dir, frame_re, anim_folder, index=index)
 
     @staticmethod
-    def run_cmd(cmd):
+    def run_cmd(cmd, stdin_chunks=None):
         """
-        Function to execute a command as subprocess.
+        Function to execute a command as subprocess (see executor.run).
         Args:
             cmd (str): command to execute
+            stdin_chunks (iterable): strings streamed to the stdin of the command
         Returns:
             return_code (int): process return code
             stdout_value (str): stdout
             stderr_values (str): stderr
         """
-        logger.debug('Executing: %s' % cmd)
-        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = proc.communicate()
-        return_code = proc.returncode
-        return return_code, stdout_value, stderr_value
+        return executor.run(cmd, stdin_chunks=stdin_chunks)
 
-    def crawl_for_this_card_class(self, target_dir):
+    def crawl_for_this_card_class(self, target_dir, index=None):
         """
         Convenience function to crawl a target dir for this class of cards.
         Args:
             target_dir (str): path to crawl
+            index (discovery.DirectoryIndex): index of the directory listings of the last run
         Returns:
             dict: cards in the target_dir with it's files
                   eg: {$card_name: {'static': 'file path', 'animated': [frames]}}
@@ -132,7 +162,25 @@ class BasicCard(object):
         frame_re = self.config['card_types'][self.card_class]['frame_re']
         anim_folder = self.config['card_types'][self.card_class]['anim_folder']
         locale = self.config['locale']
-        return self.crawler(target_dir, frame_re, anim_folder, locale_list=locale)
+        return self.crawler(target_dir, frame_re, anim_folder, locale_list=locale, index=index)
+
+    def iter_instances(self, target_dir, index=None):
+        """
+        Generator yielding instances of this class of cards as the crawl of a target dir finds them
+        (see discovery.iter_cards).
+        Args:
+            target_dir (str): path to crawl
+            index (discovery.DirectoryIndex): index of the directory listings of the last run
+        Yields:
+            instance of this class
+        """
+        card_type = self.config['card_types'][self.card_class]
+        locale_list = self.config['locale'] if self.locale_folders else None
+        for locale, name, info in discovery.iter_cards(target_dir, card_type['frame_re'], card_type['anim_folder'],
+                                                       locale_list=locale_list, index=index):
+            cards_dict = {locale: {name: info}} if self.locale_folders else {name: info}
+            for instance in self.create_instances(cards_dict):
+                yield instance
 
     def create_instances(self, cards_dict):
         """
@@ -160,25 +208,102 @@ class BasicCard(object):
         output = os.path.join(output, basename)
         return input_, output
 
+    def _set_output_paths(self, output_dir):
+        """
+        Function to store the output paths of this card in self._info['output_paths'] with output_dir as the base
+        folder, without creating them. The function looks up the CardConvert.yaml config to determine the folders
+        of this class of card.
+        Args:
+            output_dir (str): base output path
+        """
+        outputs = self.config['card_types'][self.card_class]['outputs']
+        self._info['output_paths'] = {}
+        for output in outputs:
+            self._info['output_paths'][output] = os.path.join(output_dir, self.card_class, self.locale, output)
+
+    def output_dirs(self, output_dir):
+        """
+        Function to get the output folders of this card with output_dir as the base folder.
+        Args:
+            output_dir (str): base output path
+        Returns:
+            list: folder paths
+        """
+        self._set_output_paths(output_dir)
+        return sorted(self._info['output_paths'].values())
+
     def _make_output_folders(self, output_dir):
         """
         Function to all the output folders on disk with output_dir as the base folder.
         The function looks up the CardConvert.yaml config to determine which folders to build for this class of card.
-        It also stores the output paths in self._info['output_paths']
+        It also stores the output paths in self._info['output_paths']. Folders this process already made are
+        skipped (see files.make_dirs).
         Args:
             output_dir (str): base output path
         """
         logger.info('CREATING OUTPUT FOLDERS:: %s:%s' % (self.name, self.locale))
+        files_.make_dirs(self.output_dirs(output_dir))
+
+    def _make_static_copy(self, output_type, cmd_builder, error):
+        """
+        Function to create a static copy of this card with the configured image engine. If the engine doesn't run
+        in-process the ImageMagick command from cmd_builder is executed instead.
+        Args:
+            output_type (str): output type, key of imaging.DERIVATIVES
+            cmd_builder (function): function to build the ImageMagick command from input_ and output
+            error (class): exception to raise on failure
+        Returns:
+            return_code (int): process return code
+            stdout_value (str): stdout
+            stderr_values (str): stderr
+        """
+        spec = imaging.DERIVATIVES[output_type]
+        input_, output = self._get_input_output(output_type)
+        if 'ext' in spec:
+            output = '%s.%s' % (os.path.splitext(output)[0], spec['ext'])
+        engine = self.image_engine
+        with files_.atomic_outputs([output]) as (temp,):
+            if engine.in_process:
+                try:
+                    engine.make_copy(input_, temp, spec)
+                except (IOError, ValueError) as err:
+                    raise error('%s: %s -> %s' % (engine.name, input_, output), 1, '', str(err))
+                return 0, '', ''
+            cmd = cmd_builder(input_, temp)
+            return_code, stdout_value, stderr_value = self.run_cmd(cmd)
+            if return_code != 0:
+                raise error(cmd, return_code, stdout_value, stderr_value)
+            return return_code, stdout_value, stderr_value
+
+    def _make_static_copies(self):
+        """
+        Function to create all the static copies listed in the outputs of this card class. With an in-process image
+        engine the static file is decoded once and every copy is made from that buffer, otherwise each copy runs
+        its own command.
+        """
         outputs = self.config['card_types'][self.card_class]['outputs']
-        self._info['output_paths'] = {}
-        for output in outputs:
-            path = os.path.join(output_dir, self.card_class, self.locale, output)
+        copies = [(output_type, func) for output_type, func in self.static_copies if output_type in outputs]
+        if not copies:
+            return
+        engine = self.image_engine
+        if not engine.in_process:
+            for output_type, func in copies:
+                getattr(self, func)()
+            return
+        logger.info('CREATING STATIC COPIES:: %s:%s (%s)' % (self.name, self.locale,
+                                                             ', '.join([copy_[0] for copy_ in copies])))
+        jobs = []
+        for output_type, func in copies:
+            spec = imaging.DERIVATIVES[output_type]
+            input_, output = self._get_input_output(output_type)
+            if 'ext' in spec:
+                output = '%s.%s' % (os.path.splitext(output)[0], spec['ext'])
+            jobs.append((output, spec))
+        with files_.atomic_outputs([output for output, spec in jobs]) as temps:
             try:
-                logger.debug('Creating folder: %s' % path)
-                os.makedirs(path)
-            except OSError:
-                pass
-            self._info['output_paths'][output] = path
+                engine.make_copies(input_, [(temp, spec) for temp, (output, spec) in zip(temps, jobs)])
+            except (IOError, ValueError) as err:
+                raise exceptions.MakeStaticCopiesError('%s: %s' % (engine.name, input_), 1, '', str(err))
 
     @staticmethod
     def _make_medium_copy_cmd(input_, output):
@@ -201,12 +326,7 @@ class BasicCard(object):
             stderr_values (str): stderr
         """
         logger.info('CREATING MEDIUM SIZED COPY:: %s:%s' % (self.name, self.locale))
-        input_, output = self._get_input_output('medium')
-        cmd = self._make_medium_copy_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeMediumCopyError(cmd, return_code, stdout_value, stderr_value)
-        return return_code, stdout_value, stderr_value
+        return self._make_static_copy('medium', self._make_medium_copy_cmd, exceptions.MakeMediumCopyError)
 
     @staticmethod
     def _make_small_copy_cmd(input_, output):
@@ -229,12 +349,7 @@ class BasicCard(object):
             stderr_values (str): stderr
         """
         logger.info('CREATING SMALL SIZED COPY:: %s:%s' % (self.name, self.locale))
-        input_, output = self._get_input_output('small')
-        cmd = self._make_small_copy_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeSmallCopyError(cmd, return_code, stdout_value, stderr_value)
-        return return_code, stdout_value, stderr_value
+        return self._make_static_copy('small', self._make_small_copy_cmd, exceptions.MakeSmallCopyError)
 
     @staticmethod
     def _make_jpg_copy_cmd(input_, output):
@@ -257,14 +372,7 @@ class BasicCard(object):
             stderr_values (str): stderr
         """
         logger.info('CREATING MEDIUM SIZED JPG COPY:: %s:%s' % (self.name, self.locale))
-        input_, output = self._get_input_output('mediumj')
-        output, ext = os.path.splitext(output)
-        output = '%s.jpg' % output
-        cmd = self._make_jpg_copy_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeJpgCopyError(cmd, return_code, stdout_value, stderr_value)
-        return return_code, stdout_value, stderr_value
+        return self._make_static_copy('mediumj', self._make_jpg_copy_cmd, exceptions.MakeJpgCopyError)
 
     @staticmethod
     def _make_small_icons_cmd(input_, output):
@@ -287,12 +395,7 @@ class BasicCard(object):
             stderr_values (str): stderr
         """
         logger.info('CREATING SMALL SIZED ICON:: %s:%s' % (self.name, self.locale))
-        input_, output = self._get_input_output('icons/small')
-        cmd = self._make_small_icons_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeSmallIconError(cmd, return_code, stdout_value, stderr_value)
-        return return_code, stdout_value, stderr_value
+        return self._make_static_copy('icons/small', self._make_small_icons_cmd, exceptions.MakeSmallIconError)
 
     @staticmethod
     def _make_medium_icons_cmd(input_, output):
@@ -315,12 +418,7 @@ class BasicCard(object):
             stderr_values (str): stderr
         """
         logger.info('CREATING MEDIUM SIZED ICON:: %s:%s' % (self.name, self.locale))
-        input_, output = self._get_input_output('icons/medium')
-        cmd = self._make_medium_icons_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeMediumIconError(cmd, return_code, stdout_value, stderr_value)
-        return return_code, stdout_value, stderr_value
+        return self._make_static_copy('icons/medium', self._make_medium_icons_cmd, exceptions.MakeMediumIconError)
 
     @staticmethod
     def _make_large_icons_cmd(input_, output):
@@ -343,12 +441,7 @@ class BasicCard(object):
             stderr_values (str): stderr
         """
         logger.info('CREATING LARGE SIZED ICON:: %s:%s' % (self.name, self.locale))
-        input_, output = self._get_input_output('icons/large')
-        cmd = self._make_large_icons_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeLargeIconError(cmd, return_code, stdout_value, stderr_value)
-        return return_code, stdout_value, stderr_value
+        return self._make_static_copy('icons/large', self._make_large_icons_cmd, exceptions.MakeLargeIconError)
 
     def _make_animated_png_cmd(self, input_, output):
         """
@@ -375,6 +468,7 @@ class BasicCard(object):
         if self._info['animated']:
             logger.info('CREATING ANIMATED PNG:: %s:%s' % (self.name, self.locale))
             input_, output = self._get_input_output('animated')
+            output = self._intermediate_path(output)
             cmd = self._make_animated_png_cmd(input_, output)
             return_code, stdout_value, stderr_value = self.run_cmd(cmd)
             if return_code != 0:
@@ -383,6 +477,85 @@ class BasicCard(object):
         else:
             print 'No animation for %s' % self.name
 
+    def _intermediate_path(self, output):
+        """
+        Function to get the path of an intermediate file, in the scratch dir of this card if it has one.
+        Args:
+            output (str): path of the file in the output folders
+        Returns:
+            str: path to write the file to
+        """
+        if self.scratch_dir:
+            return os.path.join(self.scratch_dir, os.path.basename(output))
+        return output
+
+    def scratch_size(self, inputs):
+        """
+        Function to predict the size of the intermediate files of this card: the animated png made from the frames
+        when it's not written in-process.
+        Args:
+            inputs (dict): input records of the card (see manifest.Manifest.inputs)
+        Returns:
+            int: bytes
+        """
+        if self.image_engine.in_process:
+            return 0
+        return sum([frame['size'] for frame in inputs.get('frames', []) if frame])
+
+    def _animation_frames(self):
+        """
+        Function to get the frames the animated copies of this card are made of.
+        Returns:
+            list: frame paths
+        """
+        return self._info['animated']
+
+    def _make_animation(self):
+        """
+        Function to create the animated gif of this card in-process from the frames, without the intermediate
+        animated png. The animated png is kept only if keep_apng is set in the config. The gif is dithered as set by
+        gif_dither in the config and reduced to fewer colours while it is over gif_target_kb of the card type, its
+        size and the time it took are logged and recorded (see metrics.record_output).
+        """
+        frames = self._animation_frames()
+        if not frames:
+            logger.warning('No frames to animate for %s:%s' % (self.name, self.locale))
+            return
+        logger.info('CREATING ANIMATED GIF:: %s:%s' % (self.name, self.locale))
+        input_, output = self._get_input_output('animated')
+        header = os.path.splitext(output)[0]
+        outputs = ['%s.gif' % header]
+        if self.config.get('keep_apng'):
+            outputs.append('%s.png' % header)
+        target_kb = self.config['card_types'][self.card_class].get('gif_target_kb')
+        dither = self.config.get('gif_dither')
+        with files_.atomic_outputs(outputs) as temps:
+            try:
+                stats = self.image_engine.make_animation(frames, temps[0], apng_output=(temps[1:] or [None])[0],
+                                                         dither=None if dither == 'none' else dither,
+                                                         target_bytes=target_kb * 1024 if target_kb else None)
+            except (IOError, ValueError) as err:
+                raise exceptions.MakeAnimatedGIFError('%s: %s' % (self.image_engine.name, header), 1, '', str(err))
+        logger.info('ANIMATED GIF:: %s:%s %sKB%s, %s colours, %d%% of the pixels of %s frames, %.2fs' % (
+            self.name, self.locale, stats['bytes'] // 1024, ' (target %sKB)' % target_kb if target_kb else '',
+            stats['colours'], 100 * stats['written'], stats['frames'], stats['seconds']))
+        if target_kb and stats['bytes'] > target_kb * 1024:
+            logger.warning('%s.gif is over its target of %sKB at %s colours' % (header, target_kb, stats['colours']))
+        metrics.record_output('animated', stats['seconds'], stats['bytes'], target_bytes=stats['target_bytes'])
+
+    def _animation_tasks(self):
+        """
+        Function to get the tasks that create animated copies of this card depending on the card class and it's config
+        Returns:
+            list: list of (task name, function, list of task names it depends on)
+        """
+        if not self._info['animated']:
+            return []
+        if self.image_engine.in_process:
+            return [('animation', self._make_animation, ['folders'])]
+        return [('apng', self._make_animated_png, ['folders']),
+                ('gif', self._make_animated_gif, ['apng'])]
+
     @staticmethod
     def _make_animated_gif_cmd(input_, output):
         """
@@ -406,13 +579,14 @@ class BasicCard(object):
         logger.info('CREATING ANIMATED GIF:: %s:%s' % (self.name, self.locale))
         input_, output = self._get_input_output('animated')
         ## the animated png created from the _maked_animated_png is out input to create the gif
-        input_ = copy.copy(output)
+        input_ = self._intermediate_path(output)
         output, ext = os.path.splitext(output)
         output = '%s.gif' % output
-        cmd = self._make_animated_gif_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeAnimatedGIFError(cmd, return_code, stdout_value, stderr_value)
+        with files_.atomic_outputs([output]) as (temp,):
+            cmd = self._make_animated_gif_cmd(input_, temp)
+            return_code, stdout_value, stderr_value = self.run_cmd(cmd)
+            if return_code != 0:
+                raise exceptions.MakeAnimatedGIFError(cmd, return_code, stdout_value, stderr_value)
         # remove the png
         logger.debug('Removing input png file: %s' % input_)
         os.remove(input_)
@@ -439,17 +613,29 @@ class BasicCard(object):
         return this_input_, output
 
     @staticmethod
-    def _make_mp4_cmd(input_, output):
+    def _ffmpeg_threads(threads):
+        """
+        Function to get the ffmpeg option limiting the threads of an encoder, it goes before each output.
+        Args:
+            threads (int): number of threads, ffmpeg picks if None
+        Returns:
+            str
+        """
+        return '-threads %s ' % threads if threads else ''
+
+    @staticmethod
+    def _make_mp4_cmd(input_, output, threads=None):
         """
         Function to build a cmd to make a mp4 of this card.
         Args:
             input_ (str): input file path
             output (str): output file path
+            threads (int): number of encoder threads, ffmpeg picks if None
         Returns:
             str: command to execute
         """
-        return 'ffmpeg -f image2 -framerate 11 -i %s -profile:v baseline -level 3.0 -pix_fmt yuv420p %s' % (input_,
-                                                                                                           output)
+        return 'ffmpeg -y -f image2 -framerate 11 -i %s -profile:v baseline -level 3.0 -pix_fmt yuv420p %s%s' % (
+            input_, BasicCard._ffmpeg_threads(threads), output)
 
     def _make_mp4(self):
         """
@@ -461,23 +647,25 @@ class BasicCard(object):
         """
         logger.info('CREATING MP4:: %s:%s' % (self.name, self.locale))
         input_, output = self._web_format_prep(fext='mp4')
-        cmd = self._make_mp4_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeMP4Error(cmd, return_code, stdout_value, stderr_value)
+        with files_.atomic_outputs([output]) as (temp,):
+            cmd = self._make_mp4_cmd(input_, temp, threads=resources.tool_threads('ffmpeg'))
+            return_code, stdout_value, stderr_value = self.run_cmd(cmd)
+            if return_code != 0:
+                raise exceptions.MakeMP4Error(cmd, return_code, stdout_value, stderr_value)
         return return_code, stdout_value, stderr_value
 
     @staticmethod
-    def _make_webm_cmd(input_, output):
+    def _make_webm_cmd(input_, output, threads=None):
         """
         Function to build a cmd to make a mp4 of this card.
         Args:
             input_ (str): input file path
             output (str): output file path
+            threads (int): number of encoder threads, ffmpeg picks if None
         Returns:
             str: command to execute
         """
-        return 'ffmpeg -f image2 -framerate 11 -i %s  %s' % (input_, output)
+        return 'ffmpeg -y -f image2 -framerate 11 -i %s  %s%s' % (input_, BasicCard._ffmpeg_threads(threads), output)
 
     def _make_webm(self):
         """
@@ -489,10 +677,64 @@ class BasicCard(object):
         """
         logger.info('CREATING WEBM:: %s:%s' % (self.name, self.locale))
         input_, output = self._web_format_prep(fext='webm')
-        cmd = self._make_webm_cmd(input_, output)
-        return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        if return_code != 0:
-            raise exceptions.MakeWEBMError(cmd, return_code, stdout_value, stderr_value)
+        with files_.atomic_outputs([output]) as (temp,):
+            cmd = self._make_webm_cmd(input_, temp, threads=resources.tool_threads('ffmpeg'))
+            return_code, stdout_value, stderr_value = self.run_cmd(cmd)
+            if return_code != 0:
+                raise exceptions.MakeWEBMError(cmd, return_code, stdout_value, stderr_value)
+        return return_code, stdout_value, stderr_value
+
+    @staticmethod
+    def _make_videos_cmd(size, mp4_output, webm_output, threads=None):
+        """
+        Function to build a cmd that encodes raw rgb frames read from stdin into a mp4 and a webm of this card in one
+        go, with the same settings as _make_mp4_cmd and _make_webm_cmd.
+        Args:
+            size (tuple): (width, height) of the frames
+            mp4_output (str): mp4 output file path
+            webm_output (str): webm output file path
+            threads (int): number of threads of each encoder, ffmpeg picks if None
+        Returns:
+            str: command to execute
+        """
+        threads = BasicCard._ffmpeg_threads(threads)
+        return ('ffmpeg -y -f rawvideo -pix_fmt rgb24 -s %sx%s -framerate 11 -i - '
+                '-profile:v baseline -level 3.0 -pix_fmt yuv420p %s%s %s%s' % (size[0], size[1], threads, mp4_output,
+                                                                              threads, webm_output))
+
+    def _make_videos(self):
+        """
+        Function to create a mp4 and a webm of this card from the composited frames without writing the flattened
+        frames to disk. The frames are flattened in memory and streamed to a single ffmpeg.
+        Returns:
+            return_code (int): process return code
+            stdout_value (str): stdout
+            stderr_values (str): stderr
+        """
+        logger.info('CREATING MP4 AND WEBM:: %s:%s' % (self.name, self.locale))
+        input_, output = self._get_input_output('animated')
+        header = os.path.splitext(output)[0]
+        frames = self.image_engine.flat_frames(self._info['comp_out'])
+        try:
+            first = next(frames)
+        except (IOError, ValueError, StopIteration) as err:
+            raise exceptions.MakeVideoError('%s: %s' % (self.image_engine.name, self._info['comp_out']), 1, '',
+                                            str(err))
+
+        def raw_frames():
+            yield first.tobytes()
+            for frame in frames:
+                yield frame.tobytes()
+
+        with files_.atomic_outputs(['%s.mp4' % header, '%s.webm' % header]) as (mp4, webm):
+            cmd = self._make_videos_cmd(first.size, mp4, webm, threads=resources.tool_threads('ffmpeg'))
+            try:
+                return_code, stdout_value, stderr_value = self.run_cmd(cmd, stdin_chunks=raw_frames())
+            except (IOError, ValueError) as err:
+                # a frame that can't be read, ffmpeg was killed before it ended the videos early
+                raise exceptions.MakeVideoError(cmd, 1, '', str(err))
+            if return_code != 0:
+                raise exceptions.MakeVideoError(cmd, return_code, stdout_value, stderr_value)
         return return_code, stdout_value, stderr_value
 
     def _get_bg_path(self):
@@ -503,38 +745,36 @@ class BasicCard(object):
             bg_path (str): path to the image
         """
         bg_basename = self.config['card_types'][self.card_class]['composite']
-        bg_folder = os.getenv('BACKGROUNDS_FOLDER')
-        if not bg_folder:
-            current_frame = inspect.currentframe()
-            src_file = inspect.getsourcefile(current_frame)
-            module_folder = re.split('python', src_file)[0]
-            bg_folder = os.path.join(module_folder, 'backgrounds')
-        bg_path = os.path.join(bg_folder, bg_basename)
-        return bg_path
+        return os.path.join(assets.backgrounds_folder(), bg_basename)
 
     def _cp_original(self, output_dir):
         """
-        Function to make copies of the original card images into the output_dir
+        Function to place the original card images into the output_dir, by hardlink, reflink, symlink or copy
+        (original_mode in the config, see files.place_file). An original that is already in place is left alone.
         Args:
             output_dir (str): base output path
         """
         logger.info('COPYING ORIGINALS:: %s:%s' % (self.name, self.locale))
         input_ = self._info['static']
-        output = os.path.join(output_dir, self.card_class, self.locale, 'original')
-        shutil.copy2(input_, output)
-        logger.debug('Copied %s ---> %s' % (input_, output))
-
-    def _make_copies(self):
-        """
-        Function to create copies of this card depending on the card class and it's config
-        """
-        raise NotImplementedError
+        output = os.path.join(output_dir, self.card_class, self.locale, 'original', os.path.basename(input_))
+        if files_.up_to_date(input_, output):
+            logger.debug('Already in place %s ---> %s' % (input_, output))
+            return
+        used = files_.place_file(input_, output, mode=self.config.get('original_mode', 'copy'))
+        logger.debug('Placed %s ---> %s (%s)' % (input_, output, used))
 
-    def _make_animation_copies(self):
+    def _copy_tasks(self):
         """
-        Function to create animated copies of this card depending on the card class and it's config
+        Function to get the tasks that create copies of this card depending on the card class and it's config.
+        With an in-process image engine all the static copies are one task, otherwise there is a task per copy.
+        Returns:
+            list: list of (task name, function, list of task names it depends on)
         """
-        raise NotImplementedError
+        if self.image_engine.in_process:
+            return [('static', self._make_static_copies, ['folders'])]
+        outputs = self.config['card_types'][self.card_class]['outputs']
+        return [(output_type, getattr(self, func), ['folders'])
+                for output_type, func in self.static_copies if output_type in outputs]
 
     def _composite_animation_frames(self):
         """
@@ -546,20 +786,138 @@ class BasicCard(object):
         """
         raise NotImplementedError
 
-    def process(self, output_dir):
+    def task_graph(self, output_dir):
         """
-        This function defines the process of how a card is processed.
-        Creates output folders
+        This function defines the process of how a card is processed as a graph of tasks.
+        Creates output folders, unless they were made beforehand (see folders_made)
         Copies original files to output folders
         Make copies of this card (small, medium, jpg etc)
         Make animated copies of this card (animated gif, png, webm, mp4)
+        Tasks that don't depend on each other can run in parallel (see CardConvert.scheduler).
+        Args:
+            output_dir (str): base output path
+        Returns:
+            tasks (list): list of (task name, function, list of task names it depends on), in an order in which they
+                          can be run serially
+        """
+        tasks = [('folders', lambda: self._make_output_folders(output_dir), []),
+                 ('original', lambda: self._cp_original(output_dir), ['folders'])]
+        tasks += self._copy_tasks()
+        tasks += self._animation_tasks()
+        if self.folders_made:
+            tasks = [(name, func, [dependency for dependency in dependencies if dependency != 'folders'])
+                     for name, func, dependencies in tasks if name != 'folders']
+        return tasks
+
+    def input_files(self):
+        """
+        Function to get the input files of this card.
+        Returns:
+            static (str): path to the static file
+            animated (list): paths to the animation frames
+        """
+        return self._info['static'], list(self._info['animated'])
+
+    def asset_files(self):
+        """
+        Function to get the files besides the input files the outputs of this card are made with: the background
+        composited over the frames (composite of the card type).
+        Returns:
+            list: file paths
+        """
+        if not self.config['card_types'][self.card_class].get('composite') or not self._info['animated']:
+            return []
+        return [self._get_bg_path()]
+
+    def fingerprint(self):
+        """
+        Function to get a fingerprint of everything besides the input files that decides what the outputs of this
+        card look like: the config of this card class, the image engine and the commands.
+        Returns:
+            str: sha1 hex digest
+        """
+        commands = [getattr(self, '%s_cmd' % func)('input', 'output') for output_type, func in self.static_copies]
+        commands += [self._make_animated_gif_cmd('input', 'output'),
+                     self._make_mp4_cmd('input', 'output'),
+                     self._make_webm_cmd('input', 'output'),
+                     self._make_videos_cmd((0, 0), 'output', 'output')]
+        settings = {'card_type': self.config['card_types'][self.card_class],
+                    'image_engine': self.image_engine.name,
+                    'keep_apng': self.config.get('keep_apng'),
+                    'gif_dither': self.config.get('gif_dither'),
+                    'gif_encoder': animation.GIF_ENCODER_VERSION,
+                    'derivatives': imaging.DERIVATIVES,
+                    'commands': commands}
+        return hashlib.sha1(json.dumps(settings, sort_keys=True)).hexdigest()
+
+    def output_files(self, output_dir):
+        """
+        Function to get the files processing this card writes, by output type.
+        Args:
+            output_dir (str): base output path
+        Returns:
+            dict: list of file paths by output type
+        """
+        self._set_output_paths(output_dir)
+        outputs = self.config['card_types'][self.card_class]['outputs']
+        files = {}
+        if 'original' in outputs:
+            files['original'] = [self._get_input_output('original')[1]]
+        for output_type, func in self.static_copies:
+            if output_type in outputs:
+                spec = imaging.DERIVATIVES[output_type]
+                output = self._get_input_output(output_type)[1]
+                if 'ext' in spec:
+                    output = '%s.%s' % (os.path.splitext(output)[0], spec['ext'])
+                files[output_type] = [output]
+        if 'animated' in outputs and self._info['animated']:
+            output = os.path.splitext(self._get_input_output('animated')[1])[0]
+            formats = list(self.animated_formats)
+            if self.image_engine.in_process and self.config.get('keep_apng'):
+                formats.append('png')
+            files['animated'] = ['%s.%s' % (output, fext) for fext in formats]
+        return files
+
+    def task_output_type(self, task):
+        """
+        Function to get the output type a task of this card writes, to tag its timings (see metrics.measure).
+        Args:
+            task (str): task name
+        Returns:
+            str: output type, static for the task making all the static copies, None for housekeeping tasks
+        """
+        if task in ('original', 'static') or task in dict(self.static_copies):
+            return task
+        if task in [name for name, func, dependencies in self._animation_tasks()] and task != 'cleanup':
+            return 'animated'
+        return None
+
+    def run_task(self, task, output_dir):
+        """
+        Function to run a single task of this card's task graph. The tasks it depends on must have been run already,
+        possibly by another process.
+        Args:
+            task (str): task name
+            output_dir (str): base output path
+        Returns:
+            output of the task function
+        """
+        self._set_output_paths(output_dir)
+        for name, func, dependencies in self.task_graph(output_dir):
+            if name == task:
+                with metrics.measure(self, name, self.task_output_type(name)):
+                    return func()
+        raise KeyError('%s has no task %s' % (self, task))
+
+    def process(self, output_dir):
+        """
+        This function runs all the tasks of this card serially (see task_graph).
         Args:
             output_dir (str): base output path
         """
         logger.info('PROCESSING:: %s:%s' % (self.name, self.locale))
-        self._make_output_folders(output_dir)
-        self._cp_original(output_dir)
-        self._make_copies()
-        self._make_animation_copies()
+        for name, func, dependencies in self.task_graph(output_dir):
+            with metrics.measure(self, name, self.task_output_type(name)):
+                func()
 
         return 'Finished processing %s:%s' % (self.name, self.locale)
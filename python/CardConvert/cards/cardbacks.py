@@ -1,10 +1,14 @@
 import os
 import logging
 from base import BasicCard
+from CardConvert import assets
+from CardConvert import executor
 from CardConvert import exceptions
 logger = logging.getLogger('CardConvert.cards.base')
 
 class CardBacks(BasicCard):
+    animated_formats = ('gif', 'mp4', 'webm')
+
     @property
     def card_class(self):
         return 'cardbacks'
@@ -22,9 +26,32 @@ class CardBacks(BasicCard):
             cards.append(CardBacks(self.config, name=key, info=cards_dict[key]))
         return cards
 
+    def _set_output_paths(self, output_dir):
+        """
+        Function to store the output paths of this card in self._info['output_paths'] with output_dir as the base
+        folder, without creating them. It also stores the paths of the composited frames in self._info['comp_out']
+        and self._info['ff_out'] so the tasks that read them can run in any process. The frames go to the scratch dir
+        of this card if it has one (see scratch.Workspace), to the animated_temp output folder otherwise. They are
+        raw arrays with an in-process engine (see imaging.PillowEngine.frame_ext).
+        Args:
+            output_dir (str): base output path
+        """
+        super(CardBacks, self)._set_output_paths(output_dir)
+        self._info['comp_out'] = []
+        self._info['ff_out'] = []
+        if self._info['animated'] and os.path.isfile(self._get_bg_path()):
+            input_, output = self._get_input_output('animated_temp')
+            dirname = self.scratch_dir or os.path.dirname(output)
+            for file_ in self._info['animated']:
+                basename = '%s%s' % (os.path.splitext(os.path.basename(file_))[0], self.image_engine.frame_ext)
+                self._info['comp_out'].append(os.path.join(dirname, basename))
+                # with an in-process engine the flattened frames are streamed to ffmpeg, never written
+                if not self.image_engine.in_process:
+                    self._info['ff_out'].append(os.path.join(dirname, 'ff_%s' % (basename)))
+
     def _composite_animation_frames(self):
         """
-        Function to comp the card with a bg.
+        Function to comp the card with a bg. The bg is read from the asset cache when it is there (see assets.prepare).
         Returns:
             return_code (int): process return code
             stdout_value (str): stdout
@@ -33,25 +60,33 @@ class CardBacks(BasicCard):
         bg_path = self._get_bg_path()
         if os.path.isfile(bg_path):
             logger.info('COMPOSITING:: %s:%s' % (self.name, self.locale))
-            self._info['comp_out'] = []
-            self._info['ff_out'] = []
-            input_, output = self._get_input_output('animated_temp')
-            dirname = os.path.dirname(output)
-            for file_ in self._info['animated']:
-                basename = os.path.basename(file_)
-                this_out = os.path.join(dirname, basename)
-                ff_out = os.path.join(dirname, 'ff_%s' % (basename))
-                cmd = 'composite -gravity center %s %s %s' % (bg_path, file_, this_out)
-                return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-                if return_code != 0:
-                    raise exceptions.MakeCompositeError(cmd, return_code, stdout_value, stderr_value)
-                self._info['comp_out'].append(this_out)
-                cmd = 'convert %s -background "rgb(36,36,36)" -alpha remove %s' % (this_out, ff_out)
-                return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-                if return_code != 0:
-                    raise exceptions.MakeCompositeError(cmd, return_code, stdout_value, stderr_value)
-                self._info['ff_out'].append(ff_out)
-                # return return_code, stdout_value, stderr_value
+            engine = self.image_engine
+            bg_path = assets.cached(self.config, bg_path, engine)
+            if engine.in_process:
+                try:
+                    engine.composite_frames(bg_path, self._info['animated'], self._info['comp_out'])
+                except (IOError, ValueError) as err:
+                    raise exceptions.MakeCompositeError('%s: composite %s' % (engine.name, self.name), 1, '',
+                                                        str(err))
+                return
+            # the frames are independent, a few of them are processed at once (cmd_threads in the config)
+            cmds = ['composite -gravity center %s %s %s' % (bg_path, file_, this_out)
+                    for file_, this_out in zip(self._info['animated'], self._info['comp_out'])]
+            self._run_frame_cmds(cmds)
+            cmds = ['convert %s -background "rgb(36,36,36)" -alpha remove %s' % (this_out, ff_out)
+                    for this_out, ff_out in zip(self._info['comp_out'], self._info['ff_out'])]
+            self._run_frame_cmds(cmds)
+
+    @staticmethod
+    def _run_frame_cmds(cmds):
+        """
+        Function to run the commands processing the frames (see executor.run_many).
+        Args:
+            cmds (list): commands
+        """
+        for cmd, (return_code, stdout_value, stderr_value) in zip(cmds, executor.run_many(cmds)):
+            if return_code != 0:
+                raise exceptions.MakeCompositeError(cmd, return_code, stdout_value, stderr_value)
 
     def _make_animated_png_cmd(self, input_, output):
         """
@@ -78,6 +113,7 @@ class CardBacks(BasicCard):
         if self._info['comp_out']:
             logger.info('CREATING ANIMATED PNG:: %s:%s' % (self.name, self.locale))
             input_, output = self._get_input_output('animated')
+            output = self._intermediate_path(output)
             cmd = self._make_animated_png_cmd(input_, output)
             return_code, stdout_value, stderr_value = self.run_cmd(cmd)
             if return_code != 0:
@@ -86,36 +122,61 @@ class CardBacks(BasicCard):
         else:
             print 'No composite for %s' % self.name
 
-    def _rm_temp_files(self):
-        def clean(key):
-            if key in self._info:
-                cmd = 'rm -rf '
-                for file_ in self._info[key]:
-                    cmd += '%s ' % file_
-                return_code, stdout_value, stderr_value = self.run_cmd(cmd)
-        clean('ff_out')
-        clean('comp_out')
+    def _animation_frames(self):
+        """
+        Function to get the frames the animated copies of this card are made of, the composited frames.
+        Returns:
+            list: frame paths
+        """
+        return self._info['comp_out']
 
-    def _make_copies(self):
+    def scratch_size(self, inputs):
         """
-        Function to create copies of this card depending on the card class and it's config
+        Function to predict the size of the intermediate files of this card: the composited frames, raw in-process,
+        and the flattened frames and the animated png when they are not made in-process.
+        Args:
+            inputs (dict): input records of the card (see manifest.Manifest.inputs)
+        Returns:
+            int: bytes
         """
-        self._make_small_copy()
-        self._make_medium_copy()
-        self._make_jpg_copy()
-        self._make_small_icons()
-        self._make_medium_icons()
-        self._make_large_icons()
+        frames = [frame for frame in inputs.get('frames', []) if frame]
+        size = sum([frame['size'] for frame in frames])
+        if not self.image_engine.in_process:
+            return 3 * size
+        try:
+            return len(frames) * self.image_engine.frame_bytes(frames[0]['path'])
+        except (IndexError, IOError):
+            return size
 
-    def _make_animation_copies(self):
+    def _rm_temp_files(self):
         """
-        Function to create animated copies of this card depending on the card class and it's config
+        Function to remove the composited frames once the animated copies are made.
         """
-        if self._info['animated']:
-            self._composite_animation_frames()
-            self._make_animated_png()
-            self._make_animated_gif()
-            self._make_mp4()
-            self._make_webm()
-            self._rm_temp_files()
+        for key in ('ff_out', 'comp_out'):
+            for file_ in self._info.get(key, []):
+                try:
+                    os.remove(file_)
+                except OSError as err:
+                    if os.path.exists(file_):
+                        logger.warning('Could not remove %s: %s' % (file_, err))
 
+    def _animation_tasks(self):
+        """
+        Function to get the tasks that create animated copies of this card depending on the card class and it's config
+        Returns:
+            list: list of (task name, function, list of task names it depends on)
+        """
+        if not self._info['animated']:
+            return []
+        tasks = [('composite', self._composite_animation_frames, ['folders'])]
+        if self.image_engine.in_process:
+            tasks += [('animation', self._make_animation, ['composite']),
+                      ('video', self._make_videos, ['composite']),
+                      ('cleanup', self._rm_temp_files, ['animation', 'video'])]
+        else:
+            tasks += [('apng', self._make_animated_png, ['composite']),
+                      ('gif', self._make_animated_gif, ['apng']),
+                      ('mp4', self._make_mp4, ['composite']),
+                      ('webm', self._make_webm, ['composite']),
+                      ('cleanup', self._rm_temp_files, ['apng', 'mp4', 'webm'])]
+        return tasks
@@ -1,7 +1,6 @@
-import os
-import re
 import logging
 from base import BasicCard
+from CardConvert import discovery
 logger = logging.getLogger('CardConvert.cards.base')
 
 
@@ -9,51 +8,27 @@ class Cards(BasicCard):
     """
     This class is named 'cards' but Unity3d writes out these in a folder named 'output'.
     """
+    locale_folders = True
+
     @property
     def card_class(self):
         return 'cards'
 
     @staticmethod
-    def crawler(target_dir, frame_re, anim_folder, locale_list=[]):
+    def crawler(target_dir, frame_re, anim_folder, locale_list=[], index=None):
         """
-        Function to os.walk through a target directory and collect all the cards in it.
+        Function to walk through a target directory and collect all the cards in it by locale (see discovery.crawl).
         Args:
             target_dir (str): path to crawl
             frame_re (str): regex expression to delimit frame counter
             anim_folder (str): name of the subdir in the target_dir that contains the animated frames
             locale_list (list): list of supported locales
+            index (discovery.DirectoryIndex): index of the directory listings of the last run
         Returns:
-            cards (dict): cards in the target_dir with it's files
-                          eg: {$card_name: {'static': 'file path', 'animated': [frames]}}
+            cards (dict): cards in the target_dir with it's files by locale
+                          eg: {$locale: {$card_name: {'static': 'file path', 'animated': [frames]}}}
         """
-        cards = {}
-        if os.path.isdir(target_dir):
-            for path, subdir, files in os.walk(target_dir):
-                animated = False
-                basename = os.path.basename(path)
-                if basename in locale_list:
-                    locale = basename.lower()
-                    cards[locale] = {}
-                if basename == anim_folder:
-                    animated = True
-                if not animated:
-                    for file_ in sorted(files):
-                        if not re.match('^\.', file_):
-                            fullpath = os.path.join(path, file_)
-                            header = os.path.splitext(file_)[0]
-                            if header not in cards[locale]:
-                                cards[locale][header] = {'static': fullpath,
-                                                         'animated': []}
-                if animated:
-                    for file_ in sorted(files):
-                        if not re.match('^\.', file_):
-                            fullpath = os.path.join(path, file_)
-                            header = os.path.splitext(file_)[0]
-                            header = re.split(frame_re, header)[0]
-                            if header in cards[locale]:
-                                cards[locale][header]['animated'].append(fullpath)
-
-        return cards
+        return discovery.crawl(target_dir, frame_re, anim_folder, locale_list=locale_list, index=index)
 
     def create_instances(self, cards_dict):
         """
@@ -68,19 +43,3 @@ class Cards(BasicCard):
             for name in cards_dict[locale]:
                 cards.append(Cards(self.config, name=name, locale=locale, info=cards_dict[locale][name]))
         return cards
-
-    def _make_copies(self):
-        """
-        Function to create copies of this card depending on the card class and it's config
-        """
-        self._make_small_copy()
-        self._make_medium_copy()
-        self._make_jpg_copy()
-
-    def _make_animation_copies(self):
-        """
-        Function to create animated copies of this card depending on the card class and it's config
-        """
-        if self._info['animated']:
-            self._make_animated_png()
-            self._make_animated_gif()
\ No newline at end of file
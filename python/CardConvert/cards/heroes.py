@@ -21,17 +21,10 @@ class Heroes(BasicCard):
             cards.append(Heroes(self.config, name=key, info=cards_dict[key]))
         return cards
 
-    def _make_copies(self):
+    def _copy_tasks(self):
         """
-        Function to create copies of this card depending on the card class and it's config
-        """
-        pass
-
-    def _make_animation_copies(self):
-        """
-        Function to create animated copies of this card depending on the card class and it's config
+        Function to get the tasks that create copies of this card depending on the card class and it's config
+        Returns:
+            list: list of (task name, function, list of task names it depends on)
         """
-        logger.info('Doing animation')
-        if self._info['animated']:
-            self._make_animated_png()
-            self._make_animated_gif()
+        return []
@@ -0,0 +1,185 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger('CardConvert.costs')
+
+COSTS_NAME = '.cardconvert_costs.json'
+COSTS_VERSION = 1
+# weight of the last run in the recorded durations
+SMOOTHING = 0.5
+# seconds per unit of a task nothing is known about yet
+DEFAULT_RATE = 0.1
+MEGABYTE = float(1 << 20)
+
+
+class CostModel(object):
+    """ Predicts how long each task of a card takes so the most expensive work is dispatched first
+    (see scheduler.TaskScheduler).
+    A task that ran before is predicted from its recorded duration. Otherwise it is predicted from the size of its
+    inputs, the static file for the static copies and all the frames for the animation tasks, times the seconds per
+    megabyte measured for that task of that card class in previous runs. Durations and rates are smoothed across
+    runs and stored in the output folder.
+    """
+    def __init__(self, output_dir, name=None):
+        """
+        Constructor
+        Args:
+            output_dir (str): base output path, the costs are stored in it
+            name (str): file name of the costs, eg: the one of a shard (see sharding.Shard), which also reads the
+                        costs of the whole output tree first but only writes the costs of its own file and the ones it
+                        updated (see manifest.Manifest)
+        """
+        self.path = os.path.join(output_dir, name or COSTS_NAME)
+        self.output_dir = output_dir
+        self._cards = {}
+        self._rates = {}
+        # keys of the cards and rates written by save, all of them if None
+        self._written = (set(), set()) if name else None
+        self._units = {}
+        if name:
+            self.load(os.path.join(output_dir, COSTS_NAME))
+        self.load()
+
+    @staticmethod
+    def key(instance):
+        """
+        Function to get the key of a card.
+        Args:
+            instance (obj): card instance
+        Returns:
+            str
+        """
+        return '%s/%s/%s' % (instance.card_class, instance.locale, instance.name)
+
+    def load(self, path=None):
+        """
+        Function to load costs from disk into these ones, they replace the ones already loaded. Missing or unreadable
+        costs are empty ones.
+        Args:
+            path (str): path of the costs file, the path of these costs if None
+        """
+        path = path or self.path
+        if not os.path.isfile(path):
+            return
+        try:
+            with open(path, 'r') as handle:
+                data = json.load(handle)
+        except (IOError, ValueError) as err:
+            logger.warning('Ignoring unreadable costs %s: %s' % (path, err))
+            return
+        if data.get('version') == COSTS_VERSION:
+            self._cards.update(data.get('cards', {}))
+            self._rates.update(data.get('rates', {}))
+            if self._written is not None and path == self.path:
+                self._written[0].update(data.get('cards', {}))
+                self._written[1].update(data.get('rates', {}))
+
+    def save(self):
+        """
+        Function to write the costs to disk, through a temp file.
+        """
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        cards, rates = self._cards, self._rates
+        if self._written is not None:
+            cards = dict((key, cards[key]) for key in self._written[0] if key in cards)
+            rates = dict((key, rates[key]) for key in self._written[1] if key in rates)
+        temp_path = '%s.tmp' % self.path
+        with open(temp_path, 'w') as handle:
+            json.dump({'version': COSTS_VERSION, 'cards': cards, 'rates': rates}, handle, indent=1, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    @staticmethod
+    def units(instance, task, inputs):
+        """
+        Function to get the amount of work of a task: 1 + megabytes of the inputs it reads.
+        Args:
+            instance (obj): card instance
+            task (str): task name
+            inputs (dict): input records of the card (see manifest.Manifest.inputs)
+        Returns:
+            float
+        """
+        output_type = instance.task_output_type(task)
+        if output_type == 'animated':
+            size = sum([frame['size'] for frame in inputs.get('frames', []) if frame])
+        elif output_type is not None and inputs.get('static'):
+            size = inputs['static']['size']
+        else:
+            size = 0
+        return 1 + size / MEGABYTE
+
+    def _rate(self, card_class, task):
+        """
+        Function to get the seconds per unit of a task of a card class, the mean of the known rates if unknown.
+        """
+        rate = self._rates.get('%s/%s' % (card_class, task))
+        if rate is None and self._rates:
+            rate = sum(self._rates.values()) / len(self._rates)
+        return DEFAULT_RATE if rate is None else rate
+
+    def predict(self, instance, task, inputs):
+        """
+        Function to predict how long a task of a card takes.
+        Args:
+            instance (obj): card instance
+            task (str): task name
+            inputs (dict): input records of the card (see manifest.Manifest.inputs)
+        Returns:
+            float: seconds
+        """
+        key = self.key(instance)
+        units = self.units(instance, task, inputs or {})
+        self._units.setdefault(key, {})[task] = units
+        recorded = self._cards.get(key, {}).get(task)
+        if recorded is not None:
+            return recorded
+        return units * self._rate(instance.card_class, task)
+
+    def update(self, records):
+        """
+        Function to refine the costs with the task records of a run (see metrics.measure).
+        Args:
+            records (list): list of record dicts
+        """
+        for record in records:
+            if record['kind'] != 'task' or record['failed']:
+                continue
+            key = '%s/%s/%s' % (record['card_class'], record['locale'], record['name'])
+            task = record['task']
+            tasks = self._cards.setdefault(key, {})
+            if self._written is not None:
+                self._written[0].add(key)
+            previous = tasks.get(task)
+            tasks[task] = record['wall'] if previous is None else \
+                SMOOTHING * record['wall'] + (1 - SMOOTHING) * previous
+            units = self._units.get(key, {}).pop(task, None)
+            if units:
+                rate_key = '%s/%s' % (record['card_class'], task)
+                previous = self._rates.get(rate_key)
+                rate = record['wall'] / units
+                if self._written is not None:
+                    self._written[1].add(rate_key)
+                self._rates[rate_key] = rate if previous is None else SMOOTHING * rate + (1 - SMOOTHING) * previous
+
+
+def accuracy(cards, processes):
+    """
+    Function to compare the predicted (see scheduler.TaskScheduler) and actual duration of the cards of a run.
+    Args:
+        cards (dict): totals by card with 'predicted' and 'wall' seconds (see metrics.Aggregator)
+        processes (int): number of processes of the pool
+    Returns:
+        list: lines to print
+    """
+    if not cards:
+        return []
+    predicted = sum([card['predicted'] for card in cards.values()])
+    actual = sum([card['wall'] for card in cards.values()])
+    error = sum([abs(card['predicted'] - card['wall']) for card in cards.values()]) / max(actual, 1e-9)
+    lines = ['Predicted %.1fs of work (%.1fs on %s processes), actual %.1fs (%.1fs), %.0f%% error per card' %
+             (predicted, predicted / processes, processes, actual, actual / processes, 100 * error)]
+    for name, card in sorted(cards.items(), key=lambda item: -abs(item[1]['predicted'] - item[1]['wall']))[:5]:
+        lines.append('    %s predicted %.2fs actual %.2fs' % (name, card['predicted'], card['wall']))
+    return lines
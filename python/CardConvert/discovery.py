@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import time
+import stat
+import logging
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger('CardConvert.discovery')
+
+INDEX_NAME = '.cardconvert_index.json'
+INDEX_VERSION = 1
+# listings of directories modified less than this many seconds before they were read are read again next time,
+# files could have been added in the same mtime tick right after the read
+RACY_SECONDS = 2
+_digits = re.compile(r'\d+')
+
+
+def list_dir(path):
+    """
+    Function to list a directory, hidden entries (starting with a dot) are left out. Uses scandir when available
+    so the type of the entries comes with the listing instead of a stat per entry.
+    Args:
+        path (str): directory path
+    Returns:
+        dirs (list): sorted names of the subdirectories
+        files (list): sorted names of the files
+    """
+    dirs = []
+    files = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            if name.startswith('.'):
+                continue
+            try:
+                mode = os.stat(os.path.join(path, name)).st_mode
+            except OSError:
+                continue
+            if stat.S_ISDIR(mode):
+                dirs.append(name)
+            elif stat.S_ISREG(mode):
+                files.append(name)
+    return sorted(dirs), sorted(files)
+
+
+class DirectoryIndex(object):
+    """ Listings of the input directories keyed by their mtime. A directory's mtime changes when an entry is added,
+    removed or renamed in it, so the listing of a directory whose mtime didn't change since the last run is reused and
+    a repeat run on an unchanged tree costs a stat per directory instead of reading every directory.
+    Changes to the content of the files are picked up by the manifest (see manifest.Manifest).
+    """
+    def __init__(self, path=None, base=None):
+        """
+        Constructor
+        Args:
+            path (str): path of the index file, listings are not kept between runs if None
+            base (str): path of an index file read first, eg: the one of the output tree for a shard
+                        (see sharding.Shard)
+        """
+        self.path = path
+        self._dirs = {}
+        self._visited = {}
+        self.hits = 0
+        self.misses = 0
+        if base and base != path:
+            self.load(base)
+        self.load()
+
+    def load(self, path=None):
+        """
+        Function to load an index from disk into this one, its listings replace the ones already loaded. A missing
+        or unreadable index is an empty one.
+        Args:
+            path (str): path of the index file, the path of this index if None
+        """
+        path = path or self.path
+        if not path or not os.path.isfile(path):
+            return
+        try:
+            with open(path, 'r') as handle:
+                data = json.load(handle)
+        except (IOError, ValueError) as err:
+            logger.warning('Ignoring unreadable discovery index %s: %s' % (path, err))
+            return
+        if data.get('version') == INDEX_VERSION:
+            self._dirs.update(data.get('dirs', {}))
+
+    def save(self):
+        """
+        Function to write the listings of the directories visited in this run to disk, through a temp file.
+        """
+        if not self.path:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        temp_path = '%s.tmp' % self.path
+        with open(temp_path, 'w') as handle:
+            json.dump({'version': INDEX_VERSION, 'dirs': self._visited}, handle, indent=1, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def listdir(self, path):
+        """
+        Function to list a directory, from the index if its mtime didn't change.
+        Args:
+            path (str): directory path
+        Returns:
+            dirs (list): sorted names of the subdirectories
+            files (list): sorted names of the files
+        """
+        key = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime
+        cached = self._dirs.get(key)
+        if cached and cached['mtime'] == mtime and cached['read'] - mtime >= RACY_SECONDS:
+            self.hits += 1
+            # json gives back unicode, the names are byte strings like the ones listed from disk
+            entry = dict(cached, dirs=[name.encode('utf-8') for name in cached['dirs']],
+                         files=[name.encode('utf-8') for name in cached['files']])
+        else:
+            self.misses += 1
+            read = time.time()
+            dirs, files = list_dir(path)
+            entry = {'mtime': mtime, 'read': read, 'dirs': dirs, 'files': files}
+        self._visited[key] = entry
+        return entry['dirs'], entry['files']
+
+
+def frame_key(frame_pattern, header):
+    """
+    Function to split the name of an animation frame into the card name and the frame number.
+    Args:
+        frame_pattern (re.RegexObject): compiled frame_re, the frame counter delimiter (see CardConvert.yaml)
+        header (str): file name without extension
+    Returns:
+        name (str): card name
+        number (int): frame number, 0 if it has none
+    """
+    match = frame_pattern.search(header)
+    if not match:
+        return header, 0
+    digits = _digits.findall(match.group())
+    return header[:match.start()], int(digits[-1]) if digits else 0
+
+
+def iter_cards(target_dir, frame_re, anim_folder, locale_list=None, index=None):
+    """
+    Generator walking through a target directory once and yielding the cards in it as soon as the directory of
+    their static file has been walked, animation folder included, so cards can be processed while the crawl goes on.
+    The frames of a card are in frame number order (frame_2 before frame_10).
+    Args:
+        target_dir (str): path to crawl
+        frame_re (str): regex expression to delimit frame counter
+        anim_folder (str): name of the subdir that contains the animated frames
+        locale_list (list): list of supported locales, only the files in a locale folder are cards if set
+        index (DirectoryIndex): index to list the directories with, None to read them all
+    Yields:
+        locale (str): lower case name of the locale folder of the card, None without a locale_list
+        name (str): card name
+        info (dict): {'static': 'file path', 'animated': [frames]}
+    """
+    index = index or DirectoryIndex()
+    if not os.path.isdir(target_dir):
+        return
+    frame_pattern = re.compile(frame_re)
+    locales = set(locale_list or [])
+    # cards found so far by locale, set to None once yielded
+    groups = {}
+
+    def visit(path, locale):
+        dirs, files = index.listdir(path)
+        basename = os.path.basename(path)
+        if locale_list and basename in locales:
+            locale = basename.lower()
+        found = []
+        group = None
+        if not locale_list or locale is not None:
+            group = groups.setdefault(locale, {})
+            for file_ in files:
+                fullpath = os.path.join(path, file_)
+                header = os.path.splitext(file_)[0]
+                if basename == anim_folder:
+                    name, number = frame_key(frame_pattern, header)
+                    if group.get(name):
+                        group[name]['animated'].append((number, fullpath))
+                elif header not in group:
+                    group[header] = {'static': fullpath, 'animated': []}
+                    found.append(header)
+        for name in dirs:
+            for item in visit(os.path.join(path, name), locale):
+                yield item
+        for header in found:
+            info = group[header]
+            info['animated'] = [fullpath for number, fullpath in sorted(info['animated'])]
+            group[header] = None
+            yield locale, header, info
+
+    for item in visit(target_dir, None):
+        yield item
+
+
+def crawl(target_dir, frame_re, anim_folder, locale_list=None, index=None):
+    """
+    Function to walk through a target directory once and collect all the cards in it (see iter_cards).
+    Args:
+        target_dir (str): path to crawl
+        frame_re (str): regex expression to delimit frame counter
+        anim_folder (str): name of the subdir that contains the animated frames
+        locale_list (list): list of supported locales, the cards are grouped by the locale folder they are in if set
+        index (DirectoryIndex): index to list the directories with, None to read them all
+    Returns:
+        cards (dict): cards in the target_dir with it's files
+                      eg: {$card_name: {'static': 'file path', 'animated': [frames]}}
+                      or {$locale: {$card_name: ...}} with a locale_list
+    """
+    cards = {}
+    for locale, name, info in iter_cards(target_dir, frame_re, anim_folder, locale_list=locale_list, index=index):
+        if locale_list:
+            cards.setdefault(locale, {})[name] = info
+        else:
+            cards[name] = info
+    return cards
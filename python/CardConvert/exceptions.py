@@ -5,6 +5,9 @@ class CardConvertError(Exception):
         self.stdout = stdout
         self.stderr = stderr
 
+    def __reduce__(self):
+        return self.__class__, (self.value, self.return_code, self.stdout, self.stderr)
+
     def __str__(self):
         info = '%s\nReturn Code:%s\nSTDOUT:%s\nSTDERR:%s\n' % (self.value, self.return_code, self.stdout, self.stderr)
         return repr(info)
@@ -34,6 +37,10 @@ class MakeLargeIconError(CardConvertError):
     pass
 
 
+class MakeStaticCopiesError(CardConvertError):
+    pass
+
+
 class MakeAnimatedPNGError(CardConvertError):
     pass
 
@@ -50,5 +57,13 @@ class MakeWEBMError(CardConvertError):
     pass
 
 
+class MakeVideoError(CardConvertError):
+    pass
+
+
 class MakeCompositeError(CardConvertError):
-    pass
\ No newline at end of file
+    pass
+
+
+class TaskLostError(CardConvertError):
+    pass
@@ -0,0 +1,210 @@
+import os
+import sys
+import Queue
+import shlex
+import errno
+import timeit
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from CardConvert import metrics
+
+logger = multiprocessing.get_logger()
+
+# semaphores limiting how many commands of a tool run at once across all the pool processes, by tool name
+_limits = {}
+# seconds after which a command is killed, None to wait forever
+_timeout = None
+# number of commands run at once by run_many
+_threads = 1
+# arguments added after the name of a tool, by tool name (see resources.Budget.tool_args)
+_tool_args = {}
+
+
+def make_limits(tool_limits):
+    """
+    Function to create the semaphores of the tool limits, in the parent process before the pool is created so that
+    all the pool processes share them (see configure).
+    Args:
+        tool_limits (dict): max number of commands running at once by tool name (tool_limits in the config)
+    Returns:
+        dict: semaphore by tool name
+    """
+    return dict((tool, multiprocessing.BoundedSemaphore(count)) for tool, count in (tool_limits or {}).items()
+                if count)
+
+
+def configure(limits=None, timeout=None, threads=None, tool_args=None):
+    """
+    Function to set up the executor of this process, called by the pool initializer (see scheduler.init_worker).
+    Args:
+        limits (dict): semaphore by tool name (see make_limits)
+        timeout (float): seconds after which a command is killed, None to wait forever
+        threads (int): number of commands run at once by run_many
+        tool_args (dict): list of arguments added after the name of a tool, by tool name
+    """
+    global _limits, _timeout, _threads, _tool_args
+    _limits = limits or {}
+    _timeout = timeout or None
+    _threads = max(1, threads or 1)
+    _tool_args = tool_args or {}
+
+
+def to_argv(cmd):
+    """
+    Function to split a command into an argument list, the commands are run without a shell.
+    Args:
+        cmd (str|list): command
+    Returns:
+        list
+    """
+    if isinstance(cmd, (list, tuple)):
+        return list(cmd)
+    return shlex.split(cmd)
+
+
+def _kill(proc, killed):
+    """
+    Function to kill a command that ran out of time.
+    """
+    killed.append(True)
+    try:
+        proc.kill()
+    except OSError as err:
+        if err.errno != errno.ESRCH:
+            raise
+
+
+def _write_stdin(proc, chunks, cmd):
+    """
+    Function to stream chunks to the stdin of a command. The command exiting before it read them all is not an
+    error here, its return code and stderr tell why. Errors of the chunks themselves are raised.
+    """
+    for chunk in chunks:
+        try:
+            proc.stdin.write(chunk)
+        except IOError as err:
+            if err.errno != errno.EPIPE:
+                raise
+            logger.debug('Writing to stdin of %s failed: %s' % (cmd, err))
+            return
+
+
+def _close_stdin(proc):
+    try:
+        proc.stdin.close()
+    except IOError:
+        pass
+
+
+def run(cmd, stdin_chunks=None, timeout=None):
+    """
+    Function to run a command without a shell. It waits for a free slot if its tool has a limit (tool_limits in the
+    config), is killed after the timeout (cmd_timeout in the config) and its timings and resource usage are recorded
+    (see metrics.record_cmd).
+    Args:
+        cmd (str|list): command
+        stdin_chunks (iterable): strings streamed to the stdin of the command, the command is killed and the error
+                                 raised if they raise
+        timeout (float): seconds after which the command is killed, the configured timeout if None
+    Returns:
+        return_code (int): process return code, 127 if the tool can't be run, negative if killed
+        stdout_value (str): stdout
+        stderr_values (str): stderr
+    """
+    argv = to_argv(cmd)
+    tool = os.path.basename(argv[0]) if argv else None
+    if tool in _tool_args:
+        argv = argv[:1] + _tool_args[tool] + argv[1:]
+    timeout = _timeout if timeout is None else timeout
+    limit = _limits.get(tool)
+    logger.debug('Executing: %s' % cmd)
+    queued = timeit.default_timer()
+    if limit is not None:
+        limit.acquire()
+    try:
+        start = timeit.default_timer()
+        # stdout and stderr go to files so the command can't block on a full pipe while stdin is being written
+        stdout_file = tempfile.TemporaryFile()
+        stderr_file = tempfile.TemporaryFile()
+        try:
+            stdin = subprocess.PIPE if stdin_chunks is not None else None
+            try:
+                proc = subprocess.Popen(argv, stdin=stdin, stdout=stdout_file, stderr=stderr_file, close_fds=True)
+            except OSError as err:
+                return 127, '', '%s: %s' % (tool, err)
+            killed = []
+            timer = None
+            if timeout:
+                timer = threading.Timer(timeout, _kill, args=(proc, killed))
+                timer.daemon = True
+                timer.start()
+            try:
+                if stdin_chunks is not None:
+                    try:
+                        _write_stdin(proc, stdin_chunks, cmd)
+                    except:
+                        # eg: a frame that can't be read, the command is killed before its stdin is closed so it
+                        # doesn't take the truncated stream for a complete one
+                        exc_info = sys.exc_info()
+                        _kill(proc, [])
+                        _close_stdin(proc)
+                        proc.wait()
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    _close_stdin(proc)
+                return_code, usage = metrics.wait(proc)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            metrics.record_cmd(cmd, timeit.default_timer() - start, usage, return_code, waited=start - queued)
+            stdout_file.seek(0)
+            stderr_file.seek(0)
+            stdout_value, stderr_value = stdout_file.read(), stderr_file.read()
+            if killed:
+                logger.warning('Killed %s after %ss' % (cmd, timeout))
+                stderr_value += '\nKilled after %ss' % timeout
+            return return_code, stdout_value, stderr_value
+        finally:
+            stdout_file.close()
+            stderr_file.close()
+    finally:
+        if limit is not None:
+            limit.release()
+
+
+def run_many(cmds, threads=None):
+    """
+    Function to run independent commands a few at a time from threads of this process, so a step made of many
+    commands (eg: one per frame) keeps several tools busy. The tool limits still apply.
+    Args:
+        cmds (list): commands
+        threads (int): number of commands run at once, cmd_threads in the config if None
+    Returns:
+        list: (return_code, stdout_value, stderr_value) of each command, in the order of cmds
+    """
+    threads = min(threads or _threads, len(cmds))
+    if threads <= 1:
+        return [run(cmd) for cmd in cmds]
+    results = [None] * len(cmds)
+    todo = Queue.Queue()
+    for index in range(len(cmds)):
+        todo.put(index)
+
+    def worker():
+        while True:
+            try:
+                index = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = run(cmds[index])
+            except Exception as err:
+                results[index] = (1, '', str(err))
+
+    workers = [threading.Thread(target=worker) for thread in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results
@@ -0,0 +1,159 @@
+import os
+import errno
+import fcntl
+import shutil
+import logging
+import contextlib
+
+logger = logging.getLogger('CardConvert.files')
+
+LINK_MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+# ioctl to share the extents of a file on copy-on-write filesystems (btrfs, xfs), from linux/fs.h
+FICLONE = 0x40049409
+
+# folders made or found by this process, so they are not made again
+_made_dirs = set()
+
+
+def make_dirs(paths):
+    """
+    Function to make folders and their parents. The folders this process already made or found are skipped without
+    touching the filesystem, the output folders are shared by thousands of cards.
+    Args:
+        paths (list): folder paths
+    """
+    for path in paths:
+        if path in _made_dirs:
+            continue
+        try:
+            os.makedirs(path)
+            logger.debug('Created folder: %s' % path)
+        except OSError as err:
+            if err.errno != errno.EEXIST or not os.path.isdir(path):
+                raise
+        _made_dirs.add(path)
+
+
+def reflink(src, dst):
+    """
+    Function to make dst a copy-on-write clone of src.
+    Args:
+        src (str): source file path
+        dst (str): destination file path
+    """
+    with open(src, 'rb') as src_handle:
+        with open(dst, 'wb') as dst_handle:
+            fcntl.ioctl(dst_handle.fileno(), FICLONE, src_handle.fileno())
+
+
+def temp_path(path):
+    """
+    Function to get the path an output is written to before it is renamed to its final path. It is hidden, in the
+    same folder so the rename is atomic, and keeps the extension the tools pick the format from.
+    Args:
+        path (str): final file path
+    Returns:
+        str
+    """
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, '.tmp%s-%s' % (os.getpid(), basename))
+
+
+@contextlib.contextmanager
+def atomic_outputs(paths):
+    """
+    Context manager to write outputs under temp paths (see temp_path) and rename them to their final paths once they
+    are all written, so an output is either the previous version or complete, never half written. The temp files
+    are removed if writing them fails.
+    Args:
+        paths (list): final file paths
+    Yields:
+        list: temp file paths, in the order of paths
+    """
+    temps = [temp_path(path) for path in paths]
+    try:
+        yield temps
+        for temp, path in zip(temps, paths):
+            os.rename(temp, path)
+            # renaming a hardlink over another link to the same file does nothing
+            if os.path.lexists(temp):
+                os.remove(temp)
+    except BaseException:
+        for temp in temps:
+            if os.path.lexists(temp):
+                os.remove(temp)
+        raise
+
+
+def up_to_date(src, dst):
+    """
+    Function to check if dst already is src or a copy of it: same file, or same size and mtime (a copy made by
+    place_file keeps the mtime).
+    Args:
+        src (str): source file path
+        dst (str): destination file path
+    Returns:
+        bool
+    """
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime == dst_stat.st_mtime
+
+
+def place_file(src, dst, mode='copy'):
+    """
+    Function to materialise src at dst by hardlink, reflink, symlink or copy. If the link can't be made (eg: across
+    filesystems or on a filesystem without reflinks) the file is copied. The file is placed under a temp path and
+    renamed over dst.
+    Args:
+        src (str): source file path
+        dst (str): destination file path
+        mode (str): one of LINK_MODES
+    Returns:
+        str: mode that was used
+    """
+    with atomic_outputs([dst]) as (temp,):
+        if os.path.lexists(temp):
+            os.remove(temp)
+        if mode == 'hardlink':
+            try:
+                os.link(src, temp)
+                return mode
+            except OSError as err:
+                logger.debug('Hardlink %s ---> %s failed, copying: %s' % (src, dst, err))
+        elif mode == 'reflink':
+            try:
+                reflink(src, temp)
+                return mode
+            except (IOError, OSError) as err:
+                logger.debug('Reflink %s ---> %s failed, copying: %s' % (src, dst, err))
+                if os.path.lexists(temp):
+                    os.remove(temp)
+        elif mode == 'symlink':
+            try:
+                os.symlink(os.path.abspath(src), temp)
+                return mode
+            except OSError as err:
+                logger.debug('Symlink %s ---> %s failed, copying: %s' % (src, dst, err))
+        shutil.copy2(src, temp)
+        return 'copy'
+
+
+def break_link(path):
+    """
+    Function to remove a file that shares its inode with other files, so writing a new version of it can't change
+    the other files.
+    Args:
+        path (str): file path
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    if stat.st_nlink > 1:
+        os.remove(path)
@@ -0,0 +1,480 @@
+import os
+import logging
+from CardConvert import animation
+try:
+    from PIL import Image, ImageFilter
+except ImportError:
+    Image = None
+    ImageFilter = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('CardConvert.imaging')
+
+# colour the cards are flattened on (#242424)
+BACKGROUND = (36, 36, 36)
+
+# Specs of the static derivatives, keyed by output type. These mirror the ImageMagick command builders in
+# cards/base.py so that both engines produce the same files.
+DERIVATIVES = {
+    'small': {'size': (123, 186)},
+    'medium': {'size': (200, 303)},
+    'mediumj': {'size': (200, 303), 'background': BACKGROUND, 'crop': (200, 302), 'quality': 85, 'ext': 'jpg'},
+    'icons/small': {'size': (11, 16)},
+    'icons/medium': {'size': (30, 44)},
+    'icons/large': {'size': (40, 60)},
+}
+
+_engines = {}
+# premultiplied backgrounds decoded or mapped by this process, keyed by path
+_backgrounds = {}
+
+
+class ImageEngine(object):
+    """ This is the base class of an image engine. An engine knows how to build a static derivative of a card
+    (resize, sharpen, flatten, crop, encode) described by one of the DERIVATIVES specs.
+    """
+    name = None
+    in_process = False
+    # extension of the frames written by one task for the next ones (eg: the composited frames of a cardback)
+    frame_ext = '.png'
+
+    def make_copy(self, input_, output, spec):
+        """
+        Function to build a derivative of input_ into output.
+        Args:
+            input_ (str): input file path
+            output (str): output file path
+            spec (dict): derivative spec (see DERIVATIVES)
+        """
+        raise NotImplementedError
+
+    def make_copies(self, input_, outputs):
+        """
+        Function to build several derivatives of input_.
+        Args:
+            input_ (str): input file path
+            outputs (list): list of (output file path, spec) tuples
+        """
+        raise NotImplementedError
+
+    def composite_frames(self, bg_path, frames, outputs, flat_outputs=None, background=BACKGROUND):
+        """
+        Function to composite a background (watermark) centered over every frame of an animation.
+        Args:
+            bg_path (str): path to the background image
+            frames (list): input frame paths
+            outputs (list): composited frame paths
+            flat_outputs (list): composited frame paths, flattened on background. None to skip them
+            background (tuple): (r, g, b) colour
+        """
+        raise NotImplementedError
+
+    def flat_frames(self, frames, background=BACKGROUND):
+        """
+        Function to decode frames and flatten them on a background, one at a time.
+        Args:
+            frames (list): frame paths
+            background (tuple): (r, g, b) colour
+        Returns:
+            generator: RGB images
+        """
+        raise NotImplementedError
+
+    def make_animation(self, frames, gif_output, apng_output=None, dither=None, target_bytes=None):
+        """
+        Function to write the animated gif, and optionally the animated png, of a list of frames.
+        Args:
+            frames (list): frame paths
+            gif_output (str): gif output file path
+            apng_output (str): apng output file path or None
+            dither (str): dithering of the gif, 'ordered', 'floyd-steinberg' or None
+            target_bytes (int): size the gif should fit in, None for no target
+        Returns:
+            dict: size and time of the gif (see animation.write_animation)
+        """
+        raise NotImplementedError
+
+
+class ImageMagickEngine(ImageEngine):
+    """ Engine that leaves the work to the ImageMagick command builders of the card classes. The card runs the
+    commands itself through BasicCard.run_cmd, this engine only exists so the choice can be made in the config.
+    """
+    name = 'imagemagick'
+    in_process = False
+
+
+class PillowEngine(ImageEngine):
+    """ Engine that builds the derivatives in-process with Pillow and NumPy. No subprocesses are forked and the
+    source only has to be decoded once per derivative.
+    """
+    name = 'pillow'
+    in_process = True
+    # intermediate frames are raw arrays (see save and load): encoding them to png took longer than compositing them,
+    # and the tasks reading them decoded them again
+    frame_ext = '.npy'
+    # an intermediate is only reused as the source of a smaller size if it is at least this many times bigger
+    cascade_factor = 2
+    # -unsharp 1.5x1+0.7+0.02 expressed as a Pillow UnsharpMask (sigma, percent, threshold in 0-255)
+    unsharp_args = (1, 70, 5)
+
+    @staticmethod
+    def available():
+        """
+        Function to check if Pillow and NumPy could be imported, and if Pillow is recent enough to write the
+        animations (see animation.available).
+        Returns:
+            bool
+        """
+        return Image is not None and numpy is not None and animation.available()
+
+    @staticmethod
+    def load(path):
+        """
+        Function to decode an image from disk, or read a raw frame (see save).
+        Args:
+            path (str): path to the image
+        Returns:
+            image (PIL.Image.Image): decoded image in RGB or RGBA mode
+        """
+        if path.endswith(PillowEngine.frame_ext):
+            array = numpy.load(path)
+            return Image.fromarray(array, 'RGBA' if array.shape[2] == 4 else 'RGB')
+        image = Image.open(path)
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        return image
+
+    @staticmethod
+    def frame_bytes(path):
+        """
+        Function to get the size of the raw RGBA frame (see save) of an image, reading only its header.
+        Args:
+            path (str): path to the image
+        Returns:
+            int: bytes
+        """
+        width, height = Image.open(path).size
+        return width * height * 4
+
+    @staticmethod
+    def fit(image_size, size):
+        """
+        Function to compute the size of an image fitted into a box, keeping the aspect ratio (like -resize WxH).
+        Args:
+            image_size (tuple): (width, height) of the image
+            size (tuple): (width, height) of the box
+        Returns:
+            tuple: (width, height)
+        """
+        width, height = image_size
+        scale = min(float(size[0]) / width, float(size[1]) / height)
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+    @staticmethod
+    def resample(image, size):
+        """
+        Function to resample an image to an exact size with a lanczos filter.
+        Args:
+            image (PIL.Image.Image): image to resample
+            size (tuple): (width, height)
+        Returns:
+            PIL.Image.Image
+        """
+        if size == image.size:
+            return image
+        return image.resize(size, getattr(Image, 'LANCZOS', Image.ANTIALIAS))
+
+    def resize(self, image, size):
+        """
+        Function to resize an image into a box with a lanczos filter.
+        Args:
+            image (PIL.Image.Image): image to resize
+            size (tuple): (width, height) of the box
+        Returns:
+            PIL.Image.Image
+        """
+        return self.resample(image, self.fit(image.size, size))
+
+    def unsharp(self, image):
+        """
+        Function to sharpen the colour channels of an image, the alpha channel is left as is.
+        Args:
+            image (PIL.Image.Image): image to sharpen
+        Returns:
+            PIL.Image.Image
+        """
+        radius, percent, threshold = self.unsharp_args
+        mask = ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold)
+        if image.mode == 'RGBA':
+            alpha = image.split()[-1]
+            image = image.convert('RGB').filter(mask)
+            image.putalpha(alpha)
+            return image
+        return image.filter(mask)
+
+    @staticmethod
+    def flatten(image, background):
+        """
+        Function to flatten an image onto a solid background colour.
+        Args:
+            image (PIL.Image.Image): image to flatten
+            background (tuple): (r, g, b) colour
+        Returns:
+            PIL.Image.Image: RGB image
+        """
+        if image.mode != 'RGBA':
+            return image.convert('RGB')
+        flat = Image.new('RGB', image.size, background)
+        flat.paste(image, mask=image.split()[-1])
+        return flat
+
+    @staticmethod
+    def crop(image, size):
+        """
+        Function to crop an image to size, anchored at the bottom center (like -gravity south -crop).
+        Args:
+            image (PIL.Image.Image): image to crop
+            size (tuple): (width, height) of the crop
+        Returns:
+            PIL.Image.Image
+        """
+        width, height = image.size
+        crop_width, crop_height = min(size[0], width), min(size[1], height)
+        left = (width - crop_width) // 2
+        top = height - crop_height
+        return image.crop((left, top, left + crop_width, top + crop_height))
+
+    @staticmethod
+    def save(image, output, quality=None):
+        """
+        Function to encode an image to disk. The format is taken from the extension of output, a .npy is the raw
+        array of the image, for the intermediate frames (see frame_ext).
+        Args:
+            image (PIL.Image.Image): image to save
+            output (str): output file path
+            quality (int): jpg quality
+        """
+        if quality:
+            image.convert('RGB').save(output, quality=quality)
+        elif output.endswith(PillowEngine.frame_ext):
+            with open(output, 'wb') as handle:
+                numpy.save(handle, numpy.asarray(image))
+        else:
+            image.save(output)
+
+    def render(self, image, spec):
+        """
+        Function to apply a derivative spec to a decoded image.
+        Args:
+            image (PIL.Image.Image): decoded source
+            spec (dict): derivative spec (see DERIVATIVES)
+        Returns:
+            PIL.Image.Image
+        """
+        if 'background' in spec:
+            image = self.flatten(image, spec['background'])
+        image = self.resize(image, spec['size'])
+        if 'crop' in spec:
+            image = self.crop(image, spec['crop'])
+        return self.unsharp(image)
+
+    def make_copy(self, input_, output, spec):
+        """
+        Function to build a derivative of input_ into output.
+        Args:
+            input_ (str): input file path
+            output (str): output file path
+            spec (dict): derivative spec (see DERIVATIVES)
+        """
+        image = self.load(input_)
+        self.save(self.render(image, spec), output, quality=spec.get('quality'))
+
+    def make_copies(self, input_, outputs):
+        """
+        Function to build several derivatives of input_ while decoding it only once. The derivatives are built from
+        the biggest to the smallest and a smaller size is resampled from an already resized (unsharpened)
+        intermediate when that one is at least cascade_factor times bigger, instead of from the full resolution.
+        As in render, a derivative with a background is flattened before it is resized, so the intermediates are
+        kept by background.
+        Args:
+            input_ (str): input file path
+            outputs (list): list of (output file path, spec) tuples
+        """
+        image = self.load(input_)
+        resized = {}
+        outputs = sorted(outputs, key=lambda item: item[1]['size'][0] * item[1]['size'][1], reverse=True)
+        for output, spec in outputs:
+            background = spec.get('background')
+            if background not in resized:
+                resized[background] = {image.size: self.flatten(image, background) if background else image}
+            cascade = resized[background]
+            size = self.fit(image.size, spec['size'])
+            if size not in cascade:
+                cascade[size] = self.resample(self._cascade_source(cascade, size), size)
+            result = cascade[size]
+            if 'crop' in spec:
+                result = self.crop(result, spec['crop'])
+            self.save(self.unsharp(result), output, quality=spec.get('quality'))
+
+    @staticmethod
+    def to_array(image):
+        """
+        Function to convert an image to a premultiplied float array.
+        Args:
+            image (PIL.Image.Image): image to convert
+        Returns:
+            rgb (numpy.ndarray): premultiplied colour, (height, width, 3) in 0-1
+            alpha (numpy.ndarray): alpha, (height, width, 1) in 0-1
+        """
+        array = numpy.asarray(image.convert('RGBA'), dtype=numpy.float32) / 255.0
+        alpha = array[:, :, 3:]
+        return array[:, :, :3] * alpha, alpha
+
+    @staticmethod
+    def to_image(array, mode):
+        """
+        Function to convert a float array in 0-1 to an image.
+        Args:
+            array (numpy.ndarray): (height, width, channels) array
+            mode (str): RGB or RGBA
+        Returns:
+            PIL.Image.Image
+        """
+        return Image.fromarray(numpy.clip(array * 255.0 + 0.5, 0, 255).astype(numpy.uint8), mode)
+
+    def load_background(self, path):
+        """
+        Function to get a background decoded and premultiplied. Backgrounds are decoded once per process and decoded
+        again only if the file changed. A background from the asset cache (see assets.prepare) is already decoded and
+        premultiplied, it is mapped read only so all the processes share it.
+        Args:
+            path (str): path to the background image, or to its .npy in the asset cache
+        Returns:
+            rgb (numpy.ndarray): premultiplied colour
+            alpha (numpy.ndarray): alpha
+        """
+        mtime = os.path.getmtime(path)
+        if path not in _backgrounds or _backgrounds[path][0] != mtime:
+            if path.endswith('.npy'):
+                array = numpy.load(path, mmap_mode='r')
+                _backgrounds[path] = (mtime, (array[:, :, :3], array[:, :, 3:]))
+            else:
+                _backgrounds[path] = (mtime, self.to_array(self.load(path)))
+        return _backgrounds[path][1]
+
+    @staticmethod
+    def _center(size, overlay_size):
+        """
+        Function to get the slices of an overlay centered on an image (like -gravity center), clipped to the image.
+        Args:
+            size (tuple): (height, width) of the image
+            overlay_size (tuple): (height, width) of the overlay
+        Returns:
+            image_slices (tuple): slices of the image covered by the overlay
+            overlay_slices (tuple): slices of the overlay that are on the image
+        """
+        image_slices = []
+        overlay_slices = []
+        for length, overlay_length in zip(size, overlay_size):
+            offset = (length - overlay_length) // 2
+            start, end = max(offset, 0), min(offset + overlay_length, length)
+            image_slices.append(slice(start, end))
+            overlay_slices.append(slice(start - offset, end - offset))
+        return tuple(image_slices), tuple(overlay_slices)
+
+    def composite_frames(self, bg_path, frames, outputs, flat_outputs=None, background=BACKGROUND):
+        """
+        Function to composite a background (watermark) centered over every frame of an animation. The background is
+        decoded once, every frame is decoded once and both outputs of a frame are written from the same arrays.
+        Args:
+            bg_path (str): path to the background image
+            frames (list): input frame paths
+            outputs (list): composited frame paths
+            flat_outputs (list): composited frame paths, flattened on background. None to skip them
+            background (tuple): (r, g, b) colour
+        """
+        overlay_rgb, overlay_alpha = self.load_background(bg_path)
+        background = numpy.array(background, dtype=numpy.float32) / 255.0
+        for frame, output, flat_output in zip(frames, outputs, flat_outputs or [None] * len(outputs)):
+            rgb, alpha = self.to_array(self.load(frame))
+            frame_slices, overlay_slices = self._center(alpha.shape[:2], overlay_alpha.shape[:2])
+            # porter duff over with premultiplied colours, only where the overlay covers the frame
+            covered_alpha = overlay_alpha[overlay_slices]
+            rgb[frame_slices] = overlay_rgb[overlay_slices] + rgb[frame_slices] * (1 - covered_alpha)
+            alpha[frame_slices] = covered_alpha + alpha[frame_slices] * (1 - covered_alpha)
+            if flat_output:
+                self.save(self.to_image(rgb + background * (1 - alpha), 'RGB'), flat_output)
+            straight = numpy.where(alpha > 0, rgb / numpy.maximum(alpha, 1e-6), 0)
+            self.save(self.to_image(numpy.concatenate((straight, alpha), axis=2), 'RGBA'), output)
+
+    def flat_frames(self, frames, background=BACKGROUND):
+        """
+        Function to decode frames and flatten them on a background, one at a time.
+        Args:
+            frames (list): frame paths
+            background (tuple): (r, g, b) colour
+        Returns:
+            generator: RGB images
+        """
+        for frame in frames:
+            yield self.flatten(self.load(frame), background)
+
+    def make_animation(self, frames, gif_output, apng_output=None, dither=None, target_bytes=None):
+        """
+        Function to write the animated gif, and optionally the animated png, of a list of frames. Every frame is
+        decoded once, the gif uses one palette computed for the whole animation and only holds what changed from
+        frame to frame (see animation.write_animation).
+        Args:
+            frames (list): frame paths
+            gif_output (str): gif output file path
+            apng_output (str): apng output file path or None
+            dither (str): dithering of the gif, 'ordered', 'floyd-steinberg' or None
+            target_bytes (int): size the gif should fit in, None for no target
+        Returns:
+            dict: size and time of the gif (see animation.write_animation)
+        """
+        return animation.write_animation(frames, self.load, gif_output, apng_output=apng_output, dither=dither,
+                                         target_bytes=target_bytes)
+
+    def _cascade_source(self, resized, size):
+        """
+        Function to pick the smallest image to resample size from.
+        Args:
+            resized (dict): images keyed by their size, holds at least the full resolution source
+            size (tuple): (width, height) to resample to
+        Returns:
+            PIL.Image.Image
+        """
+        candidates = [key for key in resized
+                      if key[0] >= size[0] * self.cascade_factor and key[1] >= size[1] * self.cascade_factor]
+        if not candidates:
+            return resized[max(resized, key=lambda key: key[0] * key[1])]
+        return resized[min(candidates, key=lambda key: key[0] * key[1])]
+
+
+def get_engine(name=None):
+    """
+    Function to get the image engine by name. Engines are stateless so one instance is kept per process.
+    Falls back to ImageMagick if Pillow is requested but can't be imported or is too old (see
+    PillowEngine.available).
+    Args:
+        name (str): 'pillow' or 'imagemagick'
+    Returns:
+        engine (ImageEngine): the engine
+    """
+    name = name or ImageMagickEngine.name
+    if name not in _engines:
+        if name == PillowEngine.name and PillowEngine.available():
+            _engines[name] = PillowEngine()
+        else:
+            if name == PillowEngine.name:
+                logger.warning('Image engine "%s" needs Pillow %s or newer and NumPy, falling back to imagemagick' %
+                               (name, '.'.join(map(str, animation.MIN_PILLOW_VERSION))))
+            elif name != ImageMagickEngine.name:
+                logger.warning('Image engine "%s" is not available, falling back to imagemagick' % name)
+            _engines[name] = ImageMagickEngine()
+    return _engines[name]
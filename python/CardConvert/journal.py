@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger('CardConvert.journal')
+
+JOURNAL_NAME = '.cardconvert_journal'
+FAILURES_NAME = 'cardconvert_failures.json'
+
+
+def stamp(content_key):
+    """
+    Function to reduce what decides the outputs of a card (see manifest.Manifest.content_key) to a short string, so
+    tasks journaled for other inputs or another config are not taken as done.
+    Args:
+        content_key (tuple): content key of the card, None if an input is missing
+    Returns:
+        str: sha1 hex digest, None if content_key is None
+    """
+    if content_key is None:
+        return None
+    return hashlib.sha1(json.dumps(content_key)).hexdigest()
+
+
+class Journal(object):
+    """ Append-only record of the tasks done in a run, a line per task written as soon as the task is done, so a run
+    that was interrupted or had failures can be resumed (pycc --resume) without running again the tasks that were
+    done (see scheduler.TaskScheduler). The manifest (see manifest.Manifest) is only written when a run ends and
+    only knows about whole cards.
+    """
+    def __init__(self, output_dir, resume=False, name=None):
+        """
+        Constructor
+        Args:
+            output_dir (str): base output path, the journal is stored in it
+            resume (bool): keep the tasks journaled by the previous run, start a new journal otherwise
+            name (str): file name of the journal, eg: the one of a shard (see sharding.Shard)
+        """
+        self.path = os.path.join(output_dir, name or JOURNAL_NAME)
+        self._done = {}
+        if resume:
+            self.load()
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        self._handle = open(self.path, 'a' if resume else 'w')
+
+    def load(self):
+        """
+        Function to load the tasks journaled so far. A line cut short by a crash is ignored.
+        """
+        self._done = {}
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r') as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._done.setdefault((entry['key'], entry['stamp']), set()).add(entry['task'])
+        logger.info('Resuming from %s tasks done in the previous run' % sum([len(tasks) for tasks in
+                                                                            self._done.values()]))
+
+    def done(self, key, stamp_):
+        """
+        Function to get the tasks of a card that are journaled.
+        Args:
+            key (str): key of the card (see manifest.Manifest.key)
+            stamp_ (str): stamp of the card (see stamp)
+        Returns:
+            set: task names
+        """
+        if stamp_ is None:
+            return set()
+        return self._done.get((key, stamp_), set())
+
+    def record(self, key, stamp_, task):
+        """
+        Function to journal a task that is done. The line is flushed right away so it survives the run being killed.
+        Args:
+            key (str): key of the card
+            stamp_ (str): stamp of the card
+            task (str): task name
+        """
+        if stamp_ is None:
+            return
+        self._handle.write('%s\n' % json.dumps({'key': key, 'stamp': stamp_, 'task': task}, sort_keys=True))
+        self._handle.flush()
+
+    def close(self, remove=False):
+        """
+        Function to close the journal.
+        Args:
+            remove (bool): remove it, when the run was complete there is nothing to resume
+        """
+        self._handle.close()
+        if remove and os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def failure(instance, task, error):
+    """
+    Function to describe a failed task for the failure report.
+    Args:
+        instance (obj): card instance
+        task (str): task name
+        error (Exception): exception raised by the task
+    Returns:
+        dict
+    """
+    return {'card_class': instance.card_class, 'name': instance.name, 'locale': instance.locale, 'task': task,
+            'error': type(error).__name__,
+            'command': getattr(error, 'value', str(error)),
+            'return_code': getattr(error, 'return_code', None),
+            'stderr': getattr(error, 'stderr', None)}
+
+
+def write_failures(failures, path):
+    """
+    Function to write the failure report of a run.
+    Args:
+        failures (list): list of failure dicts (see failure)
+        path (str): report file path
+    """
+    with open(path, 'w') as handle:
+        json.dump({'failures': failures}, handle, indent=1, sort_keys=True)
+    logger.warning('%s tasks failed, see %s' % (len(failures), path))
@@ -0,0 +1,228 @@
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger('CardConvert.manifest')
+
+MANIFEST_NAME = '.cardconvert_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def hash_file(path, block_size=1 << 20):
+    """
+    Function to get the sha1 of a file.
+    Args:
+        path (str): path to the file
+        block_size (int): bytes read at a time
+    Returns:
+        str: sha1 hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        block = handle.read(block_size)
+        while block:
+            sha1.update(block)
+            block = handle.read(block_size)
+    return sha1.hexdigest()
+
+
+def stat_file(path):
+    """
+    Function to get the size and mtime of a file.
+    Args:
+        path (str): path to the file
+    Returns:
+        dict: {'path': path, 'size': size, 'mtime': mtime} or None if the file doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+class Manifest(object):
+    """ Persistent record of what was built in an output tree. For every card/locale it holds the hashes of the
+    static file, the animation frames and the assets they are made with (eg: the background composited over
+    cardbacks, see BasicCard.asset_files), the fingerprint of the config and commands (see BasicCard.fingerprint)
+    and the size and mtime of every output file. A card whose inputs, fingerprint and outputs are unchanged since
+    the last run doesn't have to be processed again.
+    """
+    def __init__(self, output_dir, name=None):
+        """
+        Constructor
+        Args:
+            output_dir (str): base output path, the manifest is stored in it
+            name (str): file name of the manifest, eg: the one of a shard (see sharding.Shard), which also reads the
+                        manifest of the whole output tree first but only writes the cards of its own file and the ones
+                        it updated, so the copies of the other cards don't replace the ones of the other nodes when
+                        the manifests are merged (see sharding.merge)
+        """
+        self.path = os.path.join(output_dir, name or MANIFEST_NAME)
+        self.output_dir = output_dir
+        self._items = {}
+        # keys of the cards written by save, all of them if None
+        self._written = set() if name else None
+        # sha1 of the files hashed by this process by (path, size, mtime), the assets are shared by many cards
+        self._hashes = {}
+        if name:
+            self.load(os.path.join(output_dir, MANIFEST_NAME))
+        self.load()
+
+    @staticmethod
+    def key(instance):
+        """
+        Function to get the key of a card in the manifest.
+        Args:
+            instance (obj): card instance
+        Returns:
+            str
+        """
+        return '%s/%s/%s' % (instance.card_class, instance.locale, instance.name)
+
+    def load(self, path=None):
+        """
+        Function to load a manifest from disk into this one, its cards replace the ones already loaded. A missing or
+        unreadable manifest is an empty one.
+        Args:
+            path (str): path of the manifest file, the path of this manifest if None
+        """
+        path = path or self.path
+        if not os.path.isfile(path):
+            return
+        try:
+            with open(path, 'r') as handle:
+                data = json.load(handle)
+        except (IOError, ValueError) as err:
+            logger.warning('Ignoring unreadable manifest %s: %s' % (path, err))
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self._items.update(data.get('items', {}))
+            if self._written is not None and path == self.path:
+                self._written.update(data.get('items', {}))
+
+    def save(self):
+        """
+        Function to write the manifest to disk. It is written to a temp file first and renamed so an interrupted run
+        never leaves a truncated manifest behind.
+        """
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        items = self._items
+        if self._written is not None:
+            items = dict((key, items[key]) for key in self._written if key in items)
+        temp_path = '%s.tmp' % self.path
+        with open(temp_path, 'w') as handle:
+            json.dump({'version': MANIFEST_VERSION, 'items': items}, handle, indent=1, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def _hash_input(self, path, previous):
+        """
+        Function to get the record of an input file. The sha1 of the previous record is reused when the size and mtime
+        of the file didn't change, so unchanged inputs aren't read again.
+        Args:
+            path (str): path to the input file
+            previous (dict): record of this file from the last run or None
+        Returns:
+            dict: {'path': path, 'size': size, 'mtime': mtime, 'sha1': sha1}
+        """
+        record = stat_file(path)
+        if record is None:
+            return None
+        stat = (path, record['size'], record['mtime'])
+        if previous and previous.get('size') == record['size'] and previous.get('mtime') == record['mtime']:
+            record['sha1'] = previous['sha1']
+        elif stat in self._hashes:
+            record['sha1'] = self._hashes[stat]
+        else:
+            record['sha1'] = hash_file(path)
+        self._hashes[stat] = record['sha1']
+        return record
+
+    def inputs(self, instance):
+        """
+        Function to get the records of the input files of a card.
+        Args:
+            instance (obj): card instance
+        Returns:
+            dict: {'static': record, 'frames': [records], 'assets': [records]}
+        """
+        previous = self._items.get(self.key(instance), {})
+        previous_files = dict((record['path'], record) for record in previous.get('frames', []) +
+                              previous.get('assets', []) if record)
+        static, animated = instance.input_files()
+        static = self._hash_input(static, previous.get('static'))
+        frames = [self._hash_input(path, previous_files.get(path)) for path in animated]
+        assets = [self._hash_input(path, previous_files.get(path)) for path in instance.asset_files()]
+        return {'static': static, 'frames': frames, 'assets': assets}
+
+    @staticmethod
+    def _signature(records):
+        """
+        Function to reduce input records to what decides the outputs: file names and contents.
+        Args:
+            records (list): input records
+        Returns:
+            list: list of (basename, sha1), None for missing files
+        """
+        return [record and (os.path.basename(record['path']), record['sha1']) for record in records]
+
+    def content_key(self, instance, inputs):
+        """
+        Function to get a key that is the same for cards that produce identical outputs: same card class,
+        same fingerprint and same input files and contents.
+        Args:
+            instance (obj): card instance
+            inputs (dict): records of the input files (see inputs)
+        Returns:
+            tuple: the key or None if an input is missing
+        """
+        signature = self._signature([inputs['static']] + inputs['frames'] + inputs['assets'])
+        if None in signature:
+            return None
+        return instance.card_class, instance.fingerprint(), tuple(signature)
+
+    def is_current(self, instance, inputs):
+        """
+        Function to check if the outputs of a card are up to date: same inputs, same fingerprint and all the outputs
+        still on disk as they were written.
+        Args:
+            instance (obj): card instance
+            inputs (dict): records of the input files (see inputs)
+        Returns:
+            bool
+        """
+        item = self._items.get(self.key(instance))
+        if not item or item.get('fingerprint') != instance.fingerprint():
+            return False
+        if self._signature([item['static']] + item['frames'] + item.get('assets', [])) != \
+                self._signature([inputs['static']] + inputs['frames'] + inputs['assets']):
+            return False
+        for output_type, files in instance.output_files(self.output_dir).items():
+            recorded = item['outputs'].get(output_type, [])
+            if [record['path'] for record in recorded] != files:
+                return False
+            for record in recorded:
+                current = stat_file(record['path'])
+                if current is None or current['size'] != record['size'] or current['mtime'] != record['mtime']:
+                    return False
+        return True
+
+    def update(self, instance, inputs):
+        """
+        Function to record the inputs and outputs of a card that was just processed.
+        Args:
+            instance (obj): card instance
+            inputs (dict): records of the input files (see inputs)
+        """
+        outputs = {}
+        for output_type, files in instance.output_files(self.output_dir).items():
+            outputs[output_type] = [record for record in [stat_file(path) for path in files] if record]
+        if self._written is not None:
+            self._written.add(self.key(instance))
+        self._items[self.key(instance)] = {'fingerprint': instance.fingerprint(),
+                                           'static': inputs['static'],
+                                           'frames': inputs['frames'],
+                                           'assets': inputs['assets'],
+                                           'outputs': outputs}
@@ -0,0 +1,281 @@
+import os
+import csv
+import json
+import errno
+import resource
+import timeit
+import contextlib
+import multiprocessing
+
+logger = multiprocessing.get_logger()
+
+# columns of a record, in the order of the csv report
+FIELDS = ('kind', 'card_class', 'name', 'locale', 'task', 'output_type', 'tool', 'wall', 'waited', 'predicted',
+          'cpu', 'child_cpu', 'peak_rss_kb', 'child_peak_rss_kb', 'bytes_written', 'output_bytes', 'target_bytes',
+          'pid', 'failed')
+# ru_oublock counts blocks of 512 bytes on linux
+BLOCK_SIZE = 512
+
+# records of the tasks and commands run in this process since the last drain
+_records = []
+# tags of the task running in this process, added to the records of the commands it runs
+_context = {}
+
+
+def _usage():
+    """
+    Function to get the resource usage of this process and of its children it waited for.
+    Returns:
+        self_usage (resource.struct_rusage)
+        children_usage (resource.struct_rusage)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def _cpu(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextlib.contextmanager
+def measure(instance, task, output_type=None):
+    """
+    Context manager to record the wall time, the cpu time of this process and of the commands it ran, the peak RSS
+    and the bytes written to disk of a task of a card. Tasks of a process run one after the other, so the deltas of
+    the usage of this process are the usage of the task.
+    Args:
+        instance (obj): card instance
+        task (str): task name
+        output_type (str): output type written by the task
+    """
+    global _context
+    tags = {'card_class': instance.card_class, 'name': instance.name, 'locale': instance.locale, 'task': task,
+            'output_type': output_type}
+    previous = _context
+    _context = dict(tags, child_peak_rss_kb=0)
+    self_before, children_before = _usage()
+    start = timeit.default_timer()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        wall = timeit.default_timer() - start
+        self_after, children_after = _usage()
+        record = dict(tags, kind='task', tool=None, wall=wall,
+                      cpu=_cpu(self_after) - _cpu(self_before),
+                      child_cpu=_cpu(children_after) - _cpu(children_before),
+                      # ru_maxrss of this process is its peak since it started, not only during the task
+                      peak_rss_kb=self_after.ru_maxrss,
+                      child_peak_rss_kb=_context['child_peak_rss_kb'],
+                      bytes_written=BLOCK_SIZE * (self_after.ru_oublock - self_before.ru_oublock +
+                                                  children_after.ru_oublock - children_before.ru_oublock),
+                      pid=os.getpid(), failed=failed)
+        _context = previous
+        _records.append(record)
+
+
+def wait(proc):
+    """
+    Function to wait for a subprocess and get its resource usage. The usage includes the processes it waited for,
+    so the commands run by the shell of a subprocess.Popen(shell=True) are accounted.
+    Args:
+        proc (subprocess.Popen): process to wait for
+    Returns:
+        return_code (int): process return code
+        usage (resource.struct_rusage): resource usage of the process
+    """
+    while True:
+        try:
+            pid, status, usage = os.wait4(proc.pid, 0)
+            break
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, usage
+
+
+def record_cmd(cmd, wall, usage, return_code, waited=0.0):
+    """
+    Function to record a command run by a task (see executor.run).
+    Args:
+        cmd (str|list): command
+        wall (float): wall time in seconds
+        usage (resource.struct_rusage): resource usage of the command (see wait)
+        return_code (int): process return code
+        waited (float): seconds spent waiting for a free slot of the tool before starting
+    """
+    argv = cmd if isinstance(cmd, (list, tuple)) else cmd.split()
+    tool = os.path.basename(argv[0]) if argv else None
+    record = {'kind': 'cmd', 'tool': tool, 'wall': wall, 'waited': waited, 'cpu': 0.0, 'child_cpu': _cpu(usage),
+              'peak_rss_kb': None,
+              'child_peak_rss_kb': usage.ru_maxrss, 'bytes_written': BLOCK_SIZE * usage.ru_oublock,
+              'pid': os.getpid(), 'failed': return_code != 0}
+    for field in ('card_class', 'name', 'locale', 'task', 'output_type'):
+        record[field] = _context.get(field)
+    if _context:
+        _context['child_peak_rss_kb'] = max(_context['child_peak_rss_kb'], usage.ru_maxrss)
+    _records.append(record)
+
+
+def record_output(output_type, wall, size, target_bytes=None):
+    """
+    Function to record the size of an output and the time it took to encode, by a task (see measure), eg: an
+    animated gif and its size target.
+    Args:
+        output_type (str): output type
+        wall (float): encoding time in seconds
+        size (int): size of the output in bytes
+        target_bytes (int): size the output should fit in, None for no target
+    """
+    record = {'kind': 'output', 'tool': None, 'output_type': output_type, 'wall': wall, 'waited': 0.0, 'cpu': 0.0,
+              'child_cpu': 0.0, 'peak_rss_kb': None, 'child_peak_rss_kb': None, 'bytes_written': 0,
+              'output_bytes': size, 'target_bytes': target_bytes, 'pid': os.getpid(), 'failed': False}
+    for field in ('card_class', 'name', 'locale', 'task'):
+        record[field] = _context.get(field)
+    _records.append(record)
+
+
+def drain():
+    """
+    Function to get and forget the records of this process, the pool processes send them back with each task.
+    Returns:
+        list: list of record dicts
+    """
+    records = list(_records)
+    del _records[:]
+    return records
+
+
+def _add_total(totals, key, record):
+    """
+    Function to add the time and usage of a record to the totals of its key.
+    Args:
+        totals (dict): {'count', 'wall', 'cpu', 'child_cpu', 'bytes_written'} by key
+        key (str): key of the record
+        record (dict): record
+    Returns:
+        dict: totals of the key
+    """
+    total = totals.get(key)
+    if total is None:
+        total = totals[key] = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0, 'bytes_written': 0}
+    total['count'] += 1
+    for field in ('wall', 'cpu', 'child_cpu', 'bytes_written'):
+        total[field] += record[field] or 0
+    return total
+
+
+class Aggregator(object):
+    """ Sums the records of a run by task, by command and by card as they come back from the pool, so a long run
+    doesn't have to hold all of them. The records themselves are only kept for a report.
+    """
+    def __init__(self, records=None, keep=False):
+        """
+        Constructor
+        Args:
+            records (list): list of record dicts to start with
+            keep (bool): keep the records (see write_report)
+        """
+        self.keep = keep
+        self.records = []
+        self.tasks = {}
+        self.tools = {}
+        self.cards = {}
+        self.outputs = {}
+        self.add(records or [])
+
+    def add(self, records):
+        """
+        Function to add records.
+        Args:
+            records (list): list of record dicts
+        """
+        for record in records:
+            if self.keep:
+                self.records.append(record)
+            if record['kind'] == 'cmd':
+                _add_total(self.tools, record['tool'], record)
+                continue
+            if record['kind'] == 'output':
+                total = _add_total(self.outputs, record['output_type'], record)
+                total['output_bytes'] = total.get('output_bytes', 0) + record['output_bytes']
+                total['over_target'] = total.get('over_target', 0) + int(bool(record['target_bytes']) and
+                                                                         record['output_bytes'] > record['target_bytes'])
+                continue
+            _add_total(self.tasks, record['task'], record)
+            card = _add_total(self.cards, '%s:%s:%s' % (record['card_class'], record['name'], record['locale']),
+                              record)
+            card['predicted'] = card.get('predicted', 0.0) + (record.get('predicted') or 0.0)
+            if record['wall'] > card.get('slowest_wall', -1):
+                card['slowest_task'] = record['task']
+                card['slowest_wall'] = record['wall']
+
+    def summary(self):
+        """
+        Function to get the totals.
+        Returns:
+            dict: {'tasks': totals by task name, 'tools': totals by command, 'cards': totals by class:name:locale,
+                   'outputs': totals by output type with their size and how many were over their size target}
+        """
+        return {'tasks': self.tasks, 'tools': self.tools, 'cards': self.cards, 'outputs': self.outputs}
+
+    def slowest(self, top=10):
+        """
+        Function to get the cards that took the longest, with the task that took the longest for each.
+        Args:
+            top (int): number of cards
+        Returns:
+            list: lines to print
+        """
+        lines = []
+        for name, card in sorted(self.cards.items(), key=lambda item: -item[1]['wall'])[:top]:
+            lines.append('%8.2fs %s (slowest task %s %.2fs)' % (card['wall'], name, card['slowest_task'],
+                                                                card['slowest_wall']))
+        return lines
+
+
+def summarise(records):
+    """
+    Function to sum the records by task, by command and by card.
+    Args:
+        records (list): list of record dicts
+    Returns:
+        dict: {'tasks': totals by task name, 'tools': totals by command, 'cards': totals by class:name:locale}
+    """
+    return Aggregator(records).summary()
+
+
+def slowest(records, top=10):
+    """
+    Function to get the cards that took the longest, with the task that took the longest for each.
+    Args:
+        records (list): list of record dicts
+        top (int): number of cards
+    Returns:
+        list: lines to print
+    """
+    return Aggregator(records).slowest(top)
+
+
+def write_report(records, path, summary=None):
+    """
+    Function to write the records to a report, csv if the path ends with .csv, json with a summary otherwise.
+    Args:
+        records (list): list of record dicts
+        path (str): report file path
+        summary (dict): totals of the records if already computed (see Aggregator.summary)
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, 'wb') as handle:
+            writer = csv.DictWriter(handle, FIELDS)
+            writer.writerow(dict(zip(FIELDS, FIELDS)))
+            writer.writerows(records)
+    else:
+        with open(path, 'w') as handle:
+            json.dump({'records': records, 'summary': summary or summarise(records)}, handle, indent=1,
+                      sort_keys=True)
+    logger.info('Wrote report of %s records to %s' % (len(records), path))
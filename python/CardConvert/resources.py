@@ -0,0 +1,190 @@
+import os
+import multiprocessing
+
+logger = multiprocessing.get_logger()
+
+# memory a pool process needs for a card (decoded frames, palettes, encoders), to bound the number of processes
+DEFAULT_WORKER_MEMORY_MB = 512
+# cgroup limits above this are "no limit"
+UNLIMITED = 1 << 60
+MEGABYTE = 1 << 20
+IMAGEMAGICK_TOOLS = ('convert', 'composite')
+
+# budget of this process, installed by the pool initializer (see install)
+_budget = None
+
+
+def _read(path):
+    """
+    Function to read a small file of /proc or /sys.
+    Args:
+        path (str): path to the file
+    Returns:
+        str: stripped content or None if it can't be read
+    """
+    try:
+        with open(path, 'r') as handle:
+            return handle.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _parse_cpu_list(value):
+    """
+    Function to count the cpus of a list like 0-3,8,10-11.
+    Args:
+        value (str): cpu list
+    Returns:
+        int
+    """
+    count = 0
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            count += int(last) - int(first) + 1
+        elif part:
+            count += 1
+    return count
+
+
+def affinity_cpus():
+    """
+    Function to get the number of cpus this process may run on.
+    Returns:
+        int
+    """
+    status = _read('/proc/self/status') or ''
+    for line in status.splitlines():
+        if line.startswith('Cpus_allowed_list:'):
+            return _parse_cpu_list(line.split(':', 1)[1].strip())
+    return multiprocessing.cpu_count()
+
+
+def quota_cpus():
+    """
+    Function to get the cpu quota of the cgroup of this process (eg: docker run --cpus), v2 or v1.
+    Returns:
+        float: number of cpus or None without a quota
+    """
+    value = _read('/sys/fs/cgroup/cpu.max')
+    if value:
+        quota, period = value.split()[:2]
+        if quota != 'max':
+            return float(quota) / float(period)
+        return None
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') or _read('/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us')
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us') or _read('/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return float(quota) / float(period)
+    return None
+
+
+def usable_cpus():
+    """
+    Function to get the number of cpus this process can keep busy: its affinity bounded by the cgroup quota.
+    Returns:
+        int
+    """
+    cpus = affinity_cpus()
+    quota = quota_cpus()
+    if quota:
+        cpus = min(cpus, max(1, int(quota + 0.5)))
+    return max(1, cpus)
+
+
+def usable_memory():
+    """
+    Function to get the memory available to this process: the available memory of the machine bounded by the
+    memory limit of the cgroup.
+    Returns:
+        int: bytes, None if unknown
+    """
+    available = None
+    for line in (_read('/proc/meminfo') or '').splitlines():
+        if line.startswith('MemAvailable:'):
+            available = int(line.split()[1]) * 1024
+    limit = _read('/sys/fs/cgroup/memory.max') or _read('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    if limit and limit != 'max' and int(limit) < UNLIMITED:
+        usage = _read('/sys/fs/cgroup/memory.current') or _read('/sys/fs/cgroup/memory/memory.usage_in_bytes')
+        limit = int(limit) - int(usage or 0)
+        available = limit if available is None else min(available, limit)
+    return available
+
+
+class Budget(object):
+    """ Sizes the pool and shares the cpus and memory between the tools so the machine is neither oversubscribed
+    nor left idle: the pool gets a process per usable cpu (bounded by memory), and a tool that runs N commands at
+    once (tool_limits in the config, or one per process) gets cpus / N threads and memory / N each.
+    """
+    def __init__(self, config, processes=None, cpus=None, memory=None):
+        """
+        Constructor
+        Args:
+            config (dict): configuration
+            processes (int): number of processes of the pool, processes in the config if None, sized from the
+                             cpus and memory if that is auto or not set
+            cpus (int): usable cpus, detected if None
+            memory (int): usable memory in bytes, detected if None
+        """
+        self.cpus = cpus or usable_cpus()
+        self.memory = memory if memory is not None else usable_memory()
+        worker_memory = (config.get('worker_memory_mb') or DEFAULT_WORKER_MEMORY_MB) * MEGABYTE
+        processes = processes or config.get('processes')
+        if not processes or processes == 'auto':
+            processes = self.cpus
+            if self.memory:
+                processes = min(processes, max(1, self.memory // worker_memory))
+        self.processes = int(processes)
+        tool_limits = config.get('tool_limits') or {}
+        cmd_threads = max(1, config.get('cmd_threads') or 1)
+        self.threads = {}
+        self.memory_per_cmd = {}
+        for tool in ('ffmpeg',) + IMAGEMAGICK_TOOLS:
+            running = self.processes * (cmd_threads if tool in IMAGEMAGICK_TOOLS else 1)
+            if tool_limits.get(tool):
+                running = min(running, tool_limits[tool])
+            self.threads[tool] = max(1, self.cpus // running)
+            if self.memory:
+                self.memory_per_cmd[tool] = max(64 * MEGABYTE, self.memory // running)
+
+    def tool_args(self):
+        """
+        Function to get the arguments added to the imagemagick commands to keep them in their budget
+        (see executor.configure).
+        Returns:
+            dict: list of arguments by tool name
+        """
+        args = {}
+        for tool in IMAGEMAGICK_TOOLS:
+            args[tool] = ['-limit', 'thread', str(self.threads[tool])]
+            if tool in self.memory_per_cmd:
+                args[tool] += ['-limit', 'memory', '%sMiB' % (self.memory_per_cmd[tool] // MEGABYTE)]
+        return args
+
+    def __str__(self):
+        memory = '%sMiB' % (self.memory // MEGABYTE) if self.memory else 'unknown memory'
+        return '%s processes on %s cpus and %s, threads per command: %s' % (
+            self.processes, self.cpus, memory, ', '.join(['%s %s' % item for item in sorted(self.threads.items())]))
+
+
+def install(budget):
+    """
+    Function to set the budget of this process, called by the pool initializer (see scheduler.init_worker).
+    Args:
+        budget (Budget): budget
+    """
+    global _budget
+    _budget = budget
+
+
+def tool_threads(tool):
+    """
+    Function to get the number of threads a command of a tool may use in this process.
+    Args:
+        tool (str): tool name
+    Returns:
+        int: threads or None without a budget
+    """
+    if _budget is None:
+        return None
+    return _budget.threads.get(tool)
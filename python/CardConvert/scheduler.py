@@ -0,0 +1,474 @@
+import os
+import errno
+import heapq
+import Queue
+import cPickle
+import traceback
+import multiprocessing
+from multiprocessing.queues import SimpleQueue
+from CardConvert import metrics
+from CardConvert import exceptions
+from CardConvert import executor
+from CardConvert import resources
+
+logger = multiprocessing.get_logger()
+
+
+# configuration of a pool process, installed once by init_worker
+_config = None
+# queue the pool process tells which task it starts on, see TaskScheduler
+_started = None
+
+
+def init_worker(config, limits=None, budget=None, started=None):
+    """
+    This function is the initializer of the pool processes: the configuration is sent once per process instead of
+    with every task, and the executor of the external tools is set up.
+    Args:
+        config (dict): configuration
+        limits (dict): semaphores of the tool limits shared by the pool processes (see executor.make_limits)
+        budget (resources.Budget): threads and memory of the tools
+        started (multiprocessing.queues.SimpleQueue): queue of the (index, task, pid) of the tasks as they start
+    """
+    global _config, _started
+    _config = config
+    _started = started
+    resources.install(budget)
+    executor.configure(limits, timeout=config.get('cmd_timeout'), threads=config.get('cmd_threads'),
+                       tool_args=budget.tool_args() if budget else None)
+
+
+def _alive(pid):
+    """
+    Function to check if a process is still running.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno != errno.ESRCH
+    return True
+
+
+class WorkerPool(object):
+    """ The pool of processes running the tasks, set up with the budget and the tool limits (see init_worker).
+    It can outlive a run, eg: to keep converting new exports with warm processes in watch mode.
+    """
+    def __init__(self, config, processes=None):
+        """
+        Constructor
+        Args:
+            config (dict): configuration
+            processes (int): number of processes, sized by the budget if None (see resources.Budget)
+        """
+        self.budget = resources.Budget(config, processes=processes)
+        self.processes = self.budget.processes
+        limits = executor.make_limits(config.get('tool_limits'))
+        # written synchronously, a pool process killed right after it started a task has told which
+        self.started = SimpleQueue()
+        self.pool = multiprocessing.Pool(processes=self.processes, initializer=init_worker,
+                                         initargs=(config, limits, self.budget, self.started))
+
+    def close(self):
+        """
+        Function to wait for the tasks submitted to the pool and stop its processes.
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        """
+        Function to stop the processes of the pool right away.
+        """
+        self.pool.terminate()
+        self.pool.join()
+
+
+class WorkItem(object):
+    """ What a pool process needs to rebuild a card: its class, name, locale and input files. Tasks are sent to the
+    pool as work items instead of card instances, which carry the configuration and every path of the outputs.
+    The frames are stored as names in one folder when they are all in the same folder, which they are in the
+    Unity exports.
+    """
+    __slots__ = ('card_type', 'name', 'locale', 'static', 'anim_dir', 'frames', 'scratch')
+
+    def __init__(self, instance):
+        """
+        Constructor
+        Args:
+            instance (obj): card instance
+        """
+        static, animated = instance.input_files()
+        self.card_type = type(instance)
+        self.name = instance.name
+        self.locale = instance.locale
+        self.static = static
+        self.scratch = instance.scratch_dir
+        anim_dirs = set([os.path.dirname(frame) for frame in animated])
+        if len(anim_dirs) == 1:
+            self.anim_dir = anim_dirs.pop()
+            self.frames = tuple([os.path.basename(frame) for frame in animated])
+        else:
+            self.anim_dir = None
+            self.frames = tuple(animated)
+
+    def __getstate__(self):
+        return tuple([getattr(self, slot) for slot in self.__slots__])
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def instance(self, config):
+        """
+        Function to rebuild the card.
+        Args:
+            config (dict): configuration
+        Returns:
+            card instance
+        """
+        animated = list(self.frames)
+        if self.anim_dir is not None:
+            animated = [os.path.join(self.anim_dir, frame) for frame in animated]
+        return self.card_type(config, name=self.name, locale=self.locale,
+                              info={'static': self.static, 'animated': animated, 'scratch': self.scratch})
+
+
+def _run_task(index, item, task, output_dir):
+    """
+    This function is called in the pool process to run one task of a card.
+    Args:
+        index (int): index of the card in the scheduler
+        item (WorkItem): card to run the task of
+        task (str): task name
+        output_dir (str): path to write to
+    Returns:
+        index (int): index of the card in the scheduler
+        task (str): task name
+        result: output of the task
+        error (Exception): exception raised by the task or None
+        records (list): timings and resource usage of the task and of the commands it ran (see metrics.measure)
+    """
+    instance = item
+    if _started is not None:
+        _started.put((index, task, os.getpid()))
+    try:
+        instance = item.instance(_config)
+        return index, task, instance.run_task(task, output_dir), None, metrics.drain()
+    except Exception as error:
+        logger.error('Task %s of %s failed\n%s' % (task, instance, traceback.format_exc()))
+        try:
+            cPickle.dumps(error, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            error = Exception(str(error))
+        return index, task, None, error, metrics.drain()
+
+
+class TaskScheduler(object):
+    """ Runs the task graphs (see BasicCard.task_graph) of many cards on one multiprocessing pool. A task is submitted
+    as soon as the tasks it depends on are done, so independent tasks of one card (eg: the resizes and the video
+    encodes of a cardback) run in parallel and the pool stays busy until the very end of a run.
+    Ready tasks are dispatched by rank, the predicted duration of the longest chain of tasks waiting on them
+    (longest processing time first, see costs.CostModel), so the tasks on the critical path of a long animation start
+    first and the run doesn't end on one busy process.
+    Tasks are sent as work items (see WorkItem), the pool must have been created with init_worker as initializer.
+    The timings the pool processes send back with each task (see metrics.measure) are handed to on_records as they
+    come, by default they are gathered in records.
+    A failed task raises its exception in run, unless on_failed is set: then the tasks depending on it are dropped,
+    the other tasks of its card and the other cards go on, and the card is not reported to on_finished.
+    Tasks done in a previous run (see journal.Journal) are not run again as long as all the tasks depending on them
+    are done too, the intermediate files they wrote may be gone.
+    The pool never reports a task whose result can't be sent back or whose process died (eg: killed when out of
+    memory), they are found while waiting for the tasks (see _lost) and fail with a TaskLostError.
+    """
+    def __init__(self, pool, output_dir, slots, on_finished=None, cost=None, lookahead=None, on_records=None,
+                 on_started=None, on_done=None, on_failed=None, done=None, on_settled=None, started=None):
+        """
+        Constructor
+        Args:
+            pool (multiprocessing.Pool): pool to run the tasks on
+            output_dir (str): path to write to
+            slots (int): max number of tasks submitted to the pool at once
+            on_finished (function): called in this process with the instance when all the tasks of a card are done
+            cost (function): called with an instance and a task name to predict the duration of the task, all the
+                             tasks cost the same if None
+            lookahead (int): number of ready tasks to gather from the instances before dispatching the most
+                             expensive ones, slots if None
+            on_records (function): called in this process with the records of each task
+            on_started (function): called in this process with the instance before the first task of a card is
+                                   submitted, eg: to give it a scratch dir (see scratch.Workspace)
+            on_done (function): called in this process with the instance and the task name when a task is done
+            on_failed (function): called in this process with the instance, the task name and the exception when a
+                                  task fails, failures raise in run if None
+            done (function): called with an instance to get the names of its tasks done in a previous run
+            on_settled (function): called in this process with the instance when all the tasks of a card are done or
+                                   dropped, failed or not, eg: to remove its intermediate files
+            started (multiprocessing.queues.SimpleQueue): queue the pool processes tell which task they start on
+                                                          (see WorkerPool), to find the tasks of processes that died
+        """
+        self.pool = pool
+        self.output_dir = output_dir
+        self.slots = slots
+        self.on_finished = on_finished
+        self.cost = cost or (lambda instance, task: 1)
+        self.lookahead = lookahead or slots
+        self._completed = Queue.Queue()
+        self._ready = []
+        self._sequence = 0
+        self._in_flight = 0
+        self.records = []
+        self.on_records = on_records or self.records.extend
+        self.on_started = on_started
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.done = done
+        self.on_settled = on_settled
+        self.started = started
+
+    @staticmethod
+    def _ranks(graph, costs):
+        """
+        Function to compute the rank of each task in a graph: its cost + the rank of the highest ranked task depending
+        on it.
+        Args:
+            graph (list): list of (task name, list of task names it depends on) in a serial order
+            costs (dict): predicted cost by task name
+        Returns:
+            dict: rank by task name
+        """
+        ranks = {}
+        downstream = {}
+        for name, dependencies in reversed(graph):
+            ranks[name] = costs[name] + downstream.get(name, 0)
+            for dependency in dependencies:
+                downstream[dependency] = max(downstream.get(dependency, 0), ranks[name])
+        return ranks
+
+    @staticmethod
+    def _skipped(graph, done):
+        """
+        Function to get the tasks of a graph that don't have to run: the ones that are done and whose dependents
+        don't have to run either.
+        Args:
+            graph (list): list of (task name, list of task names it depends on) in a serial order
+            done (set): names of the tasks that are done
+        Returns:
+            set: task names
+        """
+        dependents = {}
+        for name, dependencies in graph:
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(name)
+        skipped = set()
+        for name, dependencies in reversed(graph):
+            if name in done and all([dependent in skipped for dependent in dependents.get(name, [])]):
+                skipped.add(name)
+        return skipped
+
+    def _push(self, index, task):
+        """
+        Function to queue a task whose dependencies are done.
+        Args:
+            index (int): index of the card
+            task (str): task name
+        """
+        self._sequence += 1
+        heapq.heappush(self._ready, (-self._rank[index][task], self._sequence, index, task))
+
+    def _submit(self):
+        """
+        Function to submit ready tasks to the pool until all the slots are taken.
+        """
+        while self._ready and self._in_flight < self.slots:
+            rank, sequence, index, task = heapq.heappop(self._ready)
+            if index not in self._items:
+                # the work item is made when the card starts, after on_started had a chance to set it up
+                if self.on_started:
+                    self.on_started(self._instances[index])
+                self._items[index] = WorkItem(self._instances[index])
+            self._results[(index, task)] = self.pool.apply_async(_run_task, args=(index, self._items[index], task,
+                                                                                  self.output_dir),
+                                                                 callback=self._completed.put)
+            self._in_flight += 1
+
+    def _lost(self):
+        """
+        Function to find the tasks submitted to the pool that will never complete: their result or exception could
+        not be sent back, or the process running them died.
+        Returns:
+            dict: error of each lost task, by (index, task)
+        """
+        lost = {}
+        for key, result in self._results.items():
+            if result.ready() and not result.successful():
+                try:
+                    result.get(0)
+                except Exception as error:
+                    lost[key] = 'the pool could not return its outcome: %s' % error
+        if self.started is None:
+            return lost
+        while not self.started.empty():
+            index, task, pid = self.started.get()
+            self._running[pid] = (index, task)
+        for pid, key in self._running.items():
+            if _alive(pid):
+                continue
+            del self._running[pid]
+            # a task finished just before its process died may not be ready yet, its result is then ignored
+            if key in self._results and key not in lost and not self._results[key].ready():
+                lost[key] = 'pool process %s died running it' % pid
+        instances = self._instances
+        return dict((key, exceptions.TaskLostError('%s of %s:%s' % (key[1], instances[key[0]].name,
+                                                                    instances[key[0]].locale), 1, '', reason))
+                    for key, reason in lost.items())
+
+    def _add(self, instance):
+        """
+        Function to add the task graph of a card and queue the tasks that don't depend on any other.
+        Args:
+            instance (obj): card instance
+        Returns:
+            int: index of the card
+        """
+        index = self._cards
+        self._cards += 1
+        graph = [(name, dependencies) for name, func, dependencies in instance.task_graph(self.output_dir)]
+        self._instances[index] = instance
+        self._cost[index] = dict((name, self.cost(instance, name)) for name, dependencies in graph)
+        self._rank[index] = self._ranks(graph, self._cost[index])
+        skipped = self._skipped(graph, self.done(instance)) if self.done else set()
+        graph = [(name, set(dependencies) - skipped) for name, dependencies in graph if name not in skipped]
+        self._waiting_on[index] = dict((name, set(dependencies)) for name, dependencies in graph)
+        dependents = {}
+        for name, dependencies in graph:
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(name)
+        self._dependents[index] = dependents
+        self._cancelled[index] = set()
+        self._remaining[index] = len(graph)
+        self._pending += len(graph)
+        for name, dependencies in graph:
+            if not dependencies:
+                self._push(index, name)
+        return index
+
+    def _fail(self, index, task, error):
+        """
+        Function to drop the tasks of a card that depend on a failed task, directly or not.
+        Args:
+            index (int): index of the card
+            task (str): name of the failed task
+            error (Exception): exception raised by the task
+        """
+        self._failed.add(index)
+        self.on_failed(self._instances[index], task, error)
+        todo = list(self._dependents[index].get(task, []))
+        while todo:
+            name = todo.pop()
+            if name not in self._cancelled[index]:
+                self._cancelled[index].add(name)
+                self._remaining[index] -= 1
+                self._pending -= 1
+                todo.extend(self._dependents[index].get(name, []))
+
+    def _finish(self, index):
+        """
+        Function to report a card whose tasks are all done or dropped.
+        Args:
+            index (int): index of the card
+        Returns:
+            str: final output of the card
+        """
+        instance = self._instances[index]
+        failed = index in self._failed
+        self._forget(index)
+        if self.on_settled:
+            self.on_settled(instance)
+        if failed:
+            return 'Failed processing %s:%s' % (instance.name, instance.locale)
+        if self.on_finished:
+            self.on_finished(instance)
+        return 'Finished processing %s:%s' % (instance.name, instance.locale)
+
+    def _forget(self, index):
+        """
+        Function to drop the state of a card whose tasks are all done.
+        Args:
+            index (int): index of the card
+        """
+        for state in (self._instances, self._items, self._cost, self._rank, self._waiting_on, self._dependents,
+                      self._cancelled, self._remaining):
+            state.pop(index, None)
+        self._failed.discard(index)
+
+    def run(self, instances):
+        """
+        Function to run all the tasks of the instances. The instances can come from a generator (see
+        util.iter_card_instances): they are pulled only while fewer tasks than lookahead are ready to be submitted,
+        so the crawl goes on while the pool works and only the cards in progress are held in memory.
+        Args:
+            instances (iterable): card instances
+        Returns:
+            output (list): final output of each instance, in the order they finished
+        """
+        self._instances = {}
+        self._items = {}
+        self._cost = {}
+        self._rank = {}
+        self._waiting_on = {}
+        self._dependents = {}
+        self._remaining = {}
+        self._cancelled = {}
+        self._failed = set()
+        self._results = {}
+        self._running = {}
+        self._cards = 0
+        self._pending = 0
+        output = []
+        cards = iter(instances)
+        exhausted = False
+        while True:
+            while not exhausted and len(self._ready) < self.lookahead:
+                try:
+                    index = self._add(next(cards))
+                except StopIteration:
+                    exhausted = True
+                    continue
+                if not self._remaining[index]:
+                    output.append(self._finish(index))
+            self._submit()
+            if not self._pending:
+                if exhausted:
+                    break
+                continue
+            try:
+                index, task, result, error, records = self._completed.get(True, 1)
+            except Queue.Empty:
+                for (index, task), error in self._lost().items():
+                    logger.error('Task %s was lost, %s' % (error.value, error.stderr))
+                    self._completed.put((index, task, None, error, []))
+                continue
+            if self._results.pop((index, task), None) is None:
+                # already failed as lost
+                continue
+            for record in records:
+                if record['kind'] == 'task':
+                    record['predicted'] = self._cost[index][task]
+            self.on_records(records)
+            self._in_flight -= 1
+            self._pending -= 1
+            self._remaining[index] -= 1
+            if error is not None:
+                if self.on_failed is None:
+                    raise error
+                self._fail(index, task, error)
+            else:
+                if self.on_done:
+                    self.on_done(self._instances[index], task)
+                for dependent in self._dependents[index].get(task, []):
+                    waiting_on = self._waiting_on[index][dependent]
+                    waiting_on.discard(task)
+                    if not waiting_on:
+                        self._push(index, dependent)
+            if not self._remaining[index]:
+                output.append(self._finish(index))
+        return output
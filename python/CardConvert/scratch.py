@@ -0,0 +1,121 @@
+import os
+import shutil
+import logging
+import tempfile
+
+logger = logging.getLogger('CardConvert.scratch')
+
+# max megabytes of intermediate files per pool process in the scratch dir
+DEFAULT_QUOTA_MB = 256
+# free space left alone in the scratch dir, /dev/shm is memory
+RESERVE_MB = 64
+MEGABYTE = 1 << 20
+
+
+def free_space(path):
+    """
+    Function to get the free space of the filesystem of a path.
+    Args:
+        path (str): path
+    Returns:
+        int: bytes available to this user
+    """
+    stats = os.statvfs(path)
+    return stats.f_bavail * stats.f_frsize
+
+
+def _make_root(base):
+    """
+    Function to create the folder of a run in a base folder.
+    Args:
+        base (str): base folder, created if missing
+    Returns:
+        str: path or None if it can't be created
+    """
+    try:
+        if not os.path.isdir(base):
+            os.makedirs(base)
+        return tempfile.mkdtemp(prefix='cardconvert_', dir=base)
+    except OSError as err:
+        logger.warning('Can\'t use %s for intermediate files: %s' % (base, err))
+        return None
+
+
+class Workspace(object):
+    """ Folders for the intermediate files of the cards (eg: the composited cardback frames, the animated pngs
+    converted to gifs), so they are not written to the output folder and deleted again.
+    Each card gets its own folder, in the scratch dir (scratch_dir in the config, eg: /dev/shm) as long as the cards
+    in progress fit in the quota (scratch_quota_mb per pool process) and in its free space, in the spill dir
+    (scratch_spill_dir, the temp dir of the system by default) otherwise. The folders are allocated in the parent
+    process when the first task of a card is submitted (see scheduler.TaskScheduler) so the tasks of a card find
+    them from any pool process, and removed when the card is done, or all at once when the run ends, failed or not.
+    """
+    def __init__(self, config, processes=1):
+        """
+        Constructor
+        Args:
+            config (dict): configuration
+            processes (int): number of processes of the pool
+        """
+        self.quota = (config.get('scratch_quota_mb') or DEFAULT_QUOTA_MB) * MEGABYTE * processes
+        self.root = None
+        if config.get('scratch_dir'):
+            self.root = _make_root(config['scratch_dir'])
+        if self.root is not None:
+            self.quota = min(self.quota, max(0, free_space(self.root) - RESERVE_MB * MEGABYTE))
+        self.spill_root = _make_root(config.get('scratch_spill_dir') or tempfile.gettempdir())
+        self.used = 0
+        self.spilled = 0
+        self._dirs = {}
+
+    def __str__(self):
+        scratch = '%s (%sMiB)' % (self.root, self.quota // MEGABYTE) if self.root else 'no scratch dir'
+        return '%s, spilling to %s' % (scratch, self.spill_root)
+
+    def allocate(self, key, size):
+        """
+        Function to create the folder of the intermediate files of a card.
+        Args:
+            key (str): key of the card (see manifest.Manifest.key)
+            size (int): predicted size of its intermediate files in bytes (see BasicCard.scratch_size)
+        Returns:
+            str: path to the folder, None if the card has no intermediate files
+        """
+        if not size:
+            return None
+        name = key.replace('/', '_')
+        fast = self.root is not None and self.used + size <= self.quota and \
+            size + RESERVE_MB * MEGABYTE <= free_space(self.root)
+        if fast:
+            path = os.path.join(self.root, name)
+            self.used += size
+        elif self.spill_root is not None:
+            path = os.path.join(self.spill_root, name)
+            self.spilled += 1
+            size = 0
+        else:
+            return None
+        os.mkdir(path)
+        self._dirs[key] = (path, size)
+        return path
+
+    def release(self, key):
+        """
+        Function to remove the folder of a card.
+        Args:
+            key (str): key of the card
+        """
+        path, size = self._dirs.pop(key, (None, 0))
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+            self.used -= size
+
+    def cleanup(self):
+        """
+        Function to remove the folders of all the cards, called when the run ends.
+        """
+        for root in (self.root, self.spill_root):
+            if root is not None:
+                shutil.rmtree(root, ignore_errors=True)
+        self._dirs = {}
+        self.used = 0
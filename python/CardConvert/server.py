@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import signal
+import socket
+import timeit
+import logging
+import SocketServer
+from CardConvert import util
+from CardConvert.scheduler import WorkerPool
+
+logger = logging.getLogger('CardConvert.server')
+
+CARD_TYPES = ['cards', 'cardbacks', 'heroes']
+# options of a job passed on to util.execute_pool
+JOB_OPTIONS = ('force', 'report', 'top', 'resume', 'failures_path')
+
+
+def parse_job(line):
+    """
+    Function to parse a job sent to the server, a json object on one line:
+    {"input_path": ..., "output_path": ..., "types": ["cards", ...], "force": false, "report": ..., "top": 10,
+    "resume": false, "failures_path": ...}, only the paths are required.
+    Args:
+        line (str): json line
+    Returns:
+        dict: job with the card types under 'types'
+    """
+    try:
+        job = json.loads(line)
+    except ValueError as err:
+        raise ValueError('Invalid job, expected a json object: %s' % err)
+    if not isinstance(job, dict):
+        raise ValueError('Invalid job, expected a json object')
+    for key in ('input_path', 'output_path'):
+        if not job.get(key):
+            raise ValueError('Invalid job, %s is missing' % key)
+    if not os.path.exists(job['input_path']):
+        raise ValueError('Input path "%s" does not exist' % job['input_path'])
+    job['types'] = job.get('types') or CARD_TYPES
+    unknown = [card_type for card_type in job['types'] if card_type not in CARD_TYPES]
+    if unknown:
+        raise ValueError('Invalid job, unknown card types %s' % ', '.join(unknown))
+    unknown = [key for key in job if key not in JOB_OPTIONS + ('input_path', 'output_path', 'types')]
+    if unknown:
+        raise ValueError('Invalid job, unknown options %s' % ', '.join(unknown))
+    return job
+
+
+class JobHandler(SocketServer.StreamRequestHandler):
+    """ Runs the job a client sends and streams the events of the run back to it, a json object per line (see
+    util.execute_pool), then {"event": "result", "output": [...], "failed": ..., "seconds": ...}, or
+    {"event": "error", "message": ...} if the job can't be run.
+    """
+    def handle(self):
+        self.connected = True
+        line = self.rfile.readline()
+        if not line.strip():
+            # eg: a server checking whether this one is still listening
+            return
+        try:
+            job = parse_job(line)
+        except ValueError as err:
+            self.send({'event': 'error', 'message': str(err)})
+            return
+        start = timeit.default_timer()
+        try:
+            output = self.server.run(job, self.send)
+        except Exception as err:
+            logger.exception('Job %s failed' % job)
+            self.send({'event': 'error', 'message': '%s: %s' % (type(err).__name__, err)})
+            return
+        self.send({'event': 'result', 'output': output, 'seconds': timeit.default_timer() - start,
+                   'failed': bool([line for line in output if line.startswith('Failed processing')])})
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def send(self, event):
+        """
+        Function to send an event to the client. A client that went away doesn't stop the job.
+        Args:
+            event (dict): event
+        """
+        if not self.connected:
+            return
+        try:
+            self.wfile.write('%s\n' % json.dumps(event, sort_keys=True))
+            self.wfile.flush()
+        except socket.error as err:
+            logger.warning('Client went away, the job goes on: %s' % err)
+            self.connected = False
+
+
+class Server(SocketServer.UnixStreamServer):
+    """ Long lived pycc (pycc --serve) taking conversion jobs on a unix socket, so the interpreter start up, the
+    config load and the pool start up are paid once instead of on every call, and the caches of the pool processes
+    stay warm between jobs. The jobs run one at a time on the pool, the clients connecting meanwhile wait for their
+    turn. The config is loaded again, and the pool started again, when its file changes.
+    """
+    def __init__(self, socket_path, config_path=None, processes=None):
+        """
+        Constructor
+        Args:
+            socket_path (str): path of the unix socket, only the user running the server can connect to it
+            config_path (str): path of the config, see util.get_config_path if None
+            processes (int): number of processes of the pool
+        """
+        self.socket_path = socket_path
+        self.config_path = config_path or util.get_config_path()
+        self.processes = processes
+        self.config = None
+        self.config_mtime = None
+        self.workers = None
+        if os.path.exists(socket_path):
+            # a socket left behind by a server that died, unless a server is still listening on it
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except socket.error:
+                os.remove(socket_path)
+            else:
+                raise ValueError('A server is already listening on %s' % socket_path)
+            finally:
+                probe.close()
+        umask = os.umask(0177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path, JobHandler)
+        finally:
+            os.umask(umask)
+        # installed before the pool is started so the pool processes inherit it
+        signal.signal(signal.SIGTERM, self._terminate)
+        self.pid = os.getpid()
+        self.warm_up()
+
+    def _terminate(self, signum, frame):
+        """
+        Handler of SIGTERM, it stops serving (see serve).
+        """
+        if os.getpid() == self.pid:
+            raise KeyboardInterrupt()
+        # in a pool process it exits releasing the locks of the pool it holds, eg: when the whole process group is
+        # terminated, so the pool can still be terminated
+        raise SystemExit(128 + signum)
+
+    def warm_up(self):
+        """
+        Function to load the config and start the pool, again if the config changed since they were.
+        """
+        mtime = os.stat(self.config_path).st_mtime
+        if mtime == self.config_mtime:
+            return
+        if self.workers is not None:
+            logger.info('%s changed, starting the pool again' % self.config_path)
+            self.workers.close()
+        self.config = util.load_config(self.config_path)
+        self.config_mtime = mtime
+        self.workers = WorkerPool(self.config, processes=self.processes)
+        logger.info('Using %s' % self.workers.budget)
+
+    def run(self, job, progress):
+        """
+        Function to run a job on the pool.
+        Args:
+            job (dict): job (see parse_job)
+            progress (function): called with each event of the run
+        Returns:
+            list: final output
+        """
+        self.warm_up()
+        logger.info('Converting %s of %s to %s' % (', '.join(job['types']), job['input_path'], job['output_path']))
+        options = dict((key, job[key]) for key in JOB_OPTIONS if job.get(key) is not None)
+        return util.execute_pool(job['types'], self.config, job['input_path'], job['output_path'],
+                                 workers=self.workers, progress=progress, **options)
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], KeyboardInterrupt):
+            # the server was stopped in the middle of a job
+            raise
+        logger.exception('Error handling a job')
+
+    def serve(self):
+        """
+        Function to take jobs until interrupted or terminated.
+        """
+        logger.info('Serving on %s' % self.socket_path)
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            logger.info('Stopped serving on %s' % self.socket_path)
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            if self.workers is not None:
+                self.workers.terminate()
+
+
+def submit(socket_path, job):
+    """
+    Generator sending a job to a server (see Server) and yielding its events as they come.
+    Args:
+        socket_path (str): path of the unix socket of the server
+        job (dict): job (see parse_job)
+    Yields:
+        dict: event
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        client.sendall('%s\n' % json.dumps(job))
+        for line in iter(client.makefile('r').readline, ''):
+            yield json.loads(line)
+    finally:
+        client.close()
@@ -0,0 +1,329 @@
+import os
+import re
+import csv
+import json
+import time
+import errno
+import shutil
+import socket
+import hashlib
+import logging
+from CardConvert import metrics
+from CardConvert.costs import CostModel
+from CardConvert.discovery import INDEX_NAME, INDEX_VERSION
+from CardConvert.journal import FAILURES_NAME
+from CardConvert.manifest import Manifest
+
+logger = logging.getLogger('CardConvert.sharding')
+
+# seconds after which the lease of a card whose node didn't finish it can be taken over by another node
+DEFAULT_LEASE_TIMEOUT = 3600
+DONE_SUFFIX = '.done'
+# the files of a node are named after the files of the output tree with node-<node name> before the extension
+NODE_PREFIX = 'node-'
+NODE_RE = r'[A-Za-z0-9_.-]+'
+
+
+def parse_shard(value):
+    """
+    Function to parse a shard given as i/N (eg: 0/4 for the first of 4 shards).
+    Args:
+        value (str): shard
+    Returns:
+        index (int): index of the shard, from 0
+        count (int): number of shards
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError('Invalid shard %s, expected i/N' % value)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('Invalid shard %s, expected 0 <= i < N' % value)
+    return index, count
+
+
+def _hash(key):
+    return hashlib.sha1(key).hexdigest()
+
+
+def node_name(path, node):
+    """
+    Function to get the name of the file of a node from the name of a file of the output tree,
+    eg: .cardconvert_manifest.json -> .cardconvert_manifest.node-0-of-4.json
+    Args:
+        path (str): file name or path
+        node (str): node name
+    Returns:
+        str
+    """
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s%s' % (root, NODE_PREFIX, node, ext)
+
+
+class Shard(object):
+    """ The part of the cards of a run one pycc process (a node) is responsible for, so several machines or
+    containers can share one input and output tree.
+    With --shard i/N the cards are split by a hash of their class, locale and name, every node gets the same split
+    without talking to the others. With a lease directory on a filesystem shared by the nodes, the nodes take the
+    cards as they find them: a node leases a card by creating a file named after it, the nodes that find the lease
+    leave the card alone. A lease not finished after lease_timeout seconds is taken to be from a node that died.
+    Each node keeps its manifest, costs, directory index, journal and reports in files of its own in the output tree,
+    merged into the ones of the tree at the end (see merge).
+    """
+    def __init__(self, index=0, count=1, lease_dir=None, node=None, lease_timeout=None):
+        """
+        Constructor
+        Args:
+            index (int): index of the shard, from 0
+            count (int): number of shards
+            lease_dir (str): directory of the leases, cards are not leased if None
+            node (str): name of this node, i-of-N with shards, host-pid with leases, set it to resume a node, only
+                        letters, digits and _.-
+            lease_timeout (int): seconds after which a lease can be taken over
+        """
+        self.index = index
+        self.count = count
+        self.lease_dir = lease_dir
+        self.lease_timeout = lease_timeout or DEFAULT_LEASE_TIMEOUT
+        if node is None and count > 1:
+            node = '%s-of-%s' % (index, count)
+        if node is None and lease_dir:
+            node = '%s-%s' % (socket.gethostname(), os.getpid())
+        if node is not None and not re.match(r'^%s$' % NODE_RE, node):
+            raise ValueError('Invalid node name %s, expected letters, digits and _.-' % node)
+        self.node = node
+        if lease_dir and not os.path.isdir(lease_dir):
+            try:
+                os.makedirs(lease_dir)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+    @property
+    def active(self):
+        """
+        Property that tells if this process shares the run with other nodes.
+        Returns:
+            bool
+        """
+        return self.node is not None
+
+    def __str__(self):
+        if not self.active:
+            return 'all the cards'
+        if self.lease_dir:
+            return 'node %s, shard %s/%s, leasing cards in %s' % (self.node, self.index, self.count, self.lease_dir)
+        return 'node %s, shard %s/%s' % (self.node, self.index, self.count)
+
+    def state_name(self, name):
+        """
+        Function to get the name of a file of this node (see node_name).
+        Args:
+            name (str): name of the file of the output tree
+        Returns:
+            str: None if this process doesn't share the run
+        """
+        return node_name(name, self.node) if self.active else None
+
+    def state_path(self, path):
+        """
+        Function to get the path of a file of this node (see node_name).
+        Args:
+            path (str): path of the file of the output tree
+        Returns:
+            str: path unchanged if this process doesn't share the run
+        """
+        return node_name(path, self.node) if self.active and path else path
+
+    def owns(self, key):
+        """
+        Function to check if a card belongs to this shard.
+        Args:
+            key (str): key of the card (see manifest.Manifest.key)
+        Returns:
+            bool
+        """
+        return self.count <= 1 or int(_hash(key), 16) % self.count == self.index
+
+    def claim(self, key):
+        """
+        Function to lease a card for this node.
+        Args:
+            key (str): key of the card
+        Returns:
+            bool: True if this node has to process the card
+        """
+        if not self.lease_dir:
+            return True
+        path = os.path.join(self.lease_dir, _hash(key))
+        if os.path.exists(path + DONE_SUFFIX):
+            return False
+        for attempt in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0644)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+                if not self._take_over(path, key):
+                    return False
+                continue
+            try:
+                os.write(fd, json.dumps({'key': key, 'node': self.node, 'time': time.time()}))
+            finally:
+                os.close(fd)
+            return True
+        return False
+
+    def _take_over(self, path, key):
+        """
+        Function to remove the lease of another node if it is stale.
+        Args:
+            path (str): lease path
+            key (str): key of the card
+        Returns:
+            bool: True if the lease was removed
+        """
+        try:
+            if time.time() - os.stat(path).st_mtime < self.lease_timeout:
+                return False
+        except OSError:
+            # the lease was finished or taken over meanwhile
+            return not os.path.exists(path + DONE_SUFFIX)
+        # only one of the nodes renaming the stale lease at once succeeds
+        stale = '%s.stale-%s' % (path, self.node)
+        try:
+            os.rename(path, stale)
+        except OSError:
+            return False
+        if time.time() - os.stat(stale).st_mtime < self.lease_timeout:
+            # another node took it over right before the rename, give it back
+            os.rename(stale, path)
+            return False
+        os.remove(stale)
+        logger.warning('Taking over the stale lease of %s' % key)
+        return True
+
+    def finish(self, key):
+        """
+        Function to mark the lease of a card as finished, the other nodes leave the card alone until the leases are
+        removed (see merge). Failed cards are finished too, they are retried by the next run.
+        Args:
+            key (str): key of the card
+        """
+        if not self.lease_dir:
+            return
+        path = os.path.join(self.lease_dir, _hash(key))
+        try:
+            os.rename(path, path + DONE_SUFFIX)
+        except OSError as err:
+            if not os.path.exists(path + DONE_SUFFIX):
+                logger.warning('Could not finish the lease of %s: %s' % (key, err))
+
+
+def _node_files(path):
+    """
+    Function to find the files of the nodes of a file of the output tree (see node_name), the other files next to
+    it (eg: report.summary.json next to report.json) are left alone.
+    Args:
+        path (str): path of the file of the output tree
+    Returns:
+        list: paths
+    """
+    root, ext = os.path.splitext(path)
+    folder, base = os.path.split(root)
+    pattern = re.compile(r'^%s\.%s%s%s$' % (re.escape(base), re.escape(NODE_PREFIX), NODE_RE, re.escape(ext)))
+    if not os.path.isdir(folder or '.'):
+        return []
+    return sorted([os.path.join(folder, name) for name in os.listdir(folder or '.') if pattern.match(name)])
+
+
+def _merge_report(report):
+    """
+    Function to merge the reports of the nodes into one (see metrics.write_report).
+    Args:
+        report (str): path of the report
+    Returns:
+        list: paths of the reports of the nodes
+    """
+    paths = _node_files(report)
+    if not paths:
+        return paths
+    if report.lower().endswith('.csv'):
+        with open(report, 'wb') as handle:
+            writer = csv.DictWriter(handle, metrics.FIELDS)
+            writer.writerow(dict(zip(metrics.FIELDS, metrics.FIELDS)))
+            for path in paths:
+                with open(path, 'rb') as node_handle:
+                    writer.writerows(csv.DictReader(node_handle))
+        logger.info('Merged %s reports into %s' % (len(paths), report))
+    else:
+        records = []
+        for path in paths:
+            with open(path, 'r') as handle:
+                records.extend(json.load(handle)['records'])
+        metrics.write_report(records, report)
+    return paths
+
+
+def merge(output_dir, report=None, lease_dir=None):
+    """
+    Function to merge the manifests, costs, directory indexes, failure reports and reports of the nodes of a run
+    into the ones of the output tree, run once all the nodes are done.
+    Args:
+        output_dir (str): base output path
+        report (str): path of the report the nodes were given (see metrics.write_report), not merged if None
+        lease_dir (str): directory of the leases, removed if set
+    Returns:
+        list: lines to print
+    """
+    merged = []
+    lines = []
+    manifest = Manifest(output_dir)
+    paths = _node_files(manifest.path)
+    for path in paths:
+        manifest.load(path)
+    manifest.save()
+    merged += paths
+    lines.append('Merged %s manifests' % len(paths))
+    costs = CostModel(output_dir)
+    paths = _node_files(costs.path)
+    for path in paths:
+        costs.load(path)
+    costs.save()
+    merged += paths
+    # the listings of the nodes are all valid, keyed by directory
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    paths = _node_files(index_path)
+    if paths:
+        dirs = {}
+        for path in [index_path] + paths:
+            if os.path.isfile(path):
+                with open(path, 'r') as handle:
+                    dirs.update(json.load(handle).get('dirs', {}))
+        with open('%s.tmp' % index_path, 'w') as handle:
+            json.dump({'version': INDEX_VERSION, 'dirs': dirs}, handle, indent=1, sort_keys=True)
+        os.rename('%s.tmp' % index_path, index_path)
+        merged += paths
+    failures_path = os.path.join(output_dir, FAILURES_NAME)
+    paths = _node_files(failures_path)
+    failures = []
+    for path in paths:
+        with open(path, 'r') as handle:
+            failures.extend(json.load(handle)['failures'])
+    if failures:
+        with open(failures_path, 'w') as handle:
+            json.dump({'failures': failures}, handle, indent=1, sort_keys=True)
+        lines.append('%s tasks failed, see %s' % (len(failures), failures_path))
+    elif os.path.isfile(failures_path):
+        os.remove(failures_path)
+    merged += paths
+    if report:
+        paths = _merge_report(report)
+        merged += paths
+        lines.append('Merged %s reports into %s' % (len(paths), report))
+    for path in merged:
+        os.remove(path)
+    if lease_dir and os.path.isdir(lease_dir):
+        shutil.rmtree(lease_dir)
+        lines.append('Removed the leases in %s' % lease_dir)
+    return lines
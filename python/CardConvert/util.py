@@ -1,12 +1,26 @@
 import os
 import re
 import yaml
+import signal
 import inspect
 import logging
 import multiprocessing
 from cards.cards import Cards
 from cards.heroes import Heroes
 from cards.cardbacks import CardBacks
+from CardConvert import files as files_
+from CardConvert import metrics
+from CardConvert import assets
+from CardConvert import imaging
+from CardConvert.discovery import DirectoryIndex, INDEX_NAME
+from CardConvert.costs import CostModel, accuracy
+from CardConvert.manifest import Manifest
+from CardConvert.journal import Journal, JOURNAL_NAME, FAILURES_NAME, stamp, failure, write_failures
+from CardConvert.manifest import MANIFEST_NAME
+from CardConvert.costs import COSTS_NAME
+from CardConvert.sharding import Shard
+from CardConvert.scratch import Workspace
+from CardConvert.scheduler import TaskScheduler, WorkerPool
 
 logger = multiprocessing.get_logger()
 handler = logging.StreamHandler()
@@ -15,6 +29,9 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 
+# number of ready tasks gathered from the crawl to pick the most expensive ones from
+DEFAULT_LOOKAHEAD = 256
+
 
 def get_config_path():
     """
@@ -48,17 +65,17 @@ def load_config(config_path=''):
     return config
 
 
-def get_card_instances(card_types, config, input_path):
+def card_roots(card_types, config, input_path):
     """
-    Function to create instances of card types in the input_path
+    Function to get the card classes of card types with the folder their cards are in.
     Args:
-        card_types (list): list of card types to search ['cards', 'cardbacks', 'heroes']
+        card_types (list): list of card types ['cards', 'cardbacks', 'heroes']
         config (dict): configuration
-        input_path (str): path to look in
+        input_path (str): input path
     Returns:
-        instances (list): list of created instances
+        list: (card class instance, path) tuples
     """
-    instances = []
+    roots = []
     for card_type in card_types:
         obj = None
         if card_type == 'cards':
@@ -68,40 +85,311 @@ def get_card_instances(card_types, config, input_path):
         if card_type == 'heroes':
             obj = Heroes(config)
         if obj:
-            path = os.path.join(input_path, config['card_types'][obj.card_class]['unity_folder'])
-            card_dict = obj.crawl_for_this_card_class(path)
-            instances += obj.create_instances(card_dict)
-    return instances
+            roots.append((obj, os.path.join(input_path, config['card_types'][obj.card_class]['unity_folder'])))
+    return roots
 
 
-def _execute_pool(instance, output_path):
+def iter_card_instances(card_types, config, input_path, index=None):
     """
-    This function is called by each instance in the process pool
+    Generator yielding instances of card types in the input_path as the crawl finds them.
     Args:
-        instance (obj): instance to execute
-        output_path (str): path to write to
+        card_types (list): list of card types to search ['cards', 'cardbacks', 'heroes']
+        config (dict): configuration
+        input_path (str): path to look in
+        index (discovery.DirectoryIndex): index of the directory listings of the last run, shared by the card types
+    Yields:
+        card instance
+    """
+    for obj, path in card_roots(card_types, config, input_path):
+        for instance in obj.iter_instances(path, index=index):
+            yield instance
+
+
+def get_card_instances(card_types, config, input_path, index=None):
+    """
+    Function to create instances of card types in the input_path
+    Args:
+        card_types (list): list of card types to search ['cards', 'cardbacks', 'heroes']
+        config (dict): configuration
+        input_path (str): path to look in
+        index (discovery.DirectoryIndex): index of the directory listings of the last run, shared by the card types
     Returns:
-        final output
+        instances (list): list of created instances
+    """
+    return list(iter_card_instances(card_types, config, input_path, index=index))
+
+
+def materialise_duplicate(primary, duplicate, output_path, mode):
+    """
+    Function to create the outputs of a card from the outputs of another card with identical inputs
+    (eg: the same art in two locales) instead of rendering them again.
+    Args:
+        primary (obj): card instance whose outputs were rendered
+        duplicate (obj): card instance to create the outputs of
+        output_path (str): path to write to
+        mode (str): hardlink, reflink or copy (see files.place_file)
     """
-    return instance.process(output_path)
+    sources = primary.output_files(output_path)
+    for output_type, files in duplicate.output_files(output_path).items():
+        for src, dst in zip(sources.get(output_type, []), files):
+            if not os.path.isfile(src):
+                continue
+            files_.make_dirs([os.path.dirname(dst)])
+            used = files_.place_file(src, dst, mode=mode)
+            logger.debug('Placed %s ---> %s (%s)' % (src, dst, used))
 
 
-def execute_pool(card_types, config, input_path, output_path, processes=None):
+def interrupt_on_sigterm():
+    """
+    Function to make SIGTERM interrupt a run like Ctrl-C does, so an aborted run still closes its journal and writes
+    its failures (see execute_pool). To be installed before the pool is started so the pool processes inherit it.
     """
-    This function executes the conversion process in a multiprocessing.pool to run in conversion in parallel
+    pid = os.getpid()
+
+    def terminate(signum, frame):
+        if os.getpid() == pid:
+            raise KeyboardInterrupt()
+        # a pool process exits releasing the locks of the pool it holds, so the pool can still be terminated
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+
+def execute_pool(card_types, config, input_path, output_path, processes=None, force=False, report=None, top=10,
+                 resume=False, failures_path=None, shard=None, workers=None, dirs=None, progress=None):
+    """
+    This function executes the conversion process in a multiprocessing.pool to run in conversion in parallel.
+    The input directories are listed through an index kept in the output_path (see discovery.DirectoryIndex) so the
+    ones that didn't change since the last run are not read again.
+    The cards are broken down into tasks (see BasicCard.task_graph) which are scheduled across the whole pool as
+    soon as the crawl finds them, so the pool doesn't wait for the whole input tree to be crawled. Out of the tasks
+    gathered (lookahead in the config) the ones predicted to take the longest are dispatched first
+    (see costs.CostModel).
+    Cards whose inputs, config and outputs didn't change since the last run (see manifest.Manifest) are skipped.
+    Cards with identical inputs (eg: the same art in several locales) are rendered once and the outputs of the others
+    are linked to those (link_mode in the config).
+    Every output is written under a temp name and renamed when complete (see files.atomic_outputs), and every task
+    done is journaled (see journal.Journal) so an interrupted run can be resumed without running its tasks again.
+    A failed task doesn't stop the run: the tasks depending on it are dropped, the failure is written to a report and
+    the card is processed again by the next run.
+    Several pycc processes, on one or several machines, can share a run (see sharding.Shard): each processes its
+    shard of the cards or the cards it leased, and keeps its manifest, costs, index, journal and reports in files of
+    its own until they are merged (see sharding.merge).
+    Intermediate files (eg: the composited cardback frames) are written to a scratch dir (scratch_dir in the config,
+    see scratch.Workspace) and removed when their card is done or the run ends.
+    The backgrounds are decoded once into a cache shared by the pool processes (asset_cache_dir in the config, see
+    assets.prepare).
+    The time and resources taken by every task and command are recorded (see metrics.measure), the slowest cards are
+    logged and the records can be written to a report.
     Args:
         card_types (list): list of card types to search ['cards', 'cardbacks', 'heroes']
         config (dict): configuration
         input_path (str): path to look in
         output_path (str): path to write to
-        processes (int): number of process in the pool
+        processes (int): number of process in the pool, processes in the config if None, sized from the usable cpus
+                         and memory if that is auto (see resources.Budget)
+        force (bool): process all the cards even if they are up to date
+        report (str): path of the json or csv report of the timings, no report if None
+        top (int): number of the slowest cards to log
+        resume (bool): don't run again the tasks done by the last run (see journal.Journal)
+        failures_path (str): path of the json report of the failed tasks, cardconvert_failures.json in the
+                             output_path if None
+        shard (sharding.Shard): part of the cards this process is responsible for, all of them if None
+        workers (scheduler.WorkerPool): pool to run the tasks on, kept open, a pool is made for this run if None
+        dirs (set): absolute paths of the folders to look at the cards of (the folders of their static file), all of
+                    them if None (see watch.watch)
+        progress (function): called with an event dict for each card skipped, linked, started, failed or finished
+                             and each task done, as the run goes (see server.Server)
     Returns:
         output : final output
     """
-    if not processes:
-        processes = config['processes']
-    instances = get_card_instances(card_types, config, input_path)
-    pool = multiprocessing.Pool(processes=processes)
-    results = [pool.apply_async(_execute_pool, args=(instance, output_path)) for instance in instances]
-    output = [p.get() for p in results]
-    return output
+    own_workers = workers is None
+    if own_workers:
+        workers = WorkerPool(config, processes=processes)
+        logger.info('Using %s' % workers.budget)
+    processes = workers.processes
+    link_mode = config.get('link_mode', 'copy')
+    shard = shard or Shard()
+    if shard.active:
+        logger.info('Processing %s' % shard)
+    manifest = Manifest(output_path, name=shard.state_name(MANIFEST_NAME))
+    index_path = os.path.join(output_path, INDEX_NAME)
+    index = DirectoryIndex(shard.state_path(index_path), base=index_path)
+    costs = CostModel(output_path, name=shard.state_name(COSTS_NAME))
+    workspace = Workspace(config, processes=processes)
+    journal = Journal(output_path, resume=resume, name=shard.state_name(JOURNAL_NAME))
+    failures_path = shard.state_path(failures_path or os.path.join(output_path, FAILURES_NAME))
+    report = shard.state_path(report)
+    failures = []
+    stamps = {}
+    logger.info('Intermediate files in %s' % workspace)
+    cached = assets.prepare(config, imaging.get_engine(config.get('image_engine')))
+    if cached:
+        logger.info('Cached %s backgrounds in %s' % (cached, config['asset_cache_dir']))
+    inputs = {}
+    duplicates = {}
+    by_content = {}
+    content_keys = {}
+    failed_content = {}
+    finished_keys = set()
+    counts = {'found': 0, 'processed': 0, 'linked': 0, 'elsewhere': 0}
+    skipped = []
+    output = []
+
+    def notify(event, instance, **details):
+        if progress is not None:
+            details.update({'event': event, 'card_class': instance.card_class, 'name': instance.name,
+                            'locale': instance.locale})
+            progress(details)
+
+    def link(primary, duplicate):
+        materialise_duplicate(primary, duplicate, output_path, link_mode)
+        manifest.update(duplicate, inputs.pop(manifest.key(duplicate)))
+        shard.finish(manifest.key(duplicate))
+        output.append('Linked %s:%s to %s:%s' % (duplicate.name, duplicate.locale, primary.name, primary.locale))
+        notify('linked', duplicate, primary=primary.name, primary_locale=primary.locale)
+
+    def to_process():
+        # cards are checked against the manifest as the crawl finds them and handed to the scheduler right away
+        for instance in iter_card_instances(card_types, config, input_path, index=index):
+            if dirs is not None and os.path.abspath(os.path.dirname(instance.input_files()[0])) not in dirs:
+                continue
+            counts['found'] += 1
+            key = manifest.key(instance)
+            if not shard.owns(key):
+                counts['elsewhere'] += 1
+                continue
+            inputs[key] = manifest.inputs(instance)
+            if not force and manifest.is_current(instance, inputs[key]):
+                skipped.append('Up to date %s:%s' % (instance.name, instance.locale))
+                notify('up_to_date', instance)
+                del inputs[key]
+                continue
+            if not shard.claim(key):
+                counts['elsewhere'] += 1
+                del inputs[key]
+                continue
+            # outputs are about to be rewritten, make sure they don't share an inode with the outputs of another card
+            for files in instance.output_files(output_path).values():
+                for path in files:
+                    files_.break_link(path)
+            content_key = manifest.content_key(instance, inputs[key])
+            stamps[key] = stamp(content_key)
+            if content_key in failed_content:
+                # identical to a card that already failed, it would fail the same way
+                counts['linked'] += 1
+                primary_key, task, error = failed_content[content_key]
+                failures.append(dict(failure(instance, task, error), duplicate_of=primary_key))
+                notify('failed', instance, task=task, error=str(error))
+                shard.finish(key)
+                del inputs[key]
+                stamps.pop(key, None)
+                continue
+            primary = by_content.get(content_key)
+            if primary is not None:
+                counts['linked'] += 1
+                if manifest.key(primary) in finished_keys:
+                    link(primary, instance)
+                else:
+                    duplicates[manifest.key(primary)].append(instance)
+                continue
+            if content_key is not None:
+                by_content[content_key] = instance
+                content_keys[key] = content_key
+            duplicates[key] = []
+            counts['processed'] += 1
+            # the output folders are made here, once per folder for the whole run, instead of by a task of each card
+            files_.make_dirs(instance.output_dirs(output_path))
+            instance.folders_made = True
+            yield instance
+        index.save()
+        logger.info('Found %s cards (%s directories read, %s unchanged since the last run): %s to process, '
+                    '%s up to date, %s identical to another card, %s for other nodes' % (
+                        counts['found'], index.misses, index.hits, counts['processed'], len(skipped),
+                        counts['linked'], counts['elsewhere']))
+
+    def started(instance):
+        key = manifest.key(instance)
+        instance.scratch_dir = workspace.allocate(key, instance.scratch_size(inputs[key]))
+        notify('started', instance)
+
+    def done(instance, task):
+        key = manifest.key(instance)
+        journal.record(key, stamps[key], task)
+        notify('task', instance, task=task)
+
+    def failed(instance, task, error):
+        key = manifest.key(instance)
+        failures.append(failure(instance, task, error))
+        notify('failed', instance, task=task, error=str(error))
+        shard.finish(key)
+        # the cards waiting to be linked to this one, or found identical to it later in the crawl, are processed by
+        # the next run
+        content_key = content_keys.pop(key, None)
+        if content_key is not None:
+            del by_content[content_key]
+            failed_content[content_key] = (key, task, error)
+        for duplicate in duplicates.pop(key, []):
+            failures.append(dict(failure(duplicate, task, error), duplicate_of=key))
+            notify('failed', duplicate, task=task, error=str(error))
+            shard.finish(manifest.key(duplicate))
+
+    def settled(instance):
+        # the intermediate files of a failed card go too, its remaining tasks are dropped
+        key = manifest.key(instance)
+        stamps.pop(key, None)
+        workspace.release(key)
+
+    def finished(instance):
+        key = manifest.key(instance)
+        shard.finish(key)
+        manifest.update(instance, inputs.pop(key))
+        finished_keys.add(key)
+        content_keys.pop(key, None)
+        notify('finished', instance, **aggregator.cards.get('%s:%s:%s' % (instance.card_class, instance.name,
+                                                                         instance.locale), {}))
+        for duplicate in duplicates.pop(key):
+            link(instance, duplicate)
+
+    aggregator = metrics.Aggregator(keep=bool(report))
+
+    def gather(records):
+        aggregator.add(records)
+        costs.update(records)
+
+    scheduler = TaskScheduler(workers.pool, output_path, slots=processes * 2, on_finished=finished,
+                              cost=lambda instance, task: costs.predict(instance, task,
+                                                                         inputs.get(manifest.key(instance))),
+                              lookahead=config.get('lookahead', DEFAULT_LOOKAHEAD), on_records=gather,
+                              on_started=started, on_done=done, on_failed=failed, on_settled=settled,
+                              started=workers.started,
+                              done=lambda instance: journal.done(manifest.key(instance),
+                                                                 stamps[manifest.key(instance)]))
+    complete = False
+    try:
+        output = scheduler.run(to_process()) + output
+        if own_workers:
+            workers.close()
+        complete = not failures
+    except:
+        if own_workers:
+            workers.terminate()
+        raise
+    finally:
+        journal.close(remove=complete)
+        if failures:
+            write_failures(failures, failures_path)
+        elif os.path.isfile(failures_path):
+            os.remove(failures_path)
+        workspace.cleanup()
+        if workspace.spilled:
+            logger.info('%s cards did not fit in the scratch dir and spilled to %s' % (workspace.spilled,
+                                                                                     workspace.spill_root))
+        manifest.save()
+        costs.save()
+        if aggregator.cards:
+            logger.info('Slowest cards:\n%s' % '\n'.join(aggregator.slowest(top)))
+            logger.info('\n'.join(accuracy(aggregator.cards, processes)))
+        if report:
+            metrics.write_report(aggregator.records, report, summary=aggregator.summary())
+    return skipped + output
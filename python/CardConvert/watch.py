@@ -0,0 +1,204 @@
+import os
+import time
+import logging
+from CardConvert import util
+from CardConvert.discovery import list_dir
+from CardConvert.scheduler import WorkerPool
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+logger = logging.getLogger('CardConvert.watch')
+
+# seconds a folder has to be left alone before its cards are converted, exports are written a frame at a time
+DEFAULT_SETTLE_SECONDS = 2
+# seconds between two scans of the input tree when inotify is not available
+DEFAULT_POLL_SECONDS = 5
+
+
+class PollingWatcher(object):
+    """ Finds the folders of a tree whose files changed by comparing scans of the tree: the files of every folder
+    with their size and mtime. Used when inotify (pyinotify) is not available, eg: on network filesystems.
+    """
+    def __init__(self, roots, interval=None):
+        """
+        Constructor
+        Args:
+            roots (list): folders to watch
+            interval (float): seconds between two scans
+        """
+        self.roots = roots
+        self.interval = interval or DEFAULT_POLL_SECONDS
+        self._last = 0
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        """
+        Function to scan the watched trees.
+        Returns:
+            dict: tuple of (name, size, mtime) of the files by absolute folder path
+        """
+        snapshot = {}
+        todo = [os.path.abspath(root) for root in self.roots if os.path.isdir(root)]
+        while todo:
+            path = todo.pop()
+            try:
+                dirs, files = list_dir(path)
+            except OSError:
+                continue
+            entries = []
+            for name in files:
+                try:
+                    stat = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                entries.append((name, stat.st_size, stat.st_mtime))
+            snapshot[path] = tuple(entries)
+            todo.extend([os.path.join(path, name) for name in dirs])
+        return snapshot
+
+    def changes(self, timeout):
+        """
+        Function to wait for changes.
+        Args:
+            timeout (float): max seconds to wait
+        Returns:
+            set: absolute paths of the folders whose files changed
+        """
+        wait = self._last + self.interval - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+        self._last = time.time()
+        snapshot = self._scan()
+        changed = set([path for path, entries in snapshot.items() if self._snapshot.get(path) != entries])
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """ Finds the folders of a tree whose files changed from the inotify events of the tree.
+    """
+    def __init__(self, roots):
+        """
+        Constructor
+        Args:
+            roots (list): folders to watch, their new subfolders are watched too
+        """
+        self._changed = set()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE | \
+            pyinotify.IN_CREATE
+        changed = self._changed
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                changed.add(os.path.abspath(event.path))
+                # files can land in a new folder before it is watched, it is read as a whole
+                if event.dir:
+                    changed.add(os.path.abspath(event.pathname))
+
+        self._manager = pyinotify.WatchManager()
+        self._notifier = pyinotify.Notifier(self._manager, Handler())
+        for root in roots:
+            if os.path.isdir(root):
+                self._manager.add_watch(root, mask, rec=True, auto_add=True)
+
+    def changes(self, timeout):
+        """
+        Function to wait for changes.
+        Args:
+            timeout (float): max seconds to wait
+        Returns:
+            set: absolute paths of the folders whose files changed
+        """
+        if self._notifier.check_events(timeout=int(timeout * 1000)):
+            self._notifier.read_events()
+            self._notifier.process_events()
+        changed = set(self._changed)
+        self._changed.clear()
+        return changed
+
+    def close(self):
+        self._notifier.stop()
+
+
+def make_watcher(roots, config):
+    """
+    Function to get a watcher of the input trees, inotify if available (pyinotify) unless watch_poll_seconds is set
+    in the config, polling otherwise.
+    Args:
+        roots (list): folders to watch
+        config (dict): configuration
+    Returns:
+        InotifyWatcher or PollingWatcher
+    """
+    if pyinotify is not None and not config.get('watch_poll_seconds'):
+        return InotifyWatcher(roots)
+    return PollingWatcher(roots, interval=config.get('watch_poll_seconds'))
+
+
+def card_dirs(changed, anim_folders):
+    """
+    Function to get the folders of the static files of the cards affected by changes: a change in an animation folder
+    affects the cards of its parent.
+    Args:
+        changed (set): absolute paths of folders
+        anim_folders (set): names of the animation folders of the card classes
+    Returns:
+        set: absolute paths of folders
+    """
+    return set([os.path.dirname(path) if os.path.basename(path) in anim_folders else path for path in changed])
+
+
+def watch(card_types, config, input_path, output_path, processes=None, settle=None, **kwargs):
+    """
+    This function converts the cards of the input_path, then keeps watching it and converts the cards whose files
+    change as soon as their folders are left alone for settle seconds (a partially written animation folder keeps
+    changing), on the same warm pool. Only the cards of the folders that changed are looked at (see
+    util.execute_pool). Runs until interrupted.
+    Args:
+        card_types (list): list of card types to watch ['cards', 'cardbacks', 'heroes']
+        config (dict): configuration
+        input_path (str): path to watch
+        output_path (str): path to write to
+        processes (int): number of processes of the pool
+        settle (float): seconds a folder has to be left alone, watch_settle_seconds in the config if None
+        kwargs: arguments of util.execute_pool
+    """
+    settle = settle or config.get('watch_settle_seconds') or DEFAULT_SETTLE_SECONDS
+    card_roots = util.card_roots(card_types, config, input_path)
+    roots = [path for obj, path in card_roots]
+    anim_folders = set([config['card_types'][obj.card_class]['anim_folder'] for obj, path in card_roots])
+    workers = WorkerPool(config, processes=processes)
+    logger.info('Using %s' % workers.budget)
+    watcher = make_watcher(roots, config)
+    logger.info('Watching %s (%s)' % (', '.join(roots), type(watcher).__name__))
+    pending = {}
+    try:
+        for line in util.execute_pool(card_types, config, input_path, output_path, workers=workers, **kwargs):
+            logger.info(line)
+        while True:
+            now = time.time()
+            for path in card_dirs(watcher.changes(min(settle, 1)), anim_folders):
+                pending[path] = now
+            now = time.time()
+            settled = set([path for path, changed in pending.items() if now - changed >= settle])
+            if not settled:
+                continue
+            for path in settled:
+                del pending[path]
+            logger.info('Converting the cards of %s' % ', '.join(sorted(settled)))
+            for line in util.execute_pool(card_types, config, input_path, output_path, workers=workers,
+                                          dirs=settled, **kwargs):
+                logger.info(line)
+    except KeyboardInterrupt:
+        logger.info('Stopped watching %s' % input_path)
+    finally:
+        watcher.close()
+        workers.terminate()
@@ -0,0 +1,184 @@
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+from CardConvert import animation
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
+
+
+def lzw_decode(data, min_code_size):
+    """
+    Function to decode the LZW data of a gif frame.
+    Args:
+        data (str): data of the sub-blocks of the frame
+        min_code_size (int): LZW minimum code size
+    Returns:
+        list: palette indices
+    """
+    clear = 1 << min_code_size
+    end = clear + 1
+    size = min_code_size + 1
+    table = [[index] for index in range(clear)] + [None, None]
+    output = []
+    previous = None
+    bits = 0
+    count = 0
+    position = 0
+    while True:
+        while count < size:
+            if position >= len(data):
+                return output
+            bits |= ord(data[position]) << count
+            count += 8
+            position += 1
+        code = bits & ((1 << size) - 1)
+        bits >>= size
+        count -= size
+        if code == clear:
+            size = min_code_size + 1
+            table = [[index] for index in range(clear)] + [None, None]
+            previous = None
+            continue
+        if code == end:
+            return output
+        if code < len(table) and table[code] is not None:
+            entry = table[code]
+            if previous is not None:
+                table.append(previous + [entry[0]])
+        else:
+            entry = previous + [previous[0]]
+            table.append(entry)
+        output.extend(entry)
+        previous = entry
+        if len(table) == 1 << size and size < 12:
+            size += 1
+
+
+def _sub_blocks(data, position):
+    blocks = []
+    while True:
+        length = ord(data[position])
+        position += 1
+        if not length:
+            return ''.join(blocks), position
+        blocks.append(data[position:position + length])
+        position += length
+
+
+def decode_gif(path):
+    """
+    Function to read the frames of a gif as they are stored.
+    Args:
+        path (str): gif path
+    Returns:
+        size (tuple): (width, height) of the canvas
+        frames (list): (x, y, palette indices, disposal, transparent index) of each frame
+    """
+    data = open(path, 'rb').read()
+    width, height, flags = struct.unpack('<HHB', data[6:11])
+    position = 13
+    if flags & 0x80:
+        position += 3 * (2 << (flags & 7))
+    control = {}
+    frames = []
+    while data[position] != ';':
+        if data[position] == '!':
+            label = data[position + 1]
+            block, position = _sub_blocks(data, position + 2)
+            if label == '\xf9':
+                packed = ord(block[0])
+                control = {'disposal': (packed >> 2) & 7, 'transparency': ord(block[3]) if packed & 1 else None}
+            continue
+        x, y, frame_width, frame_height, flags = struct.unpack('<HHHHB', data[position + 1:position + 10])
+        position += 10
+        if flags & 0x80:
+            position += 3 * (2 << (flags & 7))
+        min_code_size = ord(data[position])
+        block, position = _sub_blocks(data, position + 1)
+        indices = numpy.array(lzw_decode(block, min_code_size)[:frame_width * frame_height], numpy.uint8)
+        frames.append((x, y, indices.reshape((frame_height, frame_width)), control.get('disposal'),
+                       control.get('transparency')))
+    return (width, height), frames
+
+
+def composite_gif(path, loops=2):
+    """
+    Function to play a gif: draw each frame over the canvas, the way a browser does.
+    Args:
+        path (str): gif path
+        loops (int): number of times to play it
+    Returns:
+        list: (height, width) palette indices of the canvas as each frame is shown
+    """
+    (width, height), frames = decode_gif(path)
+    canvas = numpy.full((height, width), animation.TRANSPARENT_INDEX, numpy.uint8)
+    shown = []
+    for loop in range(loops):
+        for x, y, indices, disposal, transparency in frames:
+            region = canvas[y:y + indices.shape[0], x:x + indices.shape[1]]
+            drawn = indices != transparency
+            region[drawn] = indices[drawn]
+            shown.append(canvas.copy())
+            if disposal == animation.CLEAR:
+                region[:] = animation.TRANSPARENT_INDEX
+    return shown
+
+
+@unittest.skipUnless(animation.available(), 'needs Pillow %s.%s or newer and numpy' % animation.MIN_PILLOW_VERSION)
+class WriteAnimationTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.frames = []
+        # a square moving over a gradient, and a corner that turns transparent and back, so frames are kept and
+        # cleared
+        gradient = numpy.tile(numpy.arange(0, 240, 4, dtype=numpy.uint8), (48, 1))
+        for index in range(8):
+            pixels = numpy.zeros((48, 60, 4), numpy.uint8)
+            pixels[:, :, 0] = gradient
+            pixels[:, :, 1] = gradient[:, ::-1]
+            pixels[:, :, 2] = 96
+            pixels[:, :, 3] = 255
+            pixels[10:22, 4 + index * 5:16 + index * 5, :3] = (250, 20, 20)
+            if index % 3 == 1:
+                pixels[30:, 40:, 3] = 0
+            path = os.path.join(self.folder, 'frame_%s.png' % index)
+            Image.fromarray(pixels, 'RGBA').save(path)
+            self.frames.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assertPlaysFrames(self, dither=None):
+        gif_output = os.path.join(self.folder, 'animation.gif')
+        stats = animation.write_animation(self.frames, Image.open, gif_output, dither=dither)
+        palette_image = Image.new('P', (1, 1))
+        palette_image.putpalette(Image.open(gif_output).getpalette())
+        expected = [animation.index_frame(Image.open(path).convert('RGBA'), palette_image, dither=dither)
+                    for path in self.frames]
+        shown = composite_gif(gif_output)
+        self.assertEqual(len(shown), 2 * len(expected))
+        for index, canvas in enumerate(shown):
+            numpy.testing.assert_array_equal(canvas, expected[index % len(expected)],
+                                             'frame %s differs from its source' % index)
+        return stats
+
+    def test_delta_frames(self):
+        stats = self.assertPlaysFrames()
+        self.assertLess(stats['written'], 1)
+
+    def test_delta_frames_ordered_dither(self):
+        self.assertPlaysFrames(dither='ordered')
+
+
+if __name__ == '__main__':
+    unittest.main()
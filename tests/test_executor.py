@@ -0,0 +1,37 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+from CardConvert import executor
+
+
+class RunStdinTest(unittest.TestCase):
+    def test_command_exiting_before_reading_stdin(self):
+        chunks = ('x' * (1 << 16) for chunk in range(64))
+        return_code, stdout_value, stderr_value = executor.run(['head', '-c', '1'], stdin_chunks=chunks)
+        self.assertEqual(return_code, 0)
+        self.assertEqual(stdout_value, 'x')
+
+    def test_chunks_raising_kill_the_command(self):
+        def chunks():
+            yield 'first frame'
+            raise IOError('cannot read frame 2')
+
+        # the command would finish on the truncated stream if its stdin was just closed
+        folder = tempfile.mkdtemp()
+        try:
+            marker = os.path.join(folder, 'done')
+            with self.assertRaises(IOError) as context:
+                executor.run(['sh', '-c', 'cat > /dev/null; touch %s' % marker], stdin_chunks=chunks())
+            self.assertEqual(str(context.exception), 'cannot read frame 2')
+            self.assertFalse(os.path.exists(marker))
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+from CardConvert import animation
+from CardConvert import imaging
+
+
+class GetEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.min_version = animation.MIN_PILLOW_VERSION
+        imaging._engines.clear()
+
+    def tearDown(self):
+        animation.MIN_PILLOW_VERSION = self.min_version
+        imaging._engines.clear()
+
+    def test_pillow_too_old_falls_back_to_imagemagick(self):
+        animation.MIN_PILLOW_VERSION = (animation.pillow_version() or (0, 0))[0] + 1, 0
+        self.assertFalse(animation.available())
+        self.assertEqual(imaging.get_engine('pillow').name, imaging.ImageMagickEngine.name)
+
+    @unittest.skipUnless(animation.available(), 'needs Pillow %s.%s or newer' % animation.MIN_PILLOW_VERSION)
+    def test_pillow(self):
+        self.assertEqual(imaging.get_engine('pillow').name, imaging.PillowEngine.name)
+
+
+@unittest.skipUnless(imaging.PillowEngine.available(), 'needs Pillow %s.%s or newer and numpy' %
+                     animation.MIN_PILLOW_VERSION)
+class RawFramesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_save_and_load(self):
+        engine = imaging.PillowEngine()
+        image = imaging.Image.new('RGBA', (7, 5), (10, 20, 30, 128))
+        image.putpixel((3, 2), (250, 0, 0, 0))
+        path = os.path.join(self.folder, 'frame%s' % engine.frame_ext)
+        engine.save(image, path)
+        loaded = engine.load(path)
+        self.assertEqual(loaded.mode, 'RGBA')
+        self.assertEqual(list(loaded.getdata()), list(image.getdata()))
+        png = os.path.join(self.folder, 'frame.png')
+        engine.save(image, png)
+        self.assertEqual(engine.frame_bytes(png), loaded.size[0] * loaded.size[1] * 4)
+
+
+
+@unittest.skipUnless(imaging.PillowEngine.available(), 'needs Pillow %s.%s or newer and numpy' %
+                     animation.MIN_PILLOW_VERSION)
+class MakeCopiesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # a card with a transparent margin and a soft edge, where flattening before or after the resize differ
+        image = imaging.Image.new('RGBA', (512, 776), (0, 0, 0, 0))
+        for y in range(40, 736):
+            for x in range(30, 482, 3):
+                image.putpixel((x, y), ((x * 7) % 256, (y * 3) % 256, 180, 255 if (x + y) % 5 else 96))
+        self.input_ = os.path.join(self.folder, 'card.png')
+        image.save(self.input_)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def output(self, name, output_type):
+        return os.path.join(self.folder, '%s_%s.%s' % (name, output_type.replace('/', '_'),
+                                                       imaging.DERIVATIVES[output_type].get('ext', 'png')))
+
+    def test_same_as_make_copy(self):
+        engine = imaging.PillowEngine()
+        engine.make_copies(self.input_, [(self.output('copies', output_type), spec)
+                                         for output_type, spec in imaging.DERIVATIVES.items()])
+        # the biggest derivative of each background is resampled from the full resolution, like make_copy does
+        for output_type in ('medium', 'mediumj'):
+            engine.make_copy(self.input_, self.output('copy', output_type), imaging.DERIVATIVES[output_type])
+            with open(self.output('copies', output_type), 'rb') as copies:
+                with open(self.output('copy', output_type), 'rb') as copy:
+                    self.assertEqual(copies.read(), copy.read(), '%s differs from make_copy' % output_type)
+
+
+if __name__ == '__main__':
+    unittest.main()
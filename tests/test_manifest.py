@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+from CardConvert import util
+from CardConvert.manifest import Manifest
+from CardConvert.cards.cardbacks import CardBacks
+
+
+def write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as handle:
+        handle.write(data)
+    # a new mtime even on filesystems with a coarse one, so a rewritten file is never taken for the old one
+    stamp = time.time() + len(data)
+    os.utime(path, (stamp, stamp))
+
+
+class ManifestStalenessTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.root, 'out')
+        self.backgrounds = os.path.join(self.root, 'backgrounds')
+        self.environ = os.environ.get('BACKGROUNDS_FOLDER')
+        os.environ['BACKGROUNDS_FOLDER'] = self.backgrounds
+        self.config = util.load_config()
+        self.bg_path = os.path.join(self.backgrounds, self.config['card_types']['cardbacks']['composite'])
+        write(self.bg_path, 'watermark')
+        self.static = os.path.join(self.root, 'in', 'Cardback_0.png')
+        self.frames = [os.path.join(self.root, 'in', 'animation', 'Cardback_0_%s.png' % index) for index in range(3)]
+        for path in [self.static] + self.frames:
+            write(path, 'art of %s' % os.path.basename(path))
+        self.build()
+
+    def tearDown(self):
+        if self.environ is None:
+            del os.environ['BACKGROUNDS_FOLDER']
+        else:
+            os.environ['BACKGROUNDS_FOLDER'] = self.environ
+        shutil.rmtree(self.root)
+
+    def card(self):
+        return CardBacks(self.config, name='Cardback_0', info={'static': self.static, 'animated': list(self.frames)})
+
+    def build(self):
+        """
+        Function to stand for a run processing the card: its outputs are written and recorded in the manifest.
+        """
+        instance = self.card()
+        manifest = Manifest(self.output_path)
+        for files in instance.output_files(self.output_path).values():
+            for path in files:
+                write(path, 'output')
+        manifest.update(instance, manifest.inputs(instance))
+        manifest.save()
+
+    def is_current(self):
+        instance = self.card()
+        manifest = Manifest(self.output_path)
+        return manifest.is_current(instance, manifest.inputs(instance))
+
+    def test_unchanged(self):
+        self.assertTrue(self.is_current())
+
+    def test_static_changed(self):
+        write(self.static, 'new art')
+        self.assertFalse(self.is_current())
+
+    def test_frame_changed(self):
+        write(self.frames[1], 'new frame')
+        self.assertFalse(self.is_current())
+
+    def test_touched_but_identical(self):
+        write(self.frames[1], 'art of %s' % os.path.basename(self.frames[1]))
+        self.assertTrue(self.is_current())
+
+    def test_background_replaced(self):
+        write(self.bg_path, 'new watermark')
+        self.assertFalse(self.is_current())
+        self.build()
+        self.assertTrue(self.is_current())
+
+    def test_background_in_content_key(self):
+        instance = self.card()
+        manifest = Manifest(self.output_path)
+        content_key = manifest.content_key(instance, manifest.inputs(instance))
+        write(self.bg_path, 'new watermark')
+        self.assertNotEqual(Manifest(self.output_path).content_key(instance, manifest.inputs(instance)), content_key)
+
+    def test_output_removed(self):
+        os.remove(self.card().output_files(self.output_path)['animated'][0])
+        self.assertFalse(self.is_current())
+
+    def test_config_changed(self):
+        self.config['gif_dither'] = 'ordered'
+        self.assertFalse(self.is_current())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import signal
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+from CardConvert import util
+from CardConvert.exceptions import MakeStaticCopiesError, TaskLostError
+from CardConvert.scheduler import TaskScheduler, WorkerPool
+
+
+class FakeCard(object):
+    """ Stands for a card instance whose tasks are picked by its name: FAILED raises in its first task, KILLED dies
+    in it, UNPICKLABLE returns a result the pool can't send back, the others just run.
+    """
+    def __init__(self, config, name, locale='enGB', info=None):
+        self.name = name
+        self.locale = locale
+        self.info = info or {'static': '%s.png' % name, 'animated': []}
+        self.scratch_dir = self.info.get('scratch')
+
+    def input_files(self):
+        return self.info['static'], self.info['animated']
+
+    def task_graph(self, output_dir):
+        return [('first', None, []), ('second', None, ['first']), ('third', None, ['second']),
+                ('other', None, [])]
+
+    def run_task(self, task, output_dir):
+        if task == 'first' and self.name == 'FAILED':
+            raise MakeStaticCopiesError('convert', 1, '', 'corrupt image')
+        if task == 'first' and self.name == 'KILLED':
+            os.kill(os.getpid(), signal.SIGKILL)
+        if task == 'first' and self.name == 'UNPICKLABLE':
+            return lambda: task
+        return task
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.output_path = tempfile.mkdtemp()
+        self.workers = WorkerPool(util.load_config(), processes=2)
+        signal.signal(signal.SIGALRM, self.hung)
+        signal.alarm(60)
+
+    def tearDown(self):
+        signal.alarm(0)
+        self.workers.terminate()
+        shutil.rmtree(self.output_path)
+
+    def hung(self, signum, frame):
+        raise self.failureException('the scheduler is still waiting on a lost task')
+
+    def run_cards(self, names):
+        failed = []
+        done = []
+        scheduler = TaskScheduler(self.workers.pool, self.output_path, slots=4, started=self.workers.started,
+                                  on_failed=lambda instance, task, error: failed.append((instance.name, task, error)),
+                                  on_done=lambda instance, task: done.append((instance.name, task)))
+        output = scheduler.run([FakeCard(None, name) for name in names])
+        return output, failed, done
+
+    def assertFailed(self, name, names, error_type):
+        output, failed, done = self.run_cards(names)
+        self.assertEqual(sorted(output), sorted(['Failed processing %s:enGB' % name] +
+                                                ['Finished processing %s:enGB' % other for other in names
+                                                 if other != name]))
+        self.assertEqual([(card, task) for card, task, error in failed], [(name, 'first')])
+        self.assertIsInstance(failed[0][2], error_type)
+        # the tasks depending on the failed one are dropped, the others of the card still run
+        self.assertEqual(sorted([task for card, task in done if card == name]), ['other'])
+        for other in names:
+            if other != name:
+                self.assertEqual(sorted([task for card, task in done if card == other]),
+                                 ['first', 'other', 'second', 'third'])
+
+
+class FailedTaskTest(SchedulerTest):
+    def test_failed_task(self):
+        self.assertFailed('FAILED', ['CARD_A', 'FAILED', 'CARD_B'], MakeStaticCopiesError)
+
+    def test_failed_task_raises_without_on_failed(self):
+        scheduler = TaskScheduler(self.workers.pool, self.output_path, slots=4, started=self.workers.started)
+        self.assertRaises(MakeStaticCopiesError, scheduler.run, [FakeCard(None, 'FAILED')])
+
+
+class LostTaskTest(SchedulerTest):
+
+    def test_killed_worker(self):
+        self.assertFailed('KILLED', ['KILLED', 'CARD_A', 'CARD_B'], TaskLostError)
+
+    def test_unpicklable_result(self):
+        self.assertFailed('UNPICKLABLE', ['UNPICKLABLE', 'CARD_A'], TaskLostError)
+
+
+if __name__ == '__main__':
+    unittest.main()
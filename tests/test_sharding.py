@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+from CardConvert import sharding
+from CardConvert.costs import CostModel, COSTS_NAME
+from CardConvert.journal import FAILURES_NAME
+from CardConvert.manifest import Manifest, MANIFEST_NAME
+
+
+class FakeCard(object):
+    """ Stands for a card instance, with no outputs.
+    """
+    card_class = 'cards'
+    locale = 'enGB'
+
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+
+    def fingerprint(self):
+        return self.version
+
+    def output_files(self, output_dir):
+        return {}
+
+    def task_output_type(self, task):
+        return None
+
+
+def inputs(version):
+    return {'static': {'path': 'static.png', 'size': 1, 'mtime': 1, 'sha1': version}, 'frames': [], 'assets': []}
+
+
+def task_record(name, wall):
+    return {'kind': 'task', 'failed': False, 'card_class': 'cards', 'locale': 'enGB', 'name': name, 'task': 'copy',
+            'wall': wall}
+
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.output_path = tempfile.mkdtemp()
+        self.shards = [sharding.Shard(index, 2) for index in range(2)]
+        # the tree as the last run left it
+        manifest = Manifest(self.output_path)
+        costs = CostModel(self.output_path)
+        for name in ('CARD_A', 'CARD_B'):
+            manifest.update(FakeCard(name, 'old'), inputs('old'))
+            costs.update([task_record(name, 1.0)])
+        manifest.save()
+        costs.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_path)
+
+    def items(self):
+        with open(os.path.join(self.output_path, MANIFEST_NAME)) as handle:
+            return json.load(handle)['items']
+
+    def test_nodes_keep_the_cards_they_updated(self):
+        # each node rebuilds one card, the first node's card would be replaced by the stale copy of the second node
+        for shard, name in zip(self.shards, ('CARD_A', 'CARD_B')):
+            manifest = Manifest(self.output_path, name=shard.state_name(MANIFEST_NAME))
+            manifest.update(FakeCard(name, 'new'), inputs('new'))
+            manifest.save()
+            costs = CostModel(self.output_path, name=shard.state_name(COSTS_NAME))
+            costs.update([task_record(name, 3.0)])
+            costs.save()
+        sharding.merge(self.output_path)
+        items = self.items()
+        self.assertEqual(sorted(items), ['cards/enGB/CARD_A', 'cards/enGB/CARD_B'])
+        for key in items:
+            self.assertEqual(items[key]['fingerprint'], 'new')
+        costs = CostModel(self.output_path)
+        for name in ('CARD_A', 'CARD_B'):
+            self.assertEqual(costs.predict(FakeCard(name, 'new'), 'copy', {}), 2.0)
+        self.assertEqual(sorted(os.listdir(self.output_path)), sorted([COSTS_NAME, MANIFEST_NAME]))
+
+    def test_resumed_node_keeps_its_earlier_cards(self):
+        shard = self.shards[0]
+        manifest = Manifest(self.output_path, name=shard.state_name(MANIFEST_NAME))
+        manifest.update(FakeCard('CARD_A', 'new'), inputs('new'))
+        manifest.save()
+        # the node is run again before the merge, eg: with --resume
+        Manifest(self.output_path, name=shard.state_name(MANIFEST_NAME)).save()
+        sharding.merge(self.output_path)
+        items = self.items()
+        self.assertEqual(items['cards/enGB/CARD_A']['fingerprint'], 'new')
+        self.assertEqual(items['cards/enGB/CARD_B']['fingerprint'], 'old')
+
+    def test_other_files_left_alone(self):
+        failures_path = os.path.join(self.output_path, FAILURES_NAME)
+        report = os.path.join(self.output_path, 'report.json')
+        others = [sharding.node_name(failures_path, 'backup').replace(sharding.NODE_PREFIX, ''),
+                  os.path.join(self.output_path, 'report.summary.json')]
+        for path in others:
+            with open(path, 'w') as handle:
+                json.dump({'failures': [{'name': 'OLD'}], 'records': [{'name': 'OLD'}]}, handle)
+        node_failures = self.shards[1].state_path(failures_path)
+        with open(node_failures, 'w') as handle:
+            json.dump({'failures': [{'name': 'CARD_B'}]}, handle)
+        with open(self.shards[0].state_path(report), 'w') as handle:
+            json.dump({'records': []}, handle)
+        sharding.merge(self.output_path, report=report)
+        with open(failures_path) as handle:
+            self.assertEqual(json.load(handle)['failures'], [{'name': 'CARD_B'}])
+        for path in others:
+            self.assertTrue(os.path.isfile(path))
+        self.assertFalse(os.path.exists(node_failures))
+        self.assertTrue(os.path.isfile(report))
+
+    def test_invalid_node_name(self):
+        self.assertRaises(ValueError, sharding.Shard, node='../other')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+from CardConvert import util
+from CardConvert.exceptions import CardConvertError
+from CardConvert.journal import FAILURES_NAME
+
+
+class FakeWorkers(object):
+    """ Stands for a scheduler.WorkerPool, the fake scheduler doesn't use the pool.
+    """
+    processes = 1
+    pool = None
+    started = None
+
+
+def fake_scheduler(fail):
+    """
+    Function to make a scheduler running the cards one at a time as the crawl hands them over: the cards in fail
+    fail on their first task before the next card is crawled, the others finish.
+    Args:
+        fail (set): names of the cards to fail
+    Returns:
+        class: stands for scheduler.TaskScheduler
+    """
+    class FakeScheduler(object):
+        def __init__(self, pool, output_dir, slots, on_finished=None, on_started=None, on_failed=None,
+                     on_settled=None, **kwargs):
+            self.on_finished = on_finished
+            self.on_started = on_started
+            self.on_failed = on_failed
+            self.on_settled = on_settled
+
+        def run(self, instances):
+            output = []
+            for instance in instances:
+                self.on_started(instance)
+                if instance.name in fail:
+                    self.on_failed(instance, 'composite', CardConvertError('convert', 1, '', 'corrupt frame'))
+                    self.on_settled(instance)
+                    output.append('Failed processing %s:%s' % (instance.name, instance.locale))
+                else:
+                    self.on_settled(instance)
+                    self.on_finished(instance)
+                    output.append('Finished processing %s:%s' % (instance.name, instance.locale))
+            return output
+
+    return FakeScheduler
+
+
+class ExecutePoolDuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.root, 'in')
+        self.output_path = os.path.join(self.root, 'out')
+        self.config = util.load_config()
+        self.config['asset_cache_dir'] = None
+        self.config['scratch_dir'] = self.root
+        self.config['locale'] = ['enGB', 'frFR']
+        self.unity_folder = self.config['card_types']['cards']['unity_folder']
+        self.scheduler = util.TaskScheduler
+        # the same art in both locales, the card of the second locale crawled is linked to the first
+        for locale in self.config['locale']:
+            folder = os.path.join(self.input_path, self.unity_folder, locale)
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'CARD_0000.png'), 'wb') as handle:
+                handle.write('same art')
+
+    def tearDown(self):
+        util.TaskScheduler = self.scheduler
+        shutil.rmtree(self.root)
+
+    def run_pool(self, fail):
+        util.TaskScheduler = fake_scheduler(fail)
+        events = []
+        output = util.execute_pool(['cards'], self.config, self.input_path, self.output_path, workers=FakeWorkers(),
+                                   progress=events.append)
+        return output, events
+
+    def test_duplicate_crawled_after_its_primary_failed(self):
+        output, events = self.run_pool(fail=set(['CARD_0000']))
+        self.assertEqual(len([line for line in output if line.startswith('Failed processing')]), 1)
+        self.assertEqual(len([event for event in events if event['event'] == 'failed']), 2)
+        with open(os.path.join(self.output_path, FAILURES_NAME)) as handle:
+            failures = json.load(handle)['failures']
+        self.assertEqual(len(failures), 2)
+        primary, duplicate = failures
+        self.assertNotIn('duplicate_of', primary)
+        self.assertEqual(duplicate['duplicate_of'], 'cards/%s/CARD_0000' % primary['locale'])
+        self.assertNotEqual(duplicate['locale'], primary['locale'])
+        self.assertEqual(duplicate['task'], 'composite')
+
+    def test_duplicate_crawled_after_its_primary_finished(self):
+        output, events = self.run_pool(fail=set())
+        self.assertEqual(len([line for line in output if line.startswith('Linked')]), 1)
+        self.assertFalse(os.path.isfile(os.path.join(self.output_path, FAILURES_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()